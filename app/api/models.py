@@ -1,7 +1,20 @@
+from datetime import datetime
 from pydantic import BaseModel, Field
-from typing import List
+from typing import List, Optional
 from fastapi import UploadFile
 
+from app.services.collection import NAME_PATTERN
+
+
+class SearchFilter(BaseModel):
+    """检索过滤条件，多个条件需同时满足"""
+
+    file_ids: Optional[List[int]] = Field(None, description="只检索这些文件")
+    user_ids: Optional[List[str]] = Field(None, description="只检索这些用户/租户上传的文件")
+    tags: Optional[List[str]] = Field(None, description="只检索带有任一标签的文件")
+    uploaded_after: Optional[datetime] = Field(None, description="上传时间不早于")
+    uploaded_before: Optional[datetime] = Field(None, description="上传时间早于")
+
 
 class Question(BaseModel):
     """用户提问的模型类"""
@@ -9,6 +22,24 @@ class Question(BaseModel):
     text: str = Field(..., description="问题内容")
     session_id: str = Field(..., description="会话ID")
     user_id: str = Field(..., description="用户ID")
+    k: Optional[int] = Field(None, ge=1, le=50, description="检索的文本块数量")
+    nprobe: Optional[int] = Field(
+        None, ge=1, description="IVF 索引检索的聚类数，越大召回率越高、越慢"
+    )
+    ef_search: Optional[int] = Field(
+        None, ge=1, description="HNSW 索引检索的候选队列长度，越大召回率越高、越慢"
+    )
+    vector_weight: Optional[float] = Field(
+        None, ge=0, description="混合检索中向量检索结果的权重，0 表示只用关键词检索"
+    )
+    bm25_weight: Optional[float] = Field(
+        None, ge=0, description="混合检索中 BM25 关键词检索结果的权重，0 表示只用向量检索"
+    )
+    rerank: Optional[bool] = Field(None, description="是否对检索结果重排序，默认按配置")
+    filters: Optional[SearchFilter] = Field(None, description="检索过滤条件")
+    collection: Optional[str] = Field(
+        None, pattern=NAME_PATTERN, description="检索的知识库，默认知识库为空"
+    )
 
 
 class Answer(BaseModel):
@@ -22,6 +53,25 @@ class DeleteDocumentsRequest(BaseModel):
     """删除文档请求的模型类"""
 
     doc_ids: List[str] = Field(..., description="要删除的文件ID列表")
+    collection: Optional[str] = Field(
+        None, pattern=NAME_PATTERN, description="文件所属知识库，默认知识库为空"
+    )
+
+
+class CollectionSettings(BaseModel):
+    """知识库配置，未设置的项沿用全局配置，设为 null 时恢复为全局配置"""
+
+    FAISS_INDEX_FACTORY: Optional[str] = Field(None, description="索引类型")
+    FAISS_RESCORE_FACTOR: Optional[int] = Field(
+        None, ge=0, description="有损压缩索引精确重排的候选倍数"
+    )
+    RETRIEVER_K: Optional[int] = Field(None, ge=1, le=50, description="检索的文本块数量")
+    HYBRID_SEARCH_ENABLED: Optional[bool] = Field(None, description="是否启用混合检索")
+    HYBRID_VECTOR_WEIGHT: Optional[float] = Field(None, ge=0, description="向量检索权重")
+    HYBRID_BM25_WEIGHT: Optional[float] = Field(None, ge=0, description="BM25 检索权重")
+    HYBRID_FETCH_K: Optional[int] = Field(None, ge=1, description="每路检索的候选数量")
+    RERANK_ENABLED: Optional[bool] = Field(None, description="是否重排序")
+    RERANK_FETCH_K: Optional[int] = Field(None, ge=1, description="重排序的候选数量")
 
 
 class UploadFilesRequest(BaseModel):
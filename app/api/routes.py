@@ -1,18 +1,27 @@
-from fastapi import APIRouter, UploadFile, File, Query, Depends, Body
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, UploadFile, File, Form, Query, Depends, Body, Path
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.api.models import (
     Question,
     DeleteDocumentsRequest,
+    CollectionSettings,
 )
 from app.db.database import get_db
 from app.services.backend.index import (
     rebuild_database,
+    rebuild_jobs,
+    rebuild_job_status,
+    cancel_rebuild_job,
     upload_file,
     study_documents,
+    index_report,
+    compression_report,
     delete_documents,
     file_list,
+    collection_list,
+    update_collection,
 )
+from app.services.collection import NAME_PATTERN
 from app.services.chat.index import query_stream, get_chat_history, get_session
 from app.api.response import success_response, error_response
 
@@ -25,9 +34,43 @@ router = APIRouter()
 
 
 @router.post("/rebuild-db", summary="重建数据库", tags=["后台管理"])
-async def rebuild_db(db: Session = Depends(get_db)):
+async def rebuild_db(
+    collection: str = Query(None, pattern=NAME_PATTERN, description="知识库名称"),
+    db: AsyncSession = Depends(get_db),
+):
+    try:
+        result = await rebuild_database(db, collection)
+        return success_response(data=result)
+    except Exception as e:
+        return error_response(message=str(e))
+
+
+@router.get("/rebuild-db/jobs", summary="重建任务列表", tags=["后台管理"])
+async def rebuild_jobs_handler():
     try:
-        result = await rebuild_database(db)
+        result = await rebuild_jobs()
+        return success_response(data=result)
+    except Exception as e:
+        return error_response(message=str(e))
+
+
+@router.get("/rebuild-db/jobs/{job_id}", summary="重建任务进度", tags=["后台管理"])
+async def rebuild_job_status_handler(
+    job_id: str = Path(..., description="重建任务ID")
+):
+    try:
+        result = await rebuild_job_status(job_id)
+        return success_response(data=result)
+    except Exception as e:
+        return error_response(message=str(e))
+
+
+@router.post("/rebuild-db/jobs/{job_id}/cancel", summary="取消重建任务", tags=["后台管理"])
+async def cancel_rebuild_job_handler(
+    job_id: str = Path(..., description="重建任务ID")
+):
+    try:
+        result = await cancel_rebuild_job(job_id)
         return success_response(data=result)
     except Exception as e:
         return error_response(message=str(e))
@@ -36,33 +79,91 @@ async def rebuild_db(db: Session = Depends(get_db)):
 @router.post("/upload", summary="上传文件", tags=["后台管理"])
 async def upload_file_handler(
     files: list[UploadFile] = File(..., description="文档文件列表"),
-    db: Session = Depends(get_db),
+    user_id: str = Form(None, description="上传者/所属租户ID"),
+    tags: str = Form(None, description="文件标签，多个以逗号分隔"),
+    collection: str = Form(None, pattern=NAME_PATTERN, description="所属知识库名称"),
+    db: AsyncSession = Depends(get_db),
 ):
     try:
-        result = await upload_file(files, db)
+        result = await upload_file(files, db, user_id, tags, collection)
         return success_response(data=result)
     except Exception as e:
         return error_response(message=str(e))
 
 
 @router.get("/study-documents", summary="模型学习文档", tags=["后台管理"])
-async def study_documents_handler():
+async def study_documents_handler(
+    collection: str = Query(None, pattern=NAME_PATTERN, description="知识库名称"),
+):
+    try:
+        result = await study_documents(collection)
+        return success_response(data=result)
+    except Exception as e:
+        return error_response(message=str(e))
+
+
+@router.get("/index-report", summary="向量索引召回率评估", tags=["后台管理"])
+async def index_report_handler(
+    k: int = Query(10, ge=1, le=100, description="评估的近邻数量"),
+    queries: int = Query(100, ge=1, le=10000, description="评估使用的查询数量"),
+    collection: str = Query(None, pattern=NAME_PATTERN, description="知识库名称"),
+):
     try:
-        result = await study_documents()
+        result = await index_report(k, queries, collection)
+        return success_response(data=result)
+    except Exception as e:
+        return error_response(message=str(e))
+
+
+@router.get("/index-report/compression", summary="向量压缩方式对比", tags=["后台管理"])
+async def compression_report_handler(
+    k: int = Query(10, ge=1, le=100, description="评估的近邻数量"),
+    queries: int = Query(100, ge=1, le=10000, description="评估使用的查询数量"),
+    modes: list[str] = Query(
+        None, description="要比较的索引工厂字符串，可重复传入，如 SQ8、PCA256,SQ8，默认比较常用方式"
+    ),
+    collection: str = Query(None, pattern=NAME_PATTERN, description="知识库名称"),
+):
+    try:
+        result = await compression_report(k, queries, modes, collection)
         return success_response(data=result)
     except Exception as e:
         return error_response(message=str(e))
 
 
 @router.get("/file-list", summary="文件列表", tags=["后台管理"])
-async def file_list_handler(db: Session = Depends(get_db)):
+async def file_list_handler(
+    collection: str = Query(None, pattern=NAME_PATTERN, description="知识库名称"),
+    db: AsyncSession = Depends(get_db),
+):
     try:
-        result = await file_list(db)
+        result = await file_list(db, collection)
         return success_response(data=result)
     except Exception as e:
         return error_response(message=e)
 
 
+@router.get("/collections", summary="知识库列表", tags=["后台管理"])
+async def collection_list_handler():
+    try:
+        result = await collection_list()
+        return success_response(data=result)
+    except Exception as e:
+        return error_response(message=str(e))
+
+
+@router.put("/collections/{name}", summary="创建知识库或修改知识库配置", tags=["后台管理"])
+async def update_collection_handler(
+    name: str = Path(..., pattern=NAME_PATTERN, description="知识库名称"),
+    request: CollectionSettings = Body(..., description="知识库配置"),
+):
+    try:
+        result = await update_collection(name, request)
+        return success_response(data=result)
+    except Exception as e:
+        return error_response(message=str(e))
+
+
 @router.post("/delete-documents", summary="模型删除文档", tags=["后台管理"])
 async def delete_documents_handler(
     request: DeleteDocumentsRequest = Body(..., description="要删除的文档信息")
@@ -82,7 +183,7 @@ async def delete_documents_handler(
 @router.post("/query/stream", summary="模型问答", tags=["前台页面"])
 async def query_stream_handler(
     question: Question = Body(..., description="用户提问内容"),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     return await query_stream(question, db)
 
@@ -91,7 +192,7 @@ async def query_stream_handler(
 async def get_chat_history_handler(
     session_id: str = Query(..., description="会话ID"),
     user_id: str = Query(..., description="用户ID"),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     try:
         result = await get_chat_history(session_id, user_id, db)
@@ -102,7 +203,7 @@ async def get_chat_history_handler(
 
 @router.get("/get-session", summary="获取会话", tags=["前台页面"])
 async def get_session_handler(
-    user_id: str = Query(..., description="用户ID"), db: Session = Depends(get_db)
+    user_id: str = Query(..., description="用户ID"), db: AsyncSession = Depends(get_db)
 ):
     try:
         result = await get_session(user_id, db)
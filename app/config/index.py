@@ -11,16 +11,177 @@ class Settings(BaseSettings):
     OPENAI_API_BASE: str = os.getenv("OPENAI_API_BASE", "")
     OPENAI_MODEL: str = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
     MAX_TOKENS: int = 1024
+    EMBEDDING_MODEL: str = os.getenv("EMBEDDING_MODEL", "text-embedding-ada-002")
 
     # 文件路径配置
     BOOKS_DIR: str = "./books"
     READ_BOOKS_DIR: str = "./ReadBooks"
     FAISS_INDEX_PATH: str = "faiss_index"
     VECTOR_DB_PATH: str = "faiss_index"
+    # 向量库版本目录保留数量，以及其他进程热更新时检查索引变化的间隔(秒)
+    VECTOR_STORE_KEEP_VERSIONS: int = int(os.getenv("VECTOR_STORE_KEEP_VERSIONS", "2"))
+    VECTOR_STORE_CHECK_INTERVAL: float = float(
+        os.getenv("VECTOR_STORE_CHECK_INTERVAL", "1.0")
+    )
+    # 问答进程以内存映射方式只读加载 FAISS 索引
+    VECTOR_STORE_MMAP: bool = os.getenv("VECTOR_STORE_MMAP", "True").lower() == "true"
+    # 已加载知识库的索引总大小上限(MB)，超出时按最近最少使用淘汰，0 表示不限制
+    VECTOR_STORE_MEMORY_BUDGET: int = int(os.getenv("VECTOR_STORE_MEMORY_BUDGET", "0"))
 
-    # 文本分割配置
-    CHUNK_SIZE: int = 500
-    CHUNK_OVERLAP: int = 50
+    # 索引类型：faiss.index_factory 描述，如 Flat、HNSW32、IVF{nlist},Flat、OPQ16,IVF{nlist},PQ16，
+    # 压缩存储如 SQfp16、SQ8、PQ96、PCA256,SQ8；{nlist} 按向量数量自动计算，
+    # Trunc{dim} 前缀按 Matryoshka 方式只保留前 dim 维
+    FAISS_INDEX_FACTORY: str = os.getenv("FAISS_INDEX_FACTORY", "Flat")
+    # 训练样本上限、数据量增长超过该倍数时重新训练
+    FAISS_TRAIN_SAMPLE: int = int(os.getenv("FAISS_TRAIN_SAMPLE", "100000"))
+    FAISS_RETRAIN_GROWTH: float = float(os.getenv("FAISS_RETRAIN_GROWTH", "2.0"))
+    # 默认检索参数：IVF 检索的聚类数、HNSW 检索/构建的候选队列长度
+    FAISS_NPROBE: int = int(os.getenv("FAISS_NPROBE", "16"))
+    FAISS_EF_SEARCH: int = int(os.getenv("FAISS_EF_SEARCH", "64"))
+    FAISS_HNSW_EF_CONSTRUCTION: int = int(os.getenv("FAISS_HNSW_EF_CONSTRUCTION", "40"))
+    # 有损压缩索引多取的候选倍数，用磁盘上的原始向量精确重排，0 或 1 表示不重排
+    FAISS_RESCORE_FACTOR: int = int(os.getenv("FAISS_RESCORE_FACTOR", "4"))
+    # 每次问答检索的文本块数量
+    RETRIEVER_K: int = int(os.getenv("RETRIEVER_K", "3"))
+    # 混合检索：BM25 关键词检索与向量检索各取 HYBRID_FETCH_K 个候选，按加权 RRF 融合
+    HYBRID_SEARCH_ENABLED: bool = (
+        os.getenv("HYBRID_SEARCH_ENABLED", "True").lower() == "true"
+    )
+    HYBRID_VECTOR_WEIGHT: float = float(os.getenv("HYBRID_VECTOR_WEIGHT", "1.0"))
+    HYBRID_BM25_WEIGHT: float = float(os.getenv("HYBRID_BM25_WEIGHT", "1.0"))
+    HYBRID_FETCH_K: int = int(os.getenv("HYBRID_FETCH_K", "20"))
+    HYBRID_RRF_K: int = int(os.getenv("HYBRID_RRF_K", "60"))
+
+    # 重排序：多取 RERANK_FETCH_K 个候选重新打分，只把前 k 个交给 LLM
+    RERANK_ENABLED: bool = os.getenv("RERANK_ENABLED", "False").lower() == "true"
+    RERANK_FETCH_K: int = int(os.getenv("RERANK_FETCH_K", "20"))
+    # ONNX 交叉编码器目录 (model.onnx + tokenizer.json)，为空时使用关键词 MMR 打分
+    RERANK_MODEL_PATH: str = os.getenv("RERANK_MODEL_PATH", "")
+    RERANK_BATCH_SIZE: int = int(os.getenv("RERANK_BATCH_SIZE", "8"))
+    RERANK_MAX_LENGTH: int = int(os.getenv("RERANK_MAX_LENGTH", "512"))
+    RERANK_THREADS: int = int(os.getenv("RERANK_THREADS", "2"))
+    # 单次重排序的时间预算(秒)，超时后剩余候选保持检索顺序
+    RERANK_TIMEOUT: float = float(os.getenv("RERANK_TIMEOUT", "0.3"))
+    # MMR 中相关度的权重，越小越偏向去重
+    RERANK_MMR_LAMBDA: float = float(os.getenv("RERANK_MMR_LAMBDA", "0.7"))
+
+    # 向量缓存配置
+    EMBEDDING_CACHE_ENABLED: bool = (
+        os.getenv("EMBEDDING_CACHE_ENABLED", "True").lower() == "true"
+    )
+    EMBEDDING_CACHE_PATH: str = os.getenv(
+        "EMBEDDING_CACHE_PATH", "embedding_cache/embeddings.sqlite3"
+    )
+    EMBEDDING_CACHE_MAX_ENTRIES: int = int(
+        os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "500000")
+    )
+
+    # 向量化流水线配置：每批文本块数量、最大并发请求数、单批最大重试次数
+    EMBEDDING_BATCH_SIZE: int = int(os.getenv("EMBEDDING_BATCH_SIZE", "128"))
+    EMBEDDING_CONCURRENCY: int = int(os.getenv("EMBEDDING_CONCURRENCY", "4"))
+    EMBEDDING_MAX_RETRIES: int = int(os.getenv("EMBEDDING_MAX_RETRIES", "6"))
+
+    # 查询向量配置：内存 LRU 缓存条目数、合并并发查询的等待时间(毫秒)、单批最大查询数
+    QUERY_EMBEDDING_CACHE_SIZE: int = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "10000"))
+    QUERY_EMBEDDING_BATCH_WINDOW: float = float(
+        os.getenv("QUERY_EMBEDDING_BATCH_WINDOW", "5")
+    )
+    QUERY_EMBEDDING_BATCH_SIZE: int = int(os.getenv("QUERY_EMBEDDING_BATCH_SIZE", "64"))
+
+    # 向量模型提供方：openai 调用 EMBEDDING_MODEL 接口，local 在本机 CPU 上运行 ONNX 模型
+    EMBEDDING_PROVIDER: str = os.getenv("EMBEDDING_PROVIDER", "openai").lower()
+    # 本地模型目录，需包含 model.onnx 和 tokenizer.json
+    LOCAL_EMBEDDING_MODEL_PATH: str = os.getenv("LOCAL_EMBEDDING_MODEL_PATH", "")
+    LOCAL_EMBEDDING_MAX_LENGTH: int = int(os.getenv("LOCAL_EMBEDDING_MAX_LENGTH", "512"))
+    LOCAL_EMBEDDING_BATCH_SIZE: int = int(os.getenv("LOCAL_EMBEDDING_BATCH_SIZE", "32"))
+    # 当前进程推理线程数，以及批量入库使用的进程数(0 表示在当前进程中计算)
+    LOCAL_EMBEDDING_THREADS: int = int(os.getenv("LOCAL_EMBEDDING_THREADS", "2"))
+    LOCAL_EMBEDDING_WORKERS: int = int(os.getenv("LOCAL_EMBEDDING_WORKERS", "0"))
+    # 池化方式 mean/cls，以及查询文本的前缀 (如 bge 的检索指令)
+    LOCAL_EMBEDDING_POOLING: str = os.getenv("LOCAL_EMBEDDING_POOLING", "mean").lower()
+    LOCAL_EMBEDDING_QUERY_PREFIX: str = os.getenv("LOCAL_EMBEDDING_QUERY_PREFIX", "")
+
+    # 文档加载配置：并发下载线程数、解析进程数(0 表示 CPU 核数)
+    LOADER_DOWNLOAD_WORKERS: int = int(os.getenv("LOADER_DOWNLOAD_WORKERS", "8"))
+    LOADER_PARSE_WORKERS: int = int(os.getenv("LOADER_PARSE_WORKERS", "0"))
+    # 超过该大小(字节)的对象转存到临时文件，否则直接在内存中解析
+    LOADER_SPILL_THRESHOLD: int = int(
+        os.getenv("LOADER_SPILL_THRESHOLD", str(64 * 1024 * 1024))
+    )
+    # 落盘的大文件分批解析，每批解析的字符数
+    LOADER_BATCH_CHARS: int = int(os.getenv("LOADER_BATCH_CHARS", "4000000"))
+    # 同时下载、解析和等待向量化的文件数，向量化跟不上时不再加载新文件
+    LOADER_PREFETCH_FILES: int = int(os.getenv("LOADER_PREFETCH_FILES", "8"))
+
+    # 后台重建任务配置：内存中保留的任务数、Redis 中任务状态的过期时间(秒)、进度同步间隔(秒)
+    INGESTION_JOB_HISTORY: int = int(os.getenv("INGESTION_JOB_HISTORY", "50"))
+    INGESTION_JOB_TTL: int = int(os.getenv("INGESTION_JOB_TTL", "86400"))
+    INGESTION_PUBLISH_INTERVAL: float = float(
+        os.getenv("INGESTION_PUBLISH_INTERVAL", "1.0")
+    )
+    # 知识库重建锁的过期时间(秒)，执行期间定期续期，进程异常退出后自动释放
+    INGESTION_LOCK_TTL: int = int(os.getenv("INGESTION_LOCK_TTL", "60"))
+
+    # 会话记录写入配置：是否异步批量写入(write-behind)、每批最大条数、攒批等待时间(秒)、队列容量
+    CHAT_HISTORY_WRITE_BEHIND: bool = (
+        os.getenv("CHAT_HISTORY_WRITE_BEHIND", "False").lower() == "true"
+    )
+    CHAT_HISTORY_BATCH_SIZE: int = int(os.getenv("CHAT_HISTORY_BATCH_SIZE", "100"))
+    CHAT_HISTORY_FLUSH_INTERVAL: float = float(
+        os.getenv("CHAT_HISTORY_FLUSH_INTERVAL", "0.2")
+    )
+    CHAT_HISTORY_QUEUE_SIZE: int = int(os.getenv("CHAT_HISTORY_QUEUE_SIZE", "10000"))
+
+    # 会话记忆配置：加载的最近轮次数、历史记录的 token 预算
+    MEMORY_MAX_TURNS: int = int(os.getenv("MEMORY_MAX_TURNS", "6"))
+    MEMORY_MAX_TOKENS: int = int(os.getenv("MEMORY_MAX_TOKENS", "1500"))
+    # 滚动摘要：是否开启、单次合并的最大轮次数、摘要的最大 token 数
+    MEMORY_SUMMARY_ENABLED: bool = (
+        os.getenv("MEMORY_SUMMARY_ENABLED", "False").lower() == "true"
+    )
+    MEMORY_SUMMARY_BATCH_TURNS: int = int(os.getenv("MEMORY_SUMMARY_BATCH_TURNS", "20"))
+    MEMORY_SUMMARY_MAX_TOKENS: int = int(os.getenv("MEMORY_SUMMARY_MAX_TOKENS", "512"))
+
+    # 语义答案缓存：是否开启、命中所需的余弦相似度、最大条目数、过期时间(秒)、是否只缓存会话第一轮提问
+    SEMANTIC_CACHE_ENABLED: bool = (
+        os.getenv("SEMANTIC_CACHE_ENABLED", "False").lower() == "true"
+    )
+    SEMANTIC_CACHE_THRESHOLD: float = float(
+        os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95")
+    )
+    SEMANTIC_CACHE_MAX_ENTRIES: int = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "2000"))
+    SEMANTIC_CACHE_TTL: int = int(os.getenv("SEMANTIC_CACHE_TTL", "3600"))
+    SEMANTIC_CACHE_FIRST_TURN_ONLY: bool = (
+        os.getenv("SEMANTIC_CACHE_FIRST_TURN_ONLY", "True").lower() == "true"
+    )
+
+    # 文本分割配置：切分方式 layout(按版面和 token 数)/recursive(按字符数)
+    CHUNK_STRATEGY: str = os.getenv("CHUNK_STRATEGY", "layout").lower()
+    # layout：文本块的 token 上限、切开段落时的重叠 token 数、短于该长度的内容与后续合并
+    CHUNK_TOKENS: int = int(os.getenv("CHUNK_TOKENS", "400"))
+    CHUNK_OVERLAP_TOKENS: int = int(os.getenv("CHUNK_OVERLAP_TOKENS", "40"))
+    CHUNK_MIN_TOKENS: int = int(os.getenv("CHUNK_MIN_TOKENS", "80"))
+    # 计算 token 使用的 tiktoken 编码，离线时需设置 TIKTOKEN_CACHE_DIR，否则按字符数估算
+    CHUNK_TOKEN_ENCODING: str = os.getenv("CHUNK_TOKEN_ENCODING", "cl100k_base")
+    CHUNK_DETECT_TABLES: bool = (
+        os.getenv("CHUNK_DETECT_TABLES", "True").lower() == "true"
+    )
+    # recursive：文本块的字符数上限和重叠字符数
+    CHUNK_SIZE: int = int(os.getenv("CHUNK_SIZE", "500"))
+    CHUNK_OVERLAP: int = int(os.getenv("CHUNK_OVERLAP", "50"))
+
+    # 文本块去重：是否开启、签名方式 minhash/simhash、判定重复的相似度阈值
+    DEDUP_ENABLED: bool = os.getenv("DEDUP_ENABLED", "False").lower() == "true"
+    DEDUP_METHOD: str = os.getenv("DEDUP_METHOD", "minhash").lower()
+    DEDUP_THRESHOLD: float = float(os.getenv("DEDUP_THRESHOLD", "0.85"))
+    # 字符 n-gram 长度、MinHash 签名长度及 LSH 分段数
+    DEDUP_SHINGLE_SIZE: int = int(os.getenv("DEDUP_SHINGLE_SIZE", "5"))
+    DEDUP_NUM_PERM: int = int(os.getenv("DEDUP_NUM_PERM", "64"))
+    DEDUP_BANDS: int = int(os.getenv("DEDUP_BANDS", "16"))
+    # 文本相似度未达阈值的候选再比较向量余弦相似度，0 表示不比较
+    DEDUP_EMBEDDING_THRESHOLD: float = float(
+        os.getenv("DEDUP_EMBEDDING_THRESHOLD", "0")
+    )
 
     # Redis配置
     REDIS_HOST: str = os.getenv("REDIS_HOST", "localhost")
@@ -28,6 +189,11 @@ class Settings(BaseSettings):
     REDIS_DB: int = int(os.getenv("REDIS_DB", "0"))
     REDIS_PASSWORD: str = os.getenv("REDIS_PASSWORD", "")
     SESSION_TTL: int = int(os.getenv("SESSION_TTL", "3600"))  # 会话过期时间(秒)
+    REDIS_MAX_CONNECTIONS: int = int(os.getenv("REDIS_MAX_CONNECTIONS", "50"))
+    REDIS_SOCKET_TIMEOUT: float = float(os.getenv("REDIS_SOCKET_TIMEOUT", "1.0"))
+    # 会话缓存：是否开启、每个会话缓存的最近轮次数
+    CHAT_CACHE_ENABLED: bool = os.getenv("CHAT_CACHE_ENABLED", "True").lower() == "true"
+    CHAT_CACHE_MAX_TURNS: int = int(os.getenv("CHAT_CACHE_MAX_TURNS", "50"))
 
     # MySQL配置
     DB_HOST: str = os.getenv("DB_HOST", "localhost")
@@ -35,6 +201,12 @@ class Settings(BaseSettings):
     DB_USER: str = os.getenv("DB_USER", "root")
     DB_PASSWORD: str = os.getenv("DB_PASSWORD", "")
     DB_NAME: str = os.getenv("DB_NAME", "docqa")
+    # 连接池配置
+    DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", "10"))
+    DB_MAX_OVERFLOW: int = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+    DB_POOL_TIMEOUT: int = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+    DB_POOL_RECYCLE: int = int(os.getenv("DB_POOL_RECYCLE", "3600"))
+    DB_POOL_PRE_PING: bool = os.getenv("DB_POOL_PRE_PING", "True").lower() == "true"
 
     # MinIO配置
     MINIO_ENDPOINT: str = os.getenv("MINIO_ENDPOINT", "localhost:9000")
@@ -47,5 +219,9 @@ class Settings(BaseSettings):
     def DATABASE_URL(self) -> str:
         return f"mysql+pymysql://{self.DB_USER}:{self.DB_PASSWORD}@{self.DB_HOST}:{self.DB_PORT}/{self.DB_NAME}"
 
+    @property
+    def ASYNC_DATABASE_URL(self) -> str:
+        return f"mysql+aiomysql://{self.DB_USER}:{self.DB_PASSWORD}@{self.DB_HOST}:{self.DB_PORT}/{self.DB_NAME}"
+
 
 settings = Settings()
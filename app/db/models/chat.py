@@ -44,5 +44,13 @@ class files(Base):
     id = Column(Integer, primary_key=True)
     file_name = Column(String(255), nullable=False)
     file_path = Column(Text, nullable=False)
+    # 上传者/所属租户和逗号分隔的标签，写入文本块元数据用于检索过滤
+    user_id = Column(String(64), index=True, nullable=True)
+    tags = Column(String(255), nullable=True)
+    # 所属知识库，为空时属于默认知识库
+    collection = Column(String(64), index=True, nullable=True, default="default")
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=True)
     is_study = Column(Boolean, default=False)
+    # 格式不支持，重建时不再处理
+    is_unsupported = Column(Boolean, default=False)
     is_deleted = Column(Boolean, default=False)
@@ -0,0 +1,194 @@
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from app.config.index import settings
+from app.logging.logging import logger
+from app.services.collection import normalize_name
+
+
+class CachedAnswer:
+    """语义缓存中的一条问答"""
+
+    __slots__ = (
+        "question",
+        "answer",
+        "sources",
+        "collection",
+        "options",
+        "created_at",
+        "score",
+    )
+
+    def __init__(
+        self,
+        question: str,
+        answer: str,
+        sources: list,
+        collection: str,
+        options: Tuple = (),
+    ):
+        self.question = question
+        self.answer = answer
+        self.sources = sources
+        self.collection = collection
+        # 生成答案时的检索参数
+        self.options = options
+        self.created_at = time.monotonic()
+        # 命中时与当前问题的余弦相似度
+        self.score = 0.0
+
+
+class SemanticAnswerCache:
+    """按问题向量匹配的进程内答案缓存
+
+    问题向量归一化后存放在预分配的矩阵中，一次矩阵乘法即可找到最相似的
+    历史问题，相似度不低于 SEMANTIC_CACHE_THRESHOLD 时直接返回缓存的答案和
+    引用，不再调用 LLM。各知识库共用同一个矩阵，每个槽位记录所属知识库和
+    检索参数 (k、权重、重排序、nprobe/ef_search)，查找时只比较知识库和检索
+    参数都相同的条目。缓存与知识库的索引版本绑定，重建或删除
+    文档后清空该知识库的条目；超过 SEMANTIC_CACHE_TTL 的条目视为过期，
+    容量满时淘汰最久未命中的条目。
+    """
+
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(SemanticAnswerCache, cls).__new__(cls)
+            cls._instance._reset()
+        return cls._instance
+
+    def _reset(self):
+        # 知识库名 -> 缓存条目对应的索引版本
+        self.versions = {}
+        # (知识库名, 检索参数) -> 槽位标记用的整数编号
+        self.scope_ids = {}
+        self.max_entries = settings.SEMANTIC_CACHE_MAX_ENTRIES
+        self.matrix = None
+        self.slot_scopes = np.full(self.max_entries, -1, dtype=np.int32)
+        # 槽位 -> CachedAnswer，按最近访问排序
+        self.entries: "OrderedDict[int, CachedAnswer]" = OrderedDict()
+        self.free_slots: List[int] = list(range(self.max_entries - 1, -1, -1))
+        self.hits = 0
+        self.misses = 0
+
+    def _check_version(self, collection: str, version):
+        if version != self.versions.get(collection):
+            stale = [
+                slot
+                for slot, entry in self.entries.items()
+                if entry.collection == collection
+            ]
+            if stale:
+                logger.info(
+                    f"知识库 {collection} 的索引版本变化，清空 {len(stale)} 条语义缓存"
+                )
+            for slot in stale:
+                self._remove(slot)
+            self.versions[collection] = version
+
+    def _scope_id(self, collection: str, options: Tuple) -> int:
+        return self.scope_ids.setdefault((collection, options), len(self.scope_ids))
+
+    @staticmethod
+    def scope_options(options: Optional[dict]) -> Tuple:
+        """检索参数转为可比较的元组，未设置的参数不计入"""
+        return tuple(
+            sorted(
+                (key, value)
+                for key, value in (options or {}).items()
+                if value is not None
+            )
+        )
+
+    @staticmethod
+    def _normalize(vector) -> Optional[np.ndarray]:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if not norm:
+            return None
+        return vector / norm
+
+    def lookup(
+        self, vector, version, collection: str = None, options: dict = None
+    ) -> Optional[CachedAnswer]:
+        """查找知识库中检索参数相同、与问题向量最相似且未过期的缓存答案"""
+        collection = normalize_name(collection)
+        options = self.scope_options(options)
+        self._check_version(collection, version)
+        query = self._normalize(vector)
+        if query is None or not self.entries or query.shape[0] != self.matrix.shape[1]:
+            self.misses += 1
+            return None
+
+        scores = np.where(
+            self.slot_scopes == self._scope_id(collection, options),
+            self.matrix @ query,
+            -1.0,
+        )
+        slot = int(np.argmax(scores))
+        entry = self.entries.get(slot)
+        if entry is None or scores[slot] < settings.SEMANTIC_CACHE_THRESHOLD:
+            self.misses += 1
+            return None
+        if time.monotonic() - entry.created_at > settings.SEMANTIC_CACHE_TTL:
+            self._remove(slot)
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(slot)
+        self.hits += 1
+        entry.score = float(scores[slot])
+        return entry
+
+    def store(
+        self,
+        vector,
+        version,
+        question: str,
+        answer: str,
+        sources: list,
+        collection: str = None,
+        options: dict = None,
+    ):
+        """缓存一次完整生成的答案，生成期间索引版本已变化时丢弃"""
+        collection = normalize_name(collection)
+        options = self.scope_options(options)
+        if version != self.versions.get(collection):
+            return
+        query = self._normalize(vector)
+        if query is None or not answer:
+            return
+        if self.matrix is None:
+            self.matrix = np.zeros((self.max_entries, query.shape[0]), dtype=np.float32)
+        elif query.shape[0] != self.matrix.shape[1]:
+            return
+
+        if not self.free_slots:
+            self._remove(next(iter(self.entries)))
+        slot = self.free_slots.pop()
+        self.matrix[slot] = query
+        self.slot_scopes[slot] = self._scope_id(collection, options)
+        self.entries[slot] = CachedAnswer(
+            question, answer, sources, collection, options
+        )
+
+    def _remove(self, slot: int):
+        self.entries.pop(slot, None)
+        # 清零后该槽位的相似度恒为 0，不会再被命中
+        self.matrix[slot] = 0
+        self.slot_scopes[slot] = -1
+        self.free_slots.append(slot)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "versions": dict(self.versions),
+        }
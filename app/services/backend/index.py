@@ -1,72 +1,117 @@
+import asyncio
 import os
 import logging
-from app.services.vector_store import VectorStore
+from app.services.vector_store import VectorStore, VectorStoreRegistry
+from app.services.collection import Collection, pending_files_filter
 from app.services.files import Files
-from app.api.models import DeleteDocumentsRequest
+from app.services.ingestion_jobs import IngestionJobManager
+from app.api.models import CollectionSettings, DeleteDocumentsRequest
 
-from sqlalchemy.orm import Session
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import HTTPException
 from pathlib import Path
 from fastapi import UploadFile
 from app.db.models.chat import files
 
 
-async def rebuild_database(db):
-    """重建向量数据库"""
+async def rebuild_database(db, collection: str = None):
+    """提交重建知识库向量数据库的后台任务"""
     try:
         # 检查是否有未学习的文件
-        unprocessed_files = (
-            db.query(files)
-            .filter(files.is_study == False, files.is_deleted == False)
-            .count()
+        unprocessed_files = await db.scalar(
+            select(func.count())
+            .select_from(files)
+            .where(pending_files_filter(collection))
         )
 
         if unprocessed_files == 0:
             return {"message": "没有需要学习的文件"}
 
-        await VectorStore.create_vectorstore(db)
-        files_service = Files(db)
-        return await files_service.files_study()
+        job = IngestionJobManager().submit(collection)
+        return {
+            "message": "重建任务已提交",
+            "job_id": job.job_id,
+            "collection": job.collection,
+            "status": job.status,
+        }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-async def upload_file(files: list[UploadFile], db: Session):
+async def rebuild_jobs():
+    """重建任务列表"""
+    return IngestionJobManager().list_jobs()
+
+
+async def rebuild_job_status(job_id: str):
+    """查询重建任务的状态、文件进度和吞吐量"""
+    job = await IngestionJobManager().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"重建任务 {job_id} 不存在")
+    return job
+
+
+async def cancel_rebuild_job(job_id: str):
+    """取消重建任务"""
+    job = await IngestionJobManager().cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"重建任务 {job_id} 不存在")
+    return job
+
+
+async def upload_file(
+    files: list[UploadFile],
+    db: AsyncSession,
+    user_id: str = None,
+    tags: str = None,
+    collection: str = None,
+):
     """上传文档"""
     files_service = Files(db)
-    return await files_service.uploadfile(files)
+    return await files_service.uploadfile(files, user_id, tags, collection)
 
 
-async def study_documents():
+async def study_documents(collection: str = None):
     try:
-        vectorstore = VectorStore.load_vectorstore()
-        if not vectorstore:
+        if VectorStore.get_index_version(collection) is None:
             return {"message": "向量数据库不存在"}
 
-        docstore = vectorstore.docstore
-        # 用于追踪已处理的源文件
-        unique_sources = {}  # source -> [doc_ids]
-        documents = []
-
-        for doc_id, doc in docstore._dict.items():
-            source = doc.metadata.get("source")
-            if source:
-                if source not in unique_sources:
-                    filename = os.path.basename(source)
-                    unique_sources[source] = []
-                unique_sources[source].append(doc_id)
-
-        # 为每个源文件创建一个文档条目，包含其所有片段的ID
-        for source, doc_ids in unique_sources.items():
-            filename = os.path.basename(source)
-            documents.append(
-                {
-                    "ids": doc_ids,  # 包含文件所有片段的ID列表
-                    "source": filename,
-                    "full_path": source,
-                }
-            )
-        return {"documents": documents}
+        # 直接读取索引清单，无需反序列化向量索引
+        return {"documents": VectorStore.list_documents(collection)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+async def index_report(k: int, num_queries: int, collection: str = None):
+    """评估知识库当前向量索引的召回率、检索延迟和内存占用"""
+    try:
+        # 评估需要多次检索，放到线程池中执行
+        report = await asyncio.to_thread(
+            VectorStore.index_report, k, num_queries, collection=collection
+        )
+        if report is None:
+            return {"message": "向量数据库不存在"}
+        return report
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+async def compression_report(
+    k: int, num_queries: int, factories: list[str] = None, collection: str = None
+):
+    """比较各压缩存储方式 (fp16/SQ8/PQ/降维) 的内存占用和召回率"""
+    try:
+        report = await asyncio.to_thread(
+            VectorStore.compression_report,
+            k,
+            num_queries,
+            factories,
+            collection=collection,
+        )
+        if report is None:
+            return {"message": "向量数据库不存在"}
+        return report
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -74,7 +119,9 @@ async def study_documents():
 async def delete_documents(request: DeleteDocumentsRequest):
     """删除指定文档的向量数据"""
     try:
-        result = VectorStore.delete_documents(request.doc_ids)
+        result = await VectorStore.delete_documents(
+            request.doc_ids, request.collection
+        )
         if result:
             return {"message": "文档向量数据已成功删除"}
         # 如果文档不存在，直接抛出 HTTPException
@@ -89,12 +136,44 @@ async def delete_documents(request: DeleteDocumentsRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 
-async def file_list(db: Session):
+async def file_list(db: AsyncSession, collection: str = None):
     try:
         files_service = Files(db)
-        return await files_service.files_list()
+        return await files_service.files_list(collection)
     except Exception as e:
         if isinstance(e, HTTPException):
             raise e
         # 其他异常包装成 500
         raise HTTPException(status_code=500, detail=str(e))
+
+
+async def collection_list():
+    """知识库列表：各知识库的索引版本、配置，以及进程内已加载的知识库"""
+    try:
+        collections = []
+        for name in Collection.list_names():
+            collection = Collection(name)
+            collections.append(
+                {
+                    "name": name,
+                    "version": VectorStore.get_index_version(name),
+                    "settings": collection.overrides,
+                }
+            )
+        return {
+            "collections": collections,
+            "registry": VectorStoreRegistry().stats(),
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+async def update_collection(name: str, request: CollectionSettings):
+    """创建知识库或修改知识库配置"""
+    try:
+        overrides = request.model_dump(exclude_unset=True)
+        return {"name": name, "settings": Collection(name).save_settings(overrides)}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
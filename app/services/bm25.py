@@ -0,0 +1,59 @@
+import re
+import unicodedata
+from typing import Dict, List, Sequence
+
+# 分词规则版本，规则变化后旧索引中的词无法按原文删除，需要全量重建
+TOKENIZER_VERSION = "1"
+# 查询最多使用的词数
+MAX_QUERY_TOKENS = 64
+
+_CJK = r"\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff"
+_CJK_RE = re.compile(f"[{_CJK}]")
+_TOKEN_RE = re.compile(f"[{_CJK}]+|[0-9a-z]+(?:[-_./:][0-9a-z]+)*")
+_JOINER_RE = re.compile(r"[-_./:]")
+
+
+def tokenize(text: str) -> List[str]:
+    """面向中文语料的 BM25 分词
+
+    全角字符转为半角并转小写；连续的中日韩文字按相邻两字切分 (单字保留)，
+    英文和数字按单词切分，型号、编号等带连接符的词 (如 AB-1234) 同时保留
+    去掉连接符的整体和各部分，保证精确匹配。
+    """
+    text = unicodedata.normalize("NFKC", text).lower()
+    tokens = []
+    for match in _TOKEN_RE.finditer(text):
+        run = match.group()
+        if _CJK_RE.match(run):
+            if len(run) == 1:
+                tokens.append(run)
+            else:
+                tokens.extend(run[i : i + 2] for i in range(len(run) - 1))
+        else:
+            parts = _JOINER_RE.split(run)
+            if len(parts) > 1:
+                tokens.append("".join(parts))
+            tokens.extend(parts)
+    return tokens
+
+
+def match_query(text: str) -> str:
+    """将问题转为 FTS5 查询，任一词命中即可，由 BM25 打分排序"""
+    tokens = list(dict.fromkeys(tokenize(text)))[:MAX_QUERY_TOKENS]
+    return " OR ".join(f'"{token}"' for token in tokens)
+
+
+def reciprocal_rank_fusion(
+    rankings: Sequence[Sequence[int]], weights: Sequence[float], k: int = 60
+) -> List[int]:
+    """按加权倒数排名 (RRF) 融合多路检索结果
+
+    每路结果中排第 r 名 (从 1 开始) 的条目得分 weight / (k + r)，按总分排序。
+    """
+    scores: Dict[int, float] = {}
+    for ranking, weight in zip(rankings, weights):
+        if weight <= 0:
+            continue
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] = scores.get(item, 0.0) + weight / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
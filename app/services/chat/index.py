@@ -1,87 +1,162 @@
 import asyncio
-import os
 
 from fastapi import HTTPException
-from sqlalchemy.orm import Session
-from fastapi import HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi.responses import StreamingResponse
 
 from app.api.models import Question
+from app.logging.logging import logger
+from app.services.dedup import origins
 from app.services.document_qa import DocumentQA
 from app.utils.handlers import StreamingHandler
-from app.config.index import settings
+from app.services.vector_store import VectorStoreRegistry
+
+
+def sse_response(events) -> StreamingResponse:
+    """以 SSE 格式返回事件流"""
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "Transfer-Encoding": "chunked",
+        },
+    )
 
-async def query_stream(question: Question, db: Session):
+
+async def query_stream(question: Question, db: AsyncSession):
     """流式问答"""
     try:
-        if not os.path.exists(settings.VECTOR_DB_PATH):
+        # 知识库首次使用时从磁盘加载，放到线程池中避免阻塞事件循环
+        if await asyncio.to_thread(VectorStoreRegistry().get, question.collection) is None:
             raise HTTPException(status_code=404, detail="向量数据库不存在")
 
         # 创建 DocumentQA 实例，传入数据库会话
         qa_system = DocumentQA(db)
         handler = StreamingHandler()
+
+        filters = question.filters.model_dump(exclude_none=True) if question.filters else None
+        search_options = {
+            "k": question.k,
+            "nprobe": question.nprobe,
+            "ef_search": question.ef_search,
+            "vector_weight": question.vector_weight,
+            "bm25_weight": question.bm25_weight,
+            "rerank": question.rerank,
+        }
+
+        # 语义缓存命中时直接回放答案和引用，不调用 LLM；缓存只匹配检索参数相同的
+        # 答案，带过滤条件的检索范围不同，不使用缓存
+        cached = None
+        if not filters:
+            cached = await qa_system.match_answer_cache(
+                question.session_id,
+                question.user_id,
+                question.text,
+                question.collection,
+                search_options,
+            )
+        if cached is not None:
+
+            async def replay_response():
+                yield handler.create_sse_event(cached.answer)
+                try:
+                    await qa_system.save_chat_history(
+                        question.session_id,
+                        question.text,
+                        cached.answer,
+                        question.user_id,
+                        cached.sources,
+                    )
+                except Exception as e:
+                    logger.error(f"保存会话 {question.session_id} 的记录失败: {str(e)}")
+                    yield handler.create_error_event(f"保存会话记录失败: {str(e)}")
+                if cached.sources:
+                    yield handler.create_sse_event(cached.sources, is_source=True)
+                yield handler.create_sse_event(None)
+
+            return sse_response(replay_response())
+
         qa_chain = await qa_system.create_qa_chain(
             session_id=question.session_id,
             streaming_handler=handler,
             user_id=question.user_id,
+            search_options={**search_options, "filters": filters},
+            collection=question.collection,
         )
 
         async def stream_response():
             task = asyncio.create_task(qa_chain.ainvoke({"question": question.text}))
-            result = None
+            task.add_done_callback(handler.finish)
+            try:
+                while True:
+                    token = await handler.queue.get()
+                    if token is handler.DONE:
+                        break
+                    yield handler.create_sse_event(token)
 
-            while True:
                 try:
-                    token = await asyncio.wait_for(handler.queue.get(), timeout=0.1)
-                    yield handler.create_sse_event(token)
-                except asyncio.TimeoutError:
-                    if task.done():
-                        if not result:
-                            result = await task
-                            # 发送源文档信息
-                            if "source_documents" in result:
-                                sources = []
-                                for doc in result["source_documents"]:
-                                    sources.append(
-                                        {
-                                            "page_content": doc.page_content,
-                                            "source": doc.metadata.get(
-                                                "source", "未知来源"
-                                            ),
-                                            "page": doc.metadata.get("page", 0),
-                                        }
-                                    )
-                                # 保存对话历史到Mysql
-                                await qa_system.save_chat_history(
-                                    question.session_id,
-                                    question.text,
-                                    result["answer"],
-                                    question.user_id,
-                                    sources
-                                )
-                                yield handler.create_sse_event(sources, is_source=True)
-                        break
-                    continue
+                    result = task.result()
                 except Exception as e:
-                    print(f"Error: {e}")
-                    break
+                    logger.error(f"问答链执行失败: {str(e)}")
+                    yield handler.create_error_event(str(e))
+                    result = None
+
+                # 发送源文档信息
+                if result and "source_documents" in result:
+                    sources = []
+                    for doc in result["source_documents"]:
+                        sources.append(
+                            {
+                                "page_content": doc.page_content,
+                                "source": doc.metadata.get("source", "未知来源"),
+                                "page": doc.metadata.get("page", 0),
+                                # 合并了近似重复文本块时列出全部出处
+                                "origins": [
+                                    {
+                                        "source": item.get("source", "未知来源"),
+                                        "page": item.get("page", 0),
+                                    }
+                                    for item in origins(doc.metadata)
+                                ],
+                            }
+                        )
+                    # 保存对话历史到Mysql，答案已经发出，保存失败时发送错误事件，
+                    # 仍然返回引用和结束标记
+                    try:
+                        await qa_system.save_chat_history(
+                            question.session_id,
+                            question.text,
+                            result["answer"],
+                            question.user_id,
+                            sources,
+                        )
+                    except Exception as e:
+                        logger.error(
+                            f"保存会话 {question.session_id} 的记录失败: {str(e)}"
+                        )
+                        yield handler.create_error_event(f"保存会话记录失败: {str(e)}")
+                    else:
+                        # 只缓存已成功保存的答案
+                        qa_system.store_answer_cache(
+                            question.text, result["answer"], sources
+                        )
+                    yield handler.create_sse_event(sources, is_source=True)
+            finally:
+                # 客户端断开时生成器被关闭，取消仍在生成的问答链，不再保存历史
+                if not task.done():
+                    task.cancel()
+                    logger.info(f"客户端已断开，取消会话 {question.session_id} 的生成")
 
             yield handler.create_sse_event(None)
 
-        return StreamingResponse(
-            stream_response(),
-            media_type="text/event-stream",
-            headers={
-                "Cache-Control": "no-cache",
-                "Connection": "keep-alive",
-                "Transfer-Encoding": "chunked",
-            },
-        )
+        return sse_response(stream_response())
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-async def get_chat_history(session_id: str, user_id: str, db: Session):
+async def get_chat_history(session_id: str, user_id: str, db: AsyncSession):
     """获取聊天历史"""
     try:
         qa_system = DocumentQA(db)
@@ -90,7 +165,7 @@ async def get_chat_history(session_id: str, user_id: str, db: Session):
         raise HTTPException(status_code=500, detail=str(e))
 
 
-async def get_session(user_id: str, db: Session):
+async def get_session(user_id: str, db: AsyncSession):
     """获取会话列表"""
     try:
         qa_system = DocumentQA(db)
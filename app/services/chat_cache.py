@@ -0,0 +1,167 @@
+import json
+from typing import Dict, List
+
+from redis.exceptions import RedisError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config.index import settings
+from app.logging.logging import logger
+from app.utils.mysql_client import MySQLClient
+from app.utils.redis_client import AsyncRedisClient
+
+# 缓存不存在时才回填最近轮次：读取 MySQL 期间其他请求已回填或已写入更新的
+# 轮次时放弃本次回填，避免覆盖掉并发写入的轮次
+_REFILL_TURNS = """
+if redis.call('exists', KEYS[1]) == 1 then
+    return 0
+end
+local last = tonumber(redis.call('get', KEYS[2]) or '0')
+if last > tonumber(ARGV[2]) then
+    return 0
+end
+redis.call('rpush', KEYS[1], unpack(ARGV, 3))
+redis.call('expire', KEYS[1], ARGV[1])
+return 1
+"""
+
+
+class ChatCache:
+    """会话记录的 Redis 热缓存
+
+    读请求先查 Redis，未命中时从 MySQL 加载并回填 (read-through)；写入 MySQL
+    成功后在同一个 pipeline 中追加最近轮次并使聊天记录和会话列表失效
+    (write-through)。每个会话缓存最近 CHAT_CACHE_MAX_TURNS 轮问答，供下一次
+    提问加载记忆；Redis 不可用时直接回退到 MySQL。
+    """
+
+    def __init__(self, db: AsyncSession):
+        self.mysql = MySQLClient(db)
+
+    @staticmethod
+    def turns_key(session_id: str, user_id: str) -> str:
+        return f"chat:turns:{user_id}:{session_id}"
+
+    @staticmethod
+    def last_turn_key(session_id: str, user_id: str) -> str:
+        """会话最近写入的轮次ID，回填缓存时判断读到的数据是否已过期"""
+        return f"chat:last_turn:{user_id}:{session_id}"
+
+    @staticmethod
+    def history_key(session_id: str, user_id: str) -> str:
+        return f"chat:history:{user_id}:{session_id}"
+
+    @staticmethod
+    def sessions_key(user_id: str) -> str:
+        return f"chat:sessions:{user_id}"
+
+    async def get_recent_turns(
+        self, session_id: str, user_id: str, limit: int
+    ) -> List[Dict]:
+        """获取会话最近的问答轮次，按时间正序排列"""
+        if not settings.CHAT_CACHE_ENABLED or limit > settings.CHAT_CACHE_MAX_TURNS:
+            return await self.mysql.get_recent_turns(session_id, user_id, limit=limit)
+
+        key = self.turns_key(session_id, user_id)
+        try:
+            async with AsyncRedisClient().client.pipeline(transaction=False) as pipe:
+                pipe.lrange(key, -limit, -1)
+                pipe.expire(key, settings.SESSION_TTL)
+                cached, _ = await pipe.execute()
+            if cached:
+                return [json.loads(turn) for turn in cached]
+        except RedisError as e:
+            logger.warning(f"读取会话 {session_id} 缓存失败: {str(e)}")
+            return await self.mysql.get_recent_turns(session_id, user_id, limit=limit)
+
+        # 未命中时按缓存容量加载，后续提问直接从缓存读取
+        turns = await self.mysql.get_recent_turns(
+            session_id, user_id, limit=settings.CHAT_CACHE_MAX_TURNS
+        )
+        if turns:
+            try:
+                await AsyncRedisClient().client.eval(
+                    _REFILL_TURNS,
+                    2,
+                    key,
+                    self.last_turn_key(session_id, user_id),
+                    settings.SESSION_TTL,
+                    turns[-1]["id"],
+                    *[self._dump_turn(turn) for turn in turns],
+                )
+            except RedisError as e:
+                logger.warning(f"回填会话 {session_id} 缓存失败: {str(e)}")
+        return turns[-limit:] if limit else []
+
+    async def get_chat_history(self, session_id: str, user_id: str) -> List[Dict]:
+        """获取会话的完整聊天记录(含引用)"""
+        if not settings.CHAT_CACHE_ENABLED:
+            return await self.mysql.get_chat_history(session_id, user_id)
+        return await self._read_through(
+            self.history_key(session_id, user_id),
+            lambda: self.mysql.get_chat_history(session_id, user_id),
+        )
+
+    async def get_session(self, user_id: str) -> List[Dict]:
+        """获取用户的会话列表"""
+        if not settings.CHAT_CACHE_ENABLED:
+            return await self.mysql.get_session(user_id)
+
+        return await self._read_through(
+            self.sessions_key(user_id), lambda: self.mysql.get_session(user_id)
+        )
+
+    @classmethod
+    async def on_saved(cls, records: List[Dict], saved: List[Dict]):
+        """会话记录写入 MySQL 后更新缓存
+
+        Args:
+            records: 提交保存的会话记录，用于获取 user_id
+            saved: save_chat_histories 返回的已保存记录，与 records 一一对应
+        """
+        if not settings.CHAT_CACHE_ENABLED or not saved:
+            return
+        try:
+            async with AsyncRedisClient().client.pipeline(transaction=False) as pipe:
+                for record, turn in zip(records, saved):
+                    session_id, user_id = turn["session_id"], record["user_id"]
+                    key = cls.turns_key(session_id, user_id)
+                    # 只追加到已存在的缓存，未缓存的会话下次读取时从 MySQL 加载
+                    pipe.rpushx(key, cls._dump_turn(turn))
+                    pipe.ltrim(key, -settings.CHAT_CACHE_MAX_TURNS, -1)
+                    pipe.set(
+                        cls.last_turn_key(session_id, user_id),
+                        turn["id"],
+                        ex=settings.SESSION_TTL,
+                    )
+                    pipe.delete(cls.history_key(session_id, user_id))
+                    pipe.delete(cls.sessions_key(user_id))
+                await pipe.execute()
+        except RedisError as e:
+            logger.warning(f"更新会话缓存失败: {str(e)}")
+
+    @staticmethod
+    def _dump_turn(turn: Dict) -> str:
+        return json.dumps(
+            {"id": turn["id"], "question": turn["question"], "answer": turn["answer"]},
+            ensure_ascii=False,
+        )
+
+    @staticmethod
+    async def _read_through(key: str, loader) -> List[Dict]:
+        client = AsyncRedisClient().client
+        try:
+            cached = await client.get(key)
+            if cached is not None:
+                return json.loads(cached)
+        except RedisError as e:
+            logger.warning(f"读取缓存 {key} 失败: {str(e)}")
+            return await loader()
+
+        value = await loader()
+        try:
+            await client.set(
+                key, json.dumps(value, ensure_ascii=False), ex=settings.SESSION_TTL
+            )
+        except RedisError as e:
+            logger.warning(f"写入缓存 {key} 失败: {str(e)}")
+        return value
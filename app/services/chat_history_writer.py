@@ -0,0 +1,104 @@
+import asyncio
+from typing import Dict, List
+
+from app.config.index import settings
+from app.db.database import SessionLocal
+from app.logging.logging import logger
+from app.services.chat_cache import ChatCache
+from app.utils.mysql_client import MySQLClient
+
+
+class ChatHistoryWriter:
+    """会话记录异步批量写入器 (write-behind)
+
+    问答结束后只把记录放入队列即可返回 [DONE]，由后台协程把多个并发流的
+    记录攒成一批，在一个事务中写入 MySQL。服务关闭时会先写完队列中剩余的
+    记录。
+    """
+
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(ChatHistoryWriter, cls).__new__(cls)
+            cls._instance.queue = None
+            cls._instance.worker = None
+            # 正在写入的批次，关闭时若被中断由 stop 重新写入
+            cls._instance.inflight = []
+        return cls._instance
+
+    def start(self):
+        """在当前事件循环中启动后台写入协程"""
+        if self.worker is None or self.worker.done():
+            if self.queue is None:
+                self.queue = asyncio.Queue(maxsize=settings.CHAT_HISTORY_QUEUE_SIZE)
+            self.worker = asyncio.create_task(self._run())
+            logger.info("会话记录批量写入 worker 已启动")
+
+    async def stop(self):
+        """写完队列中剩余的记录后停止"""
+        if self.worker is None:
+            return
+        self.worker.cancel()
+        await asyncio.gather(self.worker, return_exceptions=True)
+        self.worker = None
+
+        remaining, self.inflight = self.inflight, []
+        while not self.queue.empty():
+            remaining.append(self.queue.get_nowait())
+        if remaining:
+            await self._flush(remaining)
+
+    async def submit(
+        self, session_id: str, question: str, answer: str, user_id: str, sources: list
+    ):
+        """提交一条会话记录，队列已满时等待，对上游形成背压"""
+        if self.worker is None or self.worker.done():
+            self.start()
+        await self.queue.put(
+            {
+                "session_id": session_id,
+                "question": question,
+                "answer": answer,
+                "user_id": user_id,
+                "sources": sources,
+            }
+        )
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            self.inflight = batch
+            # 在刷新间隔内继续收集记录，直到达到批大小
+            deadline = loop.time() + settings.CHAT_HISTORY_FLUSH_INTERVAL
+            while len(batch) < settings.CHAT_HISTORY_BATCH_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self._flush(batch)
+            self.inflight = []
+
+    async def _flush(self, batch: List[Dict]):
+        async with SessionLocal() as db:
+            try:
+                saved = await MySQLClient(db).save_chat_histories(batch)
+                await ChatCache.on_saved(batch, saved)
+                return
+            except Exception as e:
+                logger.error(f"批量保存 {len(batch)} 条会话记录失败，改为逐条保存: {str(e)}")
+
+        # 单条记录出错不影响同批次的其他记录
+        for record in batch:
+            async with SessionLocal() as db:
+                try:
+                    saved = await MySQLClient(db).save_chat_histories([record])
+                    await ChatCache.on_saved([record], saved)
+                except Exception as e:
+                    logger.error(
+                        f"保存会话 {record['session_id']} 的记录失败: {str(e)}"
+                    )
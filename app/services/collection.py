@@ -0,0 +1,136 @@
+import json
+import os
+import re
+import threading
+from typing import Optional
+
+from sqlalchemy import and_, or_
+
+from app.config.index import settings
+from app.db.models.chat import files
+
+DEFAULT_COLLECTION = "default"
+# 知识库名只允许字母、数字、下划线和短横线，直接用作目录名
+NAME_PATTERN = r"^[A-Za-z0-9_-]{1,64}$"
+# 其他知识库的目录，位于 FAISS_INDEX_PATH 下
+COLLECTIONS_DIR = "collections"
+SETTINGS_FILE = "collection.json"
+# 每个知识库可单独覆盖的配置项
+OVERRIDABLE_SETTINGS = (
+    "FAISS_INDEX_FACTORY",
+    "FAISS_RESCORE_FACTOR",
+    "RETRIEVER_K",
+    "HYBRID_SEARCH_ENABLED",
+    "HYBRID_VECTOR_WEIGHT",
+    "HYBRID_BM25_WEIGHT",
+    "HYBRID_FETCH_K",
+    "RERANK_ENABLED",
+    "RERANK_FETCH_K",
+)
+
+_name_re = re.compile(NAME_PATTERN)
+# 知识库目录 -> (collection.json 修改时间, 配置)
+_settings_cache = {}
+_settings_lock = threading.Lock()
+
+
+def normalize_name(name: Optional[str]) -> str:
+    """校验知识库名，为空时返回默认知识库"""
+    if not name:
+        return DEFAULT_COLLECTION
+    if not _name_re.match(name):
+        raise ValueError(f"知识库名称不合法: {name}")
+    return name
+
+
+def files_filter(name: Optional[str]):
+    """files 表中属于该知识库的记录，未设置知识库的旧记录属于默认知识库"""
+    name = normalize_name(name)
+    if name == DEFAULT_COLLECTION:
+        return or_(files.collection == name, files.collection.is_(None))
+    return files.collection == name
+
+
+def pending_files_filter(name: Optional[str]):
+    """该知识库中待学习的文件：未学习、未删除且格式不是已知不支持的"""
+    return and_(
+        files.is_study == False,
+        files.is_deleted == False,
+        or_(files.is_unsupported == False, files.is_unsupported.is_(None)),
+        files_filter(name),
+    )
+
+
+class Collection:
+    """一个独立的知识库：自己的索引目录、版本指针、清单和配置
+
+    默认知识库沿用 FAISS_INDEX_PATH 根目录，兼容已有索引；其他知识库保存在
+    FAISS_INDEX_PATH/collections/<name> 下。目录中的 collection.json 可覆盖
+    OVERRIDABLE_SETTINGS 中的配置，未覆盖的沿用全局配置。
+    """
+
+    def __init__(self, name: Optional[str] = None):
+        self.name = normalize_name(name)
+
+    @property
+    def root(self) -> str:
+        if self.name == DEFAULT_COLLECTION:
+            return settings.FAISS_INDEX_PATH
+        return os.path.join(settings.FAISS_INDEX_PATH, COLLECTIONS_DIR, self.name)
+
+    @property
+    def overrides(self) -> dict:
+        """collection.json 中的配置，按文件修改时间缓存"""
+        path = os.path.join(self.root, SETTINGS_FILE)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return {}
+        cached = _settings_cache.get(self.root)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        with open(path, encoding="utf-8") as f:
+            overrides = {
+                key: value
+                for key, value in json.load(f).items()
+                if key in OVERRIDABLE_SETTINGS
+            }
+        with _settings_lock:
+            _settings_cache[self.root] = (mtime, overrides)
+        return overrides
+
+    def setting(self, key: str):
+        """读取配置，知识库未覆盖时返回全局配置"""
+        overrides = self.overrides
+        if key in overrides:
+            return overrides[key]
+        return getattr(settings, key)
+
+    def save_settings(self, overrides: dict) -> dict:
+        """保存知识库配置，值为 None 的配置项恢复为全局配置"""
+        unknown = set(overrides) - set(OVERRIDABLE_SETTINGS)
+        if unknown:
+            raise ValueError(f"不支持的配置项: {', '.join(sorted(unknown))}")
+        merged = {**self.overrides, **overrides}
+        merged = {key: value for key, value in merged.items() if value is not None}
+
+        os.makedirs(self.root, exist_ok=True)
+        path = os.path.join(self.root, SETTINGS_FILE)
+        tmp_file = f"{path}.tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(merged, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_file, path)
+        return merged
+
+    @staticmethod
+    def list_names() -> list:
+        """磁盘上已有的知识库，默认知识库始终在列表中"""
+        names = {DEFAULT_COLLECTION}
+        directory = os.path.join(settings.FAISS_INDEX_PATH, COLLECTIONS_DIR)
+        if os.path.isdir(directory):
+            names.update(
+                name
+                for name in os.listdir(directory)
+                if _name_re.match(name) and os.path.isdir(os.path.join(directory, name))
+            )
+        return sorted(names)
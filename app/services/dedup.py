@@ -0,0 +1,324 @@
+import asyncio
+import hashlib
+import os
+import re
+import uuid
+import zlib
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+from app.config.index import settings
+from app.logging.logging import logger
+
+MINHASH = "minhash"
+SIMHASH = "simhash"
+METHODS = (MINHASH, SIMHASH)
+
+# 重复文本块在保留文本块上记录的来源，引用时列出全部出处
+DUPLICATES_KEY = "duplicates"
+ORIGIN_KEYS = (
+    "file_id",
+    "source",
+    "page",
+    "end_page",
+    "user_id",
+    "tags",
+    "uploaded_at",
+)
+
+# MinHash 使用的大于 2^32 的素数，a*h+b 不会超出 uint64
+_PRIME = np.uint64(4294967311)
+_SIMHASH_BITS = 64
+# SimHash 分为 4 段，汉明距离不超过 3 的签名至少有一段完全相同
+_SIMHASH_BANDS = 4
+# 归一化时去掉空白和标点，只比较文字本身
+_NON_WORD = re.compile(r"[\W_]+", re.UNICODE)
+
+
+def origin(metadata: dict) -> dict:
+    """文本块的出处：文件、页码和文件级元数据"""
+    return {key: metadata.get(key) for key in ORIGIN_KEYS if key in metadata}
+
+
+def origins(metadata: dict) -> List[dict]:
+    """文本块自身及被合并的重复文本块的全部出处"""
+    return [origin(metadata), *metadata.get(DUPLICATES_KEY, [])]
+
+
+class DedupIndex:
+    """文本块近似重复检测索引
+
+    文本归一化后取字符 n-gram (对中文同样适用)，计算 MinHash 或 SimHash
+    签名，按 LSH 分段放入哈希桶，新文本块只与同桶的候选比较相似度。签名
+    与索引保存在同一个版本目录中，增量更新时无需重新计算已有文本块。
+    """
+
+    FILE_NAME = "dedup.npz"
+
+    def __init__(
+        self,
+        method: str = None,
+        shingle_size: int = None,
+        num_perm: int = None,
+        bands: int = None,
+    ):
+        self.method = (method or settings.DEDUP_METHOD).lower()
+        if self.method not in METHODS:
+            raise ValueError(
+                f"不支持的去重方式: {self.method}，可选 {', '.join(METHODS)}"
+            )
+        self.shingle_size = shingle_size or settings.DEDUP_SHINGLE_SIZE
+        if self.method == MINHASH:
+            self.num_perm = num_perm or settings.DEDUP_NUM_PERM
+            self.bands = bands or settings.DEDUP_BANDS
+            if self.num_perm % self.bands:
+                raise ValueError("DEDUP_NUM_PERM 需要是 DEDUP_BANDS 的整数倍")
+            rng = np.random.default_rng(0)
+            self._a = rng.integers(1, 2**32, self.num_perm, dtype=np.uint64)
+            self._b = rng.integers(0, 2**32, self.num_perm, dtype=np.uint64)
+        else:
+            self.num_perm = 1
+            self.bands = _SIMHASH_BANDS
+        self.signatures: Dict[str, np.ndarray] = {}
+        self._buckets: Dict[Tuple[int, bytes], set] = defaultdict(set)
+
+    @property
+    def params(self) -> dict:
+        return {
+            "method": self.method,
+            "shingle_size": self.shingle_size,
+            "num_perm": self.num_perm,
+            "bands": self.bands,
+        }
+
+    def __len__(self) -> int:
+        return len(self.signatures)
+
+    def _shingles(self, text: str) -> List[str]:
+        text = _NON_WORD.sub("", text.lower())
+        size = self.shingle_size
+        if len(text) <= size:
+            return [text] if text else []
+        return list({text[i : i + size] for i in range(len(text) - size + 1)})
+
+    def signature(self, text: str) -> np.ndarray:
+        shingles = self._shingles(text)
+        if self.method == SIMHASH:
+            return self._simhash(shingles)
+        if not shingles:
+            return np.full(self.num_perm, _PRIME, dtype=np.uint64)
+        hashes = np.fromiter(
+            (zlib.crc32(shingle.encode("utf-8")) for shingle in shingles),
+            dtype=np.uint64,
+            count=len(shingles),
+        )
+        hashed = (self._a[:, None] * hashes[None, :] + self._b[:, None]) % _PRIME
+        return hashed.min(axis=1)
+
+    @staticmethod
+    def _simhash(shingles: List[str]) -> np.ndarray:
+        if not shingles:
+            return np.zeros(1, dtype=np.uint64)
+        hashes = np.fromiter(
+            (
+                int.from_bytes(
+                    hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(),
+                    "little",
+                )
+                for shingle in shingles
+            ),
+            dtype=np.uint64,
+            count=len(shingles),
+        )
+        shifts = np.arange(_SIMHASH_BITS, dtype=np.uint64)
+        bits = (hashes[:, None] >> shifts) & np.uint64(1)
+        weights = (bits.astype(np.int64) * 2 - 1).sum(axis=0)
+        value = 0
+        for bit in np.nonzero(weights > 0)[0]:
+            value |= 1 << int(bit)
+        return np.array([value], dtype=np.uint64)
+
+    def similarity(self, left: np.ndarray, right: np.ndarray) -> float:
+        """MinHash 为估算的 Jaccard 相似度，SimHash 为相同比特的比例"""
+        if self.method == SIMHASH:
+            return 1.0 - bin(int(left[0]) ^ int(right[0])).count("1") / _SIMHASH_BITS
+        return float(np.mean(left == right))
+
+    def _band_keys(self, signature: np.ndarray):
+        if self.method == SIMHASH:
+            value = int(signature[0])
+            width = _SIMHASH_BITS // self.bands
+            for band in range(self.bands):
+                key = (value >> (band * width)) & ((1 << width) - 1)
+                yield band, key.to_bytes(4, "little")
+            return
+        rows = self.num_perm // self.bands
+        for band in range(self.bands):
+            yield band, signature[band * rows : (band + 1) * rows].tobytes()
+
+    def add(self, chunk_id: str, signature: np.ndarray):
+        self.signatures[chunk_id] = signature
+        for key in self._band_keys(signature):
+            self._buckets[key].add(chunk_id)
+
+    def remove(self, chunk_ids):
+        for chunk_id in chunk_ids:
+            signature = self.signatures.pop(chunk_id, None)
+            if signature is None:
+                continue
+            for key in self._band_keys(signature):
+                bucket = self._buckets.get(key)
+                if bucket is not None:
+                    bucket.discard(chunk_id)
+                    if not bucket:
+                        del self._buckets[key]
+
+    def candidates(self, signature: np.ndarray) -> List[Tuple[str, float]]:
+        """同桶的候选文本块及其相似度，按相似度从高到低排列"""
+        chunk_ids = set()
+        for key in self._band_keys(signature):
+            chunk_ids.update(self._buckets.get(key, ()))
+        scored = [
+            (chunk_id, self.similarity(signature, self.signatures[chunk_id]))
+            for chunk_id in chunk_ids
+        ]
+        return sorted(scored, key=lambda item: item[1], reverse=True)
+
+    def save(self, index_path: str):
+        """写入签名，先写临时文件再替换"""
+        ids = list(self.signatures)
+        signatures = (
+            np.stack([self.signatures[chunk_id] for chunk_id in ids])
+            if ids
+            else np.zeros((0, self.num_perm), dtype=np.uint64)
+        )
+        path = os.path.join(index_path, self.FILE_NAME)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.npz"
+        params = {key: np.array(value) for key, value in self.params.items()}
+        np.savez(tmp_path, ids=np.array(ids, dtype=str), signatures=signatures, **params)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, index_path: str) -> Optional["DedupIndex"]:
+        """读取签名，不存在或签名参数与当前配置不一致时返回 None"""
+        if index_path is None:
+            return None
+        path = os.path.join(index_path, cls.FILE_NAME)
+        if not os.path.isfile(path):
+            return None
+        dedup = cls()
+        with np.load(path) as data:
+            if any(str(data[key]) != str(value) for key, value in dedup.params.items()):
+                return None
+            for chunk_id, signature in zip(data["ids"], data["signatures"]):
+                dedup.add(str(chunk_id), signature)
+        return dedup
+
+    @classmethod
+    def from_docstore(cls, vectorstore) -> "DedupIndex":
+        """根据已有索引的全部文本块计算签名，用于首次开启去重或修改签名参数后"""
+        dedup = cls()
+        if vectorstore is not None:
+            for chunk_id in vectorstore.index_to_docstore_id.values():
+                doc = vectorstore.docstore.search(chunk_id)
+                if isinstance(doc, Document):
+                    dedup.add(chunk_id, dedup.signature(doc.page_content))
+            logger.info(f"已根据 docstore 计算 {len(dedup)} 个文本块的去重签名")
+        return dedup
+
+
+class ChunkDeduplicator:
+    """入库时合并近似重复的文本块
+
+    重复的文本块不再向量化，其出处记录到保留的文本块的 duplicates 元数据
+    中，引用时列出全部出处。配置了 DEDUP_EMBEDDING_THRESHOLD 时，文本
+    相似度未达到阈值的候选再比较向量余弦相似度。
+    """
+
+    def __init__(self, index: DedupIndex, embeddings=None):
+        self.index = index
+        self.threshold = settings.DEDUP_THRESHOLD
+        self.embedding_threshold = settings.DEDUP_EMBEDDING_THRESHOLD
+        self.embeddings = embeddings if self.embedding_threshold > 0 else None
+        # 保留的文本块ID -> 本次新增的出处
+        self.references: Dict[str, List[dict]] = defaultdict(list)
+        # 本次新增的文本块内容，用于向量复核
+        self._texts: Dict[str, str] = {}
+        self.merged = 0
+
+    async def filter(
+        self, chunks: List[Document], vectorstore=None
+    ) -> Tuple[List[Document], List[str]]:
+        """过滤一个文件的文本块
+
+        Returns:
+            tuple: (需要写入的文本块, 重复文本块合并到的保留文本块ID)
+        """
+        signatures = await asyncio.to_thread(
+            lambda: [self.index.signature(chunk.page_content) for chunk in chunks]
+        )
+        kept, duplicate_of = [], []
+        for chunk, signature in zip(chunks, signatures):
+            match = await self._match(chunk, signature, vectorstore)
+            if match is None:
+                self.index.add(chunk.id, signature)
+                self._texts[chunk.id] = chunk.page_content
+                kept.append(chunk)
+                continue
+            self.references[match].append(origin(chunk.metadata))
+            duplicate_of.append(match)
+            self.merged += 1
+        return kept, duplicate_of
+
+    async def _match(self, chunk: Document, signature, vectorstore) -> Optional[str]:
+        candidates = self.index.candidates(signature)
+        if not candidates:
+            return None
+        chunk_id, score = candidates[0]
+        if score >= self.threshold:
+            return chunk_id
+        if self.embeddings is None:
+            return None
+
+        texts = [self._text(candidate, vectorstore) for candidate, _ in candidates]
+        candidates = [
+            candidate for candidate, text in zip(candidates, texts) if text is not None
+        ]
+        texts = [text for text in texts if text is not None]
+        if not texts:
+            return None
+        vectors = np.array(
+            await self.embeddings.aembed_documents([chunk.page_content, *texts]),
+            dtype=np.float32,
+        )
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        cosines = vectors[1:] @ vectors[0]
+        best = int(np.argmax(cosines))
+        if cosines[best] >= self.embedding_threshold:
+            return candidates[best][0]
+        return None
+
+    def _text(self, chunk_id: str, vectorstore) -> Optional[str]:
+        if chunk_id in self._texts:
+            return self._texts[chunk_id]
+        if vectorstore is not None:
+            doc = vectorstore.docstore.search(chunk_id)
+            if isinstance(doc, Document):
+                return doc.page_content
+        return None
+
+    def apply(self, vectorstore, manifest) -> int:
+        """把重复文本块的出处写入保留的文本块，返回更新的文本块数"""
+        updated = 0
+        for chunk_id, refs in self.references.items():
+            doc = vectorstore.docstore.search(chunk_id)
+            if not isinstance(doc, Document):
+                continue
+            doc.metadata[DUPLICATES_KEY] = doc.metadata.get(DUPLICATES_KEY, []) + refs
+            manifest.updated_chunks.add(chunk_id)
+            updated += 1
+        self.references.clear()
+        return updated
@@ -0,0 +1,499 @@
+import json
+import os
+import shutil
+import sqlite3
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+
+from langchain_community.docstore.base import Docstore
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_core.documents import Document
+
+from app.logging.logging import logger
+from app.services import bm25
+from app.services.dedup import origins
+
+# 批量删除时每条 SQL 的参数数量
+_BATCH_SIZE = 500
+# 表结构版本，变化后上一版本的文件不能增量更新
+SCHEMA_VERSION = "3"
+# 每个 docstore 缓存的过滤条件数量
+_FILTER_CACHE_SIZE = 64
+
+
+class SqliteDocstore(Docstore):
+    """基于 SQLite 的只读文本块存储
+
+    与 FAISS 索引一起保存在版本目录中：chunks 表保存文本块内容和元数据，
+    positions 表记录索引序号对应的文本块，chunks_fts 为 FTS5 全文索引，
+    用于 BM25 关键词检索。文件ID、上传者、上传时间和标签按文本块的每个
+    出处 (含合并到该文本块的近似重复文本块) 写入 chunk_origins 和
+    chunk_tags 表，任一出处满足过滤条件即可检索到该文本块；按过滤条件查出
+    允许检索的序号后交给 FAISS 预过滤，结果按条件缓存。
+
+    加载时不读取任何文本，检索命中后才按序号查询对应的行，多个 worker
+    进程通过操作系统的页缓存共享同一份文件。版本目录写入后不再修改，以
+    immutable 模式打开，读取时无需加锁。
+    """
+
+    FILE_NAME = "docstore.sqlite3"
+
+    def __init__(self, index_path: str):
+        self.path = os.path.join(index_path, self.FILE_NAME)
+        if not os.path.isfile(self.path):
+            raise FileNotFoundError(self.path)
+        # 每个线程使用独立的连接，检索在线程池中并发执行
+        self._local = threading.local()
+        self._size = None
+        self._filter_cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._filter_lock = threading.Lock()
+        self._legacy = None
+
+    @classmethod
+    def exists(cls, index_path: str) -> bool:
+        return os.path.isfile(os.path.join(index_path, cls.FILE_NAME))
+
+    @classmethod
+    def write(
+        cls,
+        index_path: str,
+        docstore: Docstore,
+        index_to_docstore_id: dict,
+        base_path: Optional[str] = None,
+        updated_ids: Iterable[str] = (),
+    ):
+        """按索引序号写入全部文本块
+
+        base_path 为上一版本的索引目录，其表结构和分词规则相同时复制该文件，
+        只写入新增的文本块、删除已移除的文本块，BM25 索引随之增量更新。文本
+        块ID唯一且内容不变，按ID比较即可；updated_ids 为内容未变、元数据
+        已更新的文本块。
+        """
+        path = os.path.join(index_path, cls.FILE_NAME)
+        incremental = base_path is not None and cls.is_compatible(base_path)
+        if incremental:
+            shutil.copyfile(os.path.join(base_path, cls.FILE_NAME), path)
+
+        conn = sqlite3.connect(path)
+        try:
+            conn.execute("PRAGMA journal_mode=OFF")
+            conn.execute("PRAGMA synchronous=OFF")
+            if not incremental:
+                cls._create_schema(conn)
+            existing = dict(conn.execute("SELECT id, seq FROM chunks"))
+            wanted = set(index_to_docstore_id.values())
+
+            stale = [seq for chunk_id, seq in existing.items() if chunk_id not in wanted]
+            for start in range(0, len(stale), _BATCH_SIZE):
+                cls._delete_rows(conn, stale[start : start + _BATCH_SIZE])
+
+            added = [chunk_id for chunk_id in wanted if chunk_id not in existing]
+            for chunk_id in added:
+                doc = cls._get_document(docstore, chunk_id)
+                cursor = conn.execute(
+                    "INSERT INTO chunks (id, content, metadata) VALUES (?, ?, ?)",
+                    (chunk_id, doc.page_content, cls._metadata_json(doc.metadata)),
+                )
+                conn.execute(
+                    "INSERT INTO chunks_fts (rowid, tokens) VALUES (?, ?)",
+                    (cursor.lastrowid, " ".join(bm25.tokenize(doc.page_content))),
+                )
+                cls._write_origins(conn, cursor.lastrowid, doc.metadata)
+
+            updated = [
+                chunk_id
+                for chunk_id in updated_ids
+                if chunk_id in existing and chunk_id in wanted
+            ]
+            for chunk_id in updated:
+                doc = cls._get_document(docstore, chunk_id)
+                seq = existing[chunk_id]
+                conn.execute(
+                    "UPDATE chunks SET metadata = ? WHERE seq = ?",
+                    (cls._metadata_json(doc.metadata), seq),
+                )
+                conn.execute("DELETE FROM chunk_origins WHERE seq = ?", (seq,))
+                conn.execute("DELETE FROM chunk_tags WHERE seq = ?", (seq,))
+                cls._write_origins(conn, seq, doc.metadata)
+
+            # FAISS 删除向量后序号会重新编排，序号映射每次全量重写
+            seq_by_id = dict(conn.execute("SELECT id, seq FROM chunks"))
+            conn.execute("DELETE FROM positions")
+            conn.executemany(
+                "INSERT INTO positions (pos, seq) VALUES (?, ?)",
+                (
+                    (pos, seq_by_id[chunk_id])
+                    for pos, chunk_id in sorted(index_to_docstore_id.items())
+                ),
+            )
+            conn.commit()
+            logger.info(
+                f"docstore 已{'增量' if incremental else '全量'}写入，"
+                f"新增 {len(added)} 个、删除 {len(stale)} 个、"
+                f"更新元数据 {len(updated)} 个文本块"
+            )
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _get_document(docstore: Docstore, chunk_id: str) -> Document:
+        doc = docstore.search(chunk_id)
+        if not isinstance(doc, Document):
+            raise ValueError(f"docstore 中不存在文本块 {chunk_id}")
+        return doc
+
+    @staticmethod
+    def _metadata_json(metadata: dict) -> str:
+        return json.dumps(metadata, ensure_ascii=False, default=str)
+
+    @staticmethod
+    def _write_origins(conn: sqlite3.Connection, seq: int, metadata: dict):
+        """写入文本块每个出处用于过滤的文件ID、上传者、上传时间和标签"""
+        for number, item in enumerate(origins(metadata)):
+            file_id = item.get("file_id")
+            conn.execute(
+                "INSERT INTO chunk_origins (seq, origin, file_id, user_id, uploaded_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (
+                    seq,
+                    number,
+                    str(file_id) if file_id is not None else None,
+                    item.get("user_id"),
+                    item.get("uploaded_at"),
+                ),
+            )
+            conn.executemany(
+                "INSERT OR IGNORE INTO chunk_tags (tag, seq, origin) VALUES (?, ?, ?)",
+                ((tag, seq, number) for tag in item.get("tags") or []),
+            )
+
+    @staticmethod
+    def _create_schema(conn: sqlite3.Connection):
+        conn.executescript(
+            """
+            CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+            CREATE TABLE chunks (
+                seq INTEGER PRIMARY KEY,
+                id TEXT NOT NULL UNIQUE,
+                content TEXT NOT NULL,
+                metadata TEXT NOT NULL
+            );
+            CREATE TABLE chunk_origins (
+                seq INTEGER NOT NULL,
+                origin INTEGER NOT NULL,
+                file_id TEXT,
+                user_id TEXT,
+                uploaded_at TEXT,
+                PRIMARY KEY (seq, origin)
+            ) WITHOUT ROWID;
+            CREATE TABLE chunk_tags (
+                tag TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                origin INTEGER NOT NULL,
+                PRIMARY KEY (tag, seq, origin)
+            ) WITHOUT ROWID;
+            CREATE INDEX idx_chunk_tags_seq ON chunk_tags (seq);
+            CREATE TABLE positions (pos INTEGER PRIMARY KEY, seq INTEGER NOT NULL);
+            CREATE INDEX idx_positions_seq ON positions (seq);
+            CREATE VIRTUAL TABLE chunks_fts USING fts5(tokens, content='');
+            """
+        )
+        conn.executemany(
+            "INSERT INTO meta (key, value) VALUES (?, ?)",
+            [("tokenizer", bm25.TOKENIZER_VERSION), ("schema", SCHEMA_VERSION)],
+        )
+
+    @staticmethod
+    def _delete_rows(conn: sqlite3.Connection, seqs: List[int]):
+        placeholders = ",".join("?" * len(seqs))
+        rows = conn.execute(
+            f"SELECT seq, content FROM chunks WHERE seq IN ({placeholders})", seqs
+        ).fetchall()
+        # 无内容的 FTS5 表需要提供原来的词才能删除
+        conn.executemany(
+            "INSERT INTO chunks_fts (chunks_fts, rowid, tokens) VALUES ('delete', ?, ?)",
+            ((seq, " ".join(bm25.tokenize(content))) for seq, content in rows),
+        )
+        conn.execute(f"DELETE FROM chunk_origins WHERE seq IN ({placeholders})", seqs)
+        conn.execute(f"DELETE FROM chunk_tags WHERE seq IN ({placeholders})", seqs)
+        conn.execute(f"DELETE FROM chunks WHERE seq IN ({placeholders})", seqs)
+
+    @classmethod
+    def is_compatible(cls, index_path: str) -> bool:
+        """上一版本的文件是否可以增量更新：存在且表结构、分词规则相同"""
+        if not cls.exists(index_path):
+            return False
+        try:
+            docstore = cls(index_path)
+            return (
+                docstore._meta("schema") == SCHEMA_VERSION
+                and docstore._meta("tokenizer") == bm25.TOKENIZER_VERSION
+            )
+        except sqlite3.Error:
+            return False
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(
+                f"file:{self.path}?mode=ro&immutable=1",
+                uri=True,
+                check_same_thread=False,
+            )
+            self._local.conn = conn
+        return conn
+
+    def _meta(self, key: str) -> Optional[str]:
+        row = self._conn().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _filter_clause(self, filters: dict) -> Tuple[str, list]:
+        # 上一版本的文件没有 chunk_origins 表，按文本块自身的列过滤，重建时全量重写
+        if self._legacy is None:
+            self._legacy = self._meta("schema") != SCHEMA_VERSION
+        if self._legacy:
+            return _legacy_filter_clause(filters)
+        return _filter_clause(filters)
+
+    @staticmethod
+    def _to_document(chunk_id: str, content: str, metadata: str) -> Document:
+        return Document(id=chunk_id, page_content=content, metadata=json.loads(metadata))
+
+    def search(self, search: str) -> Union[str, Document]:
+        row = (
+            self._conn()
+            .execute("SELECT id, content, metadata FROM chunks WHERE id = ?", (search,))
+            .fetchone()
+        )
+        if row is None:
+            return f"ID {search} not found."
+        return self._to_document(*row)
+
+    def get_by_positions(self, positions: List[int]) -> List[Optional[Document]]:
+        """按索引序号批量读取文本块，结果顺序与 positions 一致，不存在时为 None"""
+        if not positions:
+            return []
+        placeholders = ",".join("?" * len(positions))
+        rows = self._conn().execute(
+            "SELECT p.pos, c.id, c.content, c.metadata FROM positions p "
+            f"JOIN chunks c ON c.seq = p.seq WHERE p.pos IN ({placeholders})",
+            [int(pos) for pos in positions],
+        )
+        found = {pos: self._to_document(*row) for pos, *row in rows}
+        return [found.get(int(pos)) for pos in positions]
+
+    def bm25_search(self, query: str, k: int, filters: dict = None) -> List[int]:
+        """BM25 关键词检索，返回按相关度排序的索引序号
+
+        有过滤条件时先过滤再排序取前 k 个。
+        """
+        match = bm25.match_query(query)
+        if not match:
+            return []
+        if not filters:
+            rows = self._conn().execute(
+                "SELECT p.pos FROM ("
+                "SELECT rowid AS seq, rank FROM chunks_fts "
+                "WHERE chunks_fts MATCH ? ORDER BY rank LIMIT ?"
+                ") f JOIN positions p ON p.seq = f.seq ORDER BY f.rank",
+                (match, k),
+            )
+        else:
+            where, params = self._filter_clause(filters)
+            rows = self._conn().execute(
+                "SELECT p.pos FROM chunks_fts f "
+                "JOIN chunks c ON c.seq = f.rowid JOIN positions p ON p.seq = c.seq "
+                f"WHERE chunks_fts MATCH ? AND {where} ORDER BY f.rank LIMIT ?",
+                (match, *params, k),
+            )
+        return [pos for (pos,) in rows]
+
+    def filter_positions(self, filters: dict) -> np.ndarray:
+        """满足过滤条件的全部索引序号 (升序)，按条件缓存"""
+        key = json.dumps(filters, sort_keys=True, default=str)
+        with self._filter_lock:
+            positions = self._filter_cache.get(key)
+            if positions is not None:
+                self._filter_cache.move_to_end(key)
+                return positions
+
+        where, params = self._filter_clause(filters)
+        rows = self._conn().execute(
+            "SELECT p.pos FROM positions p JOIN chunks c ON c.seq = p.seq "
+            f"WHERE {where} ORDER BY p.pos",
+            params,
+        )
+        positions = np.fromiter((pos for (pos,) in rows), dtype=np.int64)
+        with self._filter_lock:
+            self._filter_cache[key] = positions
+            while len(self._filter_cache) > _FILTER_CACHE_SIZE:
+                self._filter_cache.popitem(last=False)
+        return positions
+
+    def get_id(self, pos: int) -> Optional[str]:
+        row = (
+            self._conn()
+            .execute(
+                "SELECT c.id FROM positions p JOIN chunks c ON c.seq = p.seq "
+                "WHERE p.pos = ?",
+                (int(pos),),
+            )
+            .fetchone()
+        )
+        return row[0] if row else None
+
+    def iter_ids(self) -> Iterator[Tuple[int, str]]:
+        """按序号遍历 (序号, 文本块ID)"""
+        yield from self._conn().execute(
+            "SELECT p.pos, c.id FROM positions p JOIN chunks c ON c.seq = p.seq "
+            "ORDER BY p.pos"
+        )
+
+    def __len__(self) -> int:
+        if self._size is None:
+            self._size = (
+                self._conn().execute("SELECT COUNT(*) FROM positions").fetchone()[0]
+            )
+        return self._size
+
+    def to_memory(self) -> tuple:
+        """读取全部文本块，返回可修改的 (InMemoryDocstore, 序号到ID的映射)"""
+        documents: Dict[str, Document] = {}
+        index_to_docstore_id: Dict[int, str] = {}
+        rows = self._conn().execute(
+            "SELECT p.pos, c.id, c.content, c.metadata FROM positions p "
+            "JOIN chunks c ON c.seq = p.seq ORDER BY p.pos"
+        )
+        for pos, chunk_id, content, metadata in rows:
+            documents[chunk_id] = self._to_document(chunk_id, content, metadata)
+            index_to_docstore_id[pos] = chunk_id
+        return InMemoryDocstore(documents), index_to_docstore_id
+
+
+def _filter_clause(filters: dict) -> Tuple[str, list]:
+    """将过滤条件转为 chunks 表 (别名 c) 上的 WHERE 子句
+
+    支持 file_ids、user_ids、tags (命中任一标签) 和 uploaded_after/uploaded_before，
+    文本块的同一个出处需同时满足全部条件。
+    """
+    conditions, params = [], []
+    if filters.get("file_ids"):
+        values = [str(value) for value in filters["file_ids"]]
+        conditions.append(f"o.file_id IN ({','.join('?' * len(values))})")
+        params.extend(values)
+    if filters.get("user_ids"):
+        values = list(filters["user_ids"])
+        conditions.append(f"o.user_id IN ({','.join('?' * len(values))})")
+        params.extend(values)
+    if filters.get("tags"):
+        values = list(filters["tags"])
+        conditions.append(
+            "EXISTS (SELECT 1 FROM chunk_tags t WHERE t.seq = o.seq "
+            f"AND t.origin = o.origin AND t.tag IN ({','.join('?' * len(values))}))"
+        )
+        params.extend(values)
+    if filters.get("uploaded_after"):
+        conditions.append("o.uploaded_at >= ?")
+        params.append(_isoformat(filters["uploaded_after"]))
+    if filters.get("uploaded_before"):
+        conditions.append("o.uploaded_at < ?")
+        params.append(_isoformat(filters["uploaded_before"]))
+    if not conditions:
+        return "1", params
+    return (
+        "EXISTS (SELECT 1 FROM chunk_origins o WHERE o.seq = c.seq AND "
+        f"{' AND '.join(conditions)})",
+        params,
+    )
+
+
+def _legacy_filter_clause(filters: dict) -> Tuple[str, list]:
+    """上一版本表结构 (文件ID等为 chunks 表的列) 的 WHERE 子句"""
+    conditions, params = [], []
+    if filters.get("file_ids"):
+        values = [str(value) for value in filters["file_ids"]]
+        conditions.append(f"c.file_id IN ({','.join('?' * len(values))})")
+        params.extend(values)
+    if filters.get("user_ids"):
+        values = list(filters["user_ids"])
+        conditions.append(f"c.user_id IN ({','.join('?' * len(values))})")
+        params.extend(values)
+    if filters.get("tags"):
+        values = list(filters["tags"])
+        conditions.append(
+            "EXISTS (SELECT 1 FROM chunk_tags t WHERE t.seq = c.seq "
+            f"AND t.tag IN ({','.join('?' * len(values))}))"
+        )
+        params.extend(values)
+    if filters.get("uploaded_after"):
+        conditions.append("c.uploaded_at >= ?")
+        params.append(_isoformat(filters["uploaded_after"]))
+    if filters.get("uploaded_before"):
+        conditions.append("c.uploaded_at < ?")
+        params.append(_isoformat(filters["uploaded_before"]))
+    return " AND ".join(conditions) or "1", params
+
+
+def metadata_matches(metadata: dict, filters: dict) -> bool:
+    """文本块的任一出处是否满足过滤条件，用于不支持预过滤的旧格式索引"""
+    return any(_origin_matches(item, filters) for item in origins(metadata))
+
+
+def _origin_matches(metadata: dict, filters: dict) -> bool:
+    if filters.get("file_ids") and str(metadata.get("file_id")) not in {
+        str(value) for value in filters["file_ids"]
+    }:
+        return False
+    if filters.get("user_ids") and metadata.get("user_id") not in filters["user_ids"]:
+        return False
+    if filters.get("tags") and not set(metadata.get("tags") or []) & set(filters["tags"]):
+        return False
+    uploaded_at = metadata.get("uploaded_at")
+    if filters.get("uploaded_after") and (
+        not uploaded_at or uploaded_at < _isoformat(filters["uploaded_after"])
+    ):
+        return False
+    if filters.get("uploaded_before") and (
+        not uploaded_at or uploaded_at >= _isoformat(filters["uploaded_before"])
+    ):
+        return False
+    return True
+
+
+def _isoformat(value) -> str:
+    """与入库时一致，转为不带时区的 UTC ISO 时间字符串"""
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value.isoformat()
+    return str(value)
+
+
+class SqliteIdMap(Mapping):
+    """索引序号到文本块ID的只读映射，按需从 SqliteDocstore 查询"""
+
+    def __init__(self, docstore: SqliteDocstore):
+        self.docstore = docstore
+
+    def __getitem__(self, pos: int) -> str:
+        chunk_id = self.docstore.get_id(pos)
+        if chunk_id is None:
+            raise KeyError(pos)
+        return chunk_id
+
+    def __iter__(self):
+        return (pos for pos, _ in self.docstore.iter_ids())
+
+    def __len__(self) -> int:
+        return len(self.docstore)
+
+    def values(self):
+        return [chunk_id for _, chunk_id in self.docstore.iter_ids()]
+
+    def items(self):
+        return list(self.docstore.iter_ids())
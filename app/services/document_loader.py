@@ -0,0 +1,338 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+from dataclasses import dataclass, field
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import AsyncIterator, Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config.index import settings
+from app.db.models.chat import files
+from app.logging.logging import logger
+from app.services.collection import pending_files_filter
+from app.services.index_manifest import IndexManifest
+from app.utils import loaders
+from app.utils.chunker import ChunkOptions
+from app.utils.loaders import ParsedBatch, parse_file
+from app.utils.minio_client import MinioClient
+
+# 按版面和 token 数切分，解析进程直接产出文本块
+LAYOUT = "layout"
+# 扩展名无法识别格式时读取的对象开头字节数
+SNIFF_BYTES = 4096
+
+
+class FileBatches:
+    """单个文件的解析结果，按批产出
+
+    小文件只有一批；落盘的大文件每批只解析 LOADER_BATCH_CHARS 个字符，
+    读取下一批时才在解析进程池中继续解析，内存占用与文件大小无关。临时
+    文件在全部读完或调用 close 后删除。
+    """
+
+    def __init__(
+        self,
+        first: ParsedBatch,
+        parse_args: tuple = (),
+        spill_path: Optional[str] = None,
+        metadata: dict = None,
+    ):
+        self.first = first
+        self.parse_args = parse_args
+        self.spill_path = spill_path
+        self.metadata = metadata or {}
+
+    async def __aiter__(self) -> AsyncIterator[ParsedBatch]:
+        batch = self.first
+        try:
+            while True:
+                yield batch
+                if batch.cursor is None:
+                    break
+                batch = await asyncio.get_running_loop().run_in_executor(
+                    DocumentLoader.get_parse_pool(),
+                    parse_file,
+                    *self.parse_args,
+                    batch.cursor,
+                    settings.LOADER_BATCH_CHARS,
+                )
+                for document in batch.documents:
+                    document.metadata.update(self.metadata)
+        finally:
+            self.close()
+
+    def close(self):
+        if self.spill_path and os.path.exists(self.spill_path):
+            os.unlink(self.spill_path)
+        self.spill_path = None
+
+
+@dataclass
+class LoadedFile:
+    """单个文件的加载结果"""
+
+    file_id: int
+    file_name: str
+    content_hash: Optional[str] = None
+    # 解析出的文档，按批读取
+    batches: Optional[FileBatches] = None
+    # 内容与索引清单中的记录一致，未解析
+    unchanged: bool = False
+    # 文件级元数据，写入每个文本块用于检索过滤
+    metadata: dict = field(default_factory=dict)
+
+    def close(self):
+        if self.batches is not None:
+            self.batches.close()
+
+
+class DocumentLoader:
+    """流水线式文档加载器
+
+    下载在 I/O 线程池中并发执行，解析 (按版面切分时包括切分) 在按 CPU
+    核数创建的进程池中执行，
+    每个文件解析完成后立即产出，事件循环不会被下载或解析阻塞。同时加载和
+    等待向量化的文件数不超过 LOADER_PREFETCH_FILES。
+    """
+
+    _download_pool = None
+    _parse_pool = None
+    _pool_lock = threading.Lock()
+
+    @classmethod
+    def get_download_pool(cls) -> ThreadPoolExecutor:
+        with cls._pool_lock:
+            if cls._download_pool is None:
+                cls._download_pool = ThreadPoolExecutor(
+                    max_workers=settings.LOADER_DOWNLOAD_WORKERS,
+                    thread_name_prefix="doc-download",
+                )
+            return cls._download_pool
+
+    @classmethod
+    def get_parse_pool(cls) -> ProcessPoolExecutor:
+        with cls._pool_lock:
+            if cls._parse_pool is None:
+                # 服务进程中有多个线程，使用 spawn 避免 fork 继承锁状态
+                cls._parse_pool = ProcessPoolExecutor(
+                    max_workers=settings.LOADER_PARSE_WORKERS or os.cpu_count(),
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return cls._parse_pool
+
+    @classmethod
+    def shutdown(cls):
+        """关闭下载线程池和解析进程池"""
+        with cls._pool_lock:
+            if cls._download_pool is not None:
+                cls._download_pool.shutdown(wait=False, cancel_futures=True)
+                cls._download_pool = None
+            if cls._parse_pool is not None:
+                cls._parse_pool.shutdown(wait=False, cancel_futures=True)
+                cls._parse_pool = None
+
+    @staticmethod
+    async def iter_documents(
+        db: AsyncSession,
+        manifest: IndexManifest = None,
+        embedding_model: str = None,
+        progress=None,
+        collection: str = None,
+    ) -> AsyncIterator[LoadedFile]:
+        """并发下载并解析知识库中未学习的文件，按完成顺序逐个产出
+
+        Args:
+            db: 数据库会话
+            manifest: 索引清单，内容哈希与清单一致的文件不再解析
+            embedding_model: 当前向量模型，模型变化的文件需要重新向量化
+            progress: 进度记录对象(IngestionJob)，记录每个文件的处理状态
+            collection: 知识库名，默认知识库为空
+        """
+        files_query = (
+            await db.scalars(
+                select(files).where(pending_files_filter(collection))
+            )
+        ).all()
+        minio_client = MinioClient()
+        # 已开始加载但尚未被消费完的文件数，向量化跟不上时不再加载新文件，
+        # 内存占用不随待处理文件数增长
+        window = asyncio.Semaphore(max(1, settings.LOADER_PREFETCH_FILES))
+
+        async def _load(file_record) -> Optional[LoadedFile]:
+            await window.acquire()
+            return await DocumentLoader._load_file(
+                minio_client,
+                file_record.id,
+                file_record.file_name,
+                DocumentLoader.object_name(file_record),
+                manifest,
+                embedding_model,
+                progress,
+                DocumentLoader.file_metadata(file_record),
+            )
+
+        tasks = []
+        for file_record in files_query:
+            if not file_record.file_name:
+                logger.warning(f"跳过无效文件名的记录: {file_record.id}")
+                continue
+            tasks.append(asyncio.create_task(_load(file_record)))
+
+        try:
+            for future in asyncio.as_completed(tasks):
+                loaded = await future
+                try:
+                    if loaded is not None:
+                        yield loaded
+                finally:
+                    # 调用方读取下一个文件时，上一个文件的批次已全部处理
+                    window.release()
+        finally:
+            for task in tasks:
+                task.cancel()
+            # 已解析但未产出的文件删除其临时文件
+            for result in await asyncio.gather(*tasks, return_exceptions=True):
+                if isinstance(result, LoadedFile):
+                    result.close()
+
+    @staticmethod
+    def chunk_options() -> ChunkOptions:
+        """版面切分参数，在主进程中读取配置后随任务传给解析进程"""
+        return ChunkOptions(
+            chunk_tokens=settings.CHUNK_TOKENS,
+            overlap_tokens=settings.CHUNK_OVERLAP_TOKENS,
+            min_tokens=settings.CHUNK_MIN_TOKENS,
+            encoding=settings.CHUNK_TOKEN_ENCODING,
+            detect_tables=settings.CHUNK_DETECT_TABLES,
+        )
+
+    @staticmethod
+    def object_name(file_record) -> str:
+        """文件在 MinIO 中的对象名称
+
+        上传时记录在 file_path 中；旧记录的 file_path 是预签名 URL，对象名称
+        就是文件名。
+        """
+        path = file_record.file_path
+        if path and "://" not in path:
+            return path
+        return file_record.file_name
+
+    @staticmethod
+    def file_metadata(file_record) -> dict:
+        """文件级元数据：文件ID、上传者/租户、标签和上传时间"""
+        return {
+            "file_id": file_record.id,
+            "user_id": file_record.user_id,
+            "tags": file_record.tags.split(",") if file_record.tags else [],
+            "uploaded_at": (
+                file_record.created_at.isoformat() if file_record.created_at else None
+            ),
+        }
+
+    @staticmethod
+    async def _load_file(
+        minio_client: MinioClient,
+        file_id: int,
+        file_name: str,
+        object_name: str,
+        manifest: IndexManifest = None,
+        embedding_model: str = None,
+        progress=None,
+        file_metadata: dict = None,
+    ) -> Optional[LoadedFile]:
+        """下载并解析单个文件，出错时记录日志并返回 None
+
+        下载前按扩展名确定加载器，扩展名无法识别时读取对象的 MIME 类型和开头
+        的字节判断格式，不支持的文件不再下载。对象内容直接读入内存交给解析
+        进程，只有超过 LOADER_SPILL_THRESHOLD 的大文件才会写入唯一命名的
+        临时文件，多个重建任务之间互不干扰，并按 LOADER_BATCH_CHARS 分批解析。
+        """
+        loop = asyncio.get_running_loop()
+        spill_path = None
+        file_metadata = file_metadata or {"file_id": file_id}
+
+        def _report(status: str, **info):
+            if progress is not None:
+                progress.file_status(file_id, file_name, status, **info)
+
+        try:
+            loader = loaders.resolve(file_name)
+            if loader is None:
+                content_type, head = await loop.run_in_executor(
+                    DocumentLoader.get_download_pool(),
+                    minio_client.sniff_object,
+                    object_name,
+                    SNIFF_BYTES,
+                )
+                loader = loaders.resolve(file_name, content_type, head)
+            if loader is None:
+                logger.info(f"文件 {file_name} 格式不支持，跳过下载")
+                _report("unsupported")
+                return None
+
+            _report("downloading")
+            data, spill_path, content_hash = await loop.run_in_executor(
+                DocumentLoader.get_download_pool(),
+                minio_client.read_object,
+                object_name,
+                settings.LOADER_SPILL_THRESHOLD,
+            )
+            if manifest is not None and manifest.is_unchanged(
+                file_name, content_hash, embedding_model
+            ):
+                logger.info(f"文件 {file_name} 内容未变化，跳过解析")
+                _report("unchanged")
+                return LoadedFile(
+                    file_id,
+                    file_name,
+                    content_hash,
+                    unchanged=True,
+                    metadata=file_metadata,
+                )
+
+            _report("parsing")
+            # 按版面切分时解析和切分都在解析进程中完成
+            parse_args = (
+                loader.name,
+                file_name,
+                data,
+                spill_path,
+                DocumentLoader.chunk_options(),
+                settings.CHUNK_STRATEGY == LAYOUT,
+            )
+            first = await loop.run_in_executor(
+                DocumentLoader.get_parse_pool(),
+                parse_file,
+                *parse_args,
+                None,
+                settings.LOADER_BATCH_CHARS if spill_path else 0,
+            )
+            for document in first.documents:
+                document.metadata.update(file_metadata)
+            if first.cursor is None:
+                batches = FileBatches(first)
+                logger.info(f"文件 {file_name} 解析完成 ({loader.name})")
+            else:
+                # 其余批次读取时继续解析，临时文件由 FileBatches 负责删除
+                batches = FileBatches(first, parse_args, spill_path, file_metadata)
+                spill_path = None
+                logger.info(f"文件 {file_name} 较大，分批解析 ({loader.name})")
+            _report("parsed", loader=loader.name, pages=first.units)
+            return LoadedFile(
+                file_id,
+                file_name,
+                content_hash,
+                batches,
+                metadata=file_metadata,
+            )
+        except Exception as e:
+            logger.error(f"处理文件 {file_name} 时出错: {str(e)}")
+            _report("failed", error=str(e))
+            return None
+        finally:
+            if spill_path and os.path.exists(spill_path):
+                os.unlink(spill_path)
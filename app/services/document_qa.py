@@ -3,23 +3,33 @@ from langchain.chains import ConversationalRetrievalChain
 from langchain.memory import ConversationBufferMemory
 from app.config.index import settings
 from app.logging.logging import logger
-from app.services.vector_store import VectorStore
+from app.services.answer_cache import CachedAnswer, SemanticAnswerCache
+from app.services.chat_cache import ChatCache
+from app.services.chat_history_writer import ChatHistoryWriter
+from app.services.memory import ConversationMemory
+from app.services.retriever import FaissRetriever
+from app.services.vector_store import VectorStoreRegistry
 from app.utils.mysql_client import MySQLClient
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import HTTPException
+from typing import Optional
 
 
 class DocumentQA:
     """文档问答核心类"""
 
-    def __init__(self, db: Session):
+    def __init__(self, db: AsyncSession):
         self.llm = None
+        self.condense_llm = None
         self.vectorstore = None
+        self.db = db
         self.mysql = MySQLClient(db)
-        self.init_resources()
+        self.cache = ChatCache(db)
+        # 本轮问题向量、索引版本、知识库和检索参数，用于写入语义缓存
+        self.answer_cache_key = None
 
-    def init_resources(self, streaming=False):
-        """初始化 LLM 和向量数据库"""
+    def init_resources(self, streaming=False, collection: str = None):
+        """初始化 LLM 并获取知识库在进程内共享的向量数据库"""
         self.llm = ChatOpenAI(
             model=settings.OPENAI_MODEL,
             openai_api_key=settings.OPENAI_API_KEY,
@@ -27,34 +37,49 @@ class DocumentQA:
             max_tokens=settings.MAX_TOKENS,
             streaming=streaming,
         )
-        self.vectorstore = VectorStore.load_vectorstore()
-        logger.info("FAISS 向量数据库已成功加载！")
+        # 问题改写使用非流式模型，避免改写结果混入流式输出
+        self.condense_llm = (
+            ChatOpenAI(
+                model=settings.OPENAI_MODEL,
+                openai_api_key=settings.OPENAI_API_KEY,
+                openai_api_base=settings.OPENAI_API_BASE,
+                max_tokens=settings.MAX_TOKENS,
+            )
+            if streaming
+            else None
+        )
+        self.vectorstore = VectorStoreRegistry().get(collection)
+        if self.vectorstore is None:
+            raise HTTPException(status_code=404, detail="向量数据库不存在")
 
     async def get_memory(
         self, session_id: str, user_id: str
     ) -> ConversationBufferMemory:
-        """获取带历史记录的记忆对象"""
-        memory = ConversationBufferMemory(
-            input_key="question",
-            output_key="answer",
-            memory_key="chat_history",
-            return_messages=True,
-        )
-
-        # 从MySQL加载历史记录
-        history = await self.mysql.get_chat_history(session_id, user_id)
-        for msg in history:
-            memory.save_context(
-                {"question": msg["question"]}, {"answer": msg["answer"]}
-            )
-        return memory
+        """获取只包含最近若干轮历史的记忆对象"""
+        return await ConversationMemory(self.db).load(session_id, user_id)
 
     async def create_qa_chain(
-        self, session_id: str, streaming_handler=None, user_id: str = None
+        self,
+        session_id: str,
+        streaming_handler=None,
+        user_id: str = None,
+        search_options: dict = None,
+        collection: str = None,
     ):
-        """创建问答链"""
+        """创建问答链
+
+        Args:
+            session_id: 会话ID
+            streaming_handler: 流式输出回调
+            user_id: 用户ID
+            search_options: 本次检索参数，可包含 k、nprobe、ef_search、vector_weight、
+                bm25_weight、rerank、filters
+            collection: 检索的知识库，默认知识库为空
+        """
+        self.init_resources(
+            streaming=streaming_handler is not None, collection=collection
+        )
         if streaming_handler:
-            self.init_resources(streaming=True)
             self.llm.callbacks = [streaming_handler]
 
         # 获取带历史记录的记忆对象
@@ -62,22 +87,85 @@ class DocumentQA:
 
         return ConversationalRetrievalChain.from_llm(
             llm=self.llm,
-            retriever=self.vectorstore.as_retriever(search_kwargs={"k": 3}),
+            retriever=FaissRetriever.from_options(
+                self.vectorstore, **(search_options or {}), collection=collection
+            ),
             memory=memory,
+            condense_question_llm=self.condense_llm,
             return_source_documents=True,
             output_key="answer",
         )
 
+    async def match_answer_cache(
+        self,
+        session_id: str,
+        user_id: str,
+        question: str,
+        collection: str = None,
+        search_options: dict = None,
+    ) -> Optional[CachedAnswer]:
+        """在语义缓存中查找相似问题的答案
+
+        默认只对会话的第一轮提问使用缓存，后续提问的答案依赖上下文。只匹配
+        检索参数 (search_options，不含 filters) 相同时生成的答案。
+        """
+        self.answer_cache_key = None
+        if not settings.SEMANTIC_CACHE_ENABLED:
+            return None
+        try:
+            if settings.SEMANTIC_CACHE_FIRST_TURN_ONLY and (
+                await self.cache.get_recent_turns(session_id, user_id, limit=1)
+            ):
+                return None
+
+            registry = VectorStoreRegistry()
+            vectorstore = registry.get(collection)
+            if vectorstore is None or vectorstore.embeddings is None:
+                return None
+            version = registry.get_version(collection)
+            vector = await vectorstore.embeddings.aembed_query(question)
+        except Exception as e:
+            logger.warning(f"查询语义缓存失败: {str(e)}")
+            return None
+
+        self.answer_cache_key = (vector, version, collection, search_options)
+        cached = SemanticAnswerCache().lookup(
+            vector, version, collection, search_options
+        )
+        if cached is not None:
+            logger.info(
+                f"语义缓存命中，相似度 {cached.score:.3f}，原问题: {cached.question}"
+            )
+        return cached
+
+    def store_answer_cache(self, question: str, answer: str, sources: list):
+        """缓存本轮生成的答案，只有查找过缓存的提问才会写入"""
+        if self.answer_cache_key is None:
+            return
+        vector, version, collection, search_options = self.answer_cache_key
+        SemanticAnswerCache().store(
+            vector, version, question, answer, sources, collection, search_options
+        )
+
     async def save_chat_history(
         self, session_id: str, question: str, answer: str, user_id: str, sources: list
     ):
-        """保存对话历史到MySQL"""
-        await self.mysql.save_chat_history(session_id, question, answer, user_id, sources)
+        """保存对话历史到MySQL，开启 write-behind 时只入队，由后台批量写入"""
+        if settings.CHAT_HISTORY_WRITE_BEHIND:
+            await ChatHistoryWriter().submit(
+                session_id, question, answer, user_id, sources
+            )
+        else:
+            saved = await self.mysql.save_chat_history(
+                session_id, question, answer, user_id, sources
+            )
+            await ChatCache.on_saved([{"user_id": user_id}], saved)
+        ConversationMemory.schedule_summary(session_id, user_id)
 
     async def get_chat_history(self, session_id: str, user_id: str):
         """获取聊天历史"""
         # 检查 session_id 是否存在
-        history = await self.mysql.get_chat_history(session_id, user_id)
+        history = await self.cache.get_chat_history(session_id, user_id)
         if not history:
             raise HTTPException(status_code=404, detail=f"会话 ID {session_id} 不存在")
         return history
@@ -88,4 +176,4 @@ class DocumentQA:
 
     async def get_session(self, user_id: str):
         """获取会话列表"""
-        return await self.mysql.get_session(user_id)
+        return await self.cache.get_session(user_id)
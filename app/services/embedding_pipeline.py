@@ -0,0 +1,223 @@
+import asyncio
+import random
+import time
+from typing import AsyncIterable, Iterable, List, Optional, Union
+
+import openai
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from app.config.index import settings
+from app.logging.logging import logger
+
+# 可重试的瞬时错误，限流错误单独处理
+TRANSIENT_ERRORS = (
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+
+class AdaptiveRateLimiter:
+    """自适应并发限制器
+
+    收到 429 时并发上限减半并进入冷却期，连续成功后逐步恢复 (AIMD)。
+    """
+
+    def __init__(self, max_concurrency: int):
+        self.max_concurrency = max(1, max_concurrency)
+        self.limit = self.max_concurrency
+        self.in_flight = 0
+        self.success_streak = 0
+        self.cooldown_until = 0.0
+        self._cond = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._cond:
+            while True:
+                delay = self.cooldown_until - time.monotonic()
+                if delay > 0:
+                    try:
+                        await asyncio.wait_for(self._cond.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                if self.in_flight < self.limit:
+                    break
+                await self._cond.wait()
+            self.in_flight += 1
+
+    async def release(self, rate_limited: bool = False, retry_after: float = 0.0):
+        async with self._cond:
+            self.in_flight -= 1
+            if rate_limited:
+                self.limit = max(1, self.limit // 2)
+                self.success_streak = 0
+                self.cooldown_until = max(
+                    self.cooldown_until, time.monotonic() + retry_after
+                )
+                logger.warning(
+                    f"向量化请求被限流，并发上限降为 {self.limit}，冷却 {retry_after:.1f}s"
+                )
+            else:
+                self.success_streak += 1
+                if self.limit < self.max_concurrency and self.success_streak >= self.limit:
+                    self.limit += 1
+                    self.success_streak = 0
+            self._cond.notify_all()
+
+
+class EmbeddingPipeline:
+    """分批、并发的向量化流水线
+
+    文档按 batch_size 分批，在并发上限内同时请求向量模型，每批完成后立即
+    写入 FAISS 索引；单批失败时按指数退避重试，遇到 429 自动降低并发。
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        batch_size: int = None,
+        max_concurrency: int = None,
+        max_retries: int = None,
+    ):
+        self.embeddings = embeddings
+        self.batch_size = batch_size or settings.EMBEDDING_BATCH_SIZE
+        self.max_concurrency = max_concurrency or settings.EMBEDDING_CONCURRENCY
+        self.max_retries = (
+            settings.EMBEDDING_MAX_RETRIES if max_retries is None else max_retries
+        )
+        self.limiter = AdaptiveRateLimiter(self.max_concurrency)
+
+    async def add_documents(
+        self,
+        documents: Union[Iterable[Document], AsyncIterable[Document]],
+        vectorstore: Optional[FAISS] = None,
+        query_embedding: Embeddings = None,
+        progress=None,
+    ) -> Optional[FAISS]:
+        """向量化文档并写入索引
+
+        Args:
+            documents: 文档块，可以是列表或异步迭代器
+            vectorstore: 已有的索引，为空时用第一批结果创建
+            query_embedding: 新建索引时绑定的查询向量模型，默认与流水线相同
+            progress: 进度记录对象(IngestionJob)，每批写入后累加向量数
+
+        Returns:
+            FAISS: 写入后的索引，没有任何文档时返回传入的 vectorstore
+        """
+        pending = set()
+        total = 0
+        started = time.monotonic()
+
+        def _write(task: asyncio.Task):
+            nonlocal vectorstore, total
+            batch, vectors = task.result()
+            text_embeddings = [
+                (doc.page_content, vector) for doc, vector in zip(batch, vectors)
+            ]
+            metadatas = [doc.metadata for doc in batch]
+            # 上游已分配文本块ID时沿用，便于索引清单按文件追踪
+            ids = [doc.id for doc in batch] if all(doc.id for doc in batch) else None
+            if vectorstore is None:
+                vectorstore = FAISS.from_embeddings(
+                    text_embeddings,
+                    query_embedding or self.embeddings,
+                    metadatas=metadatas,
+                    ids=ids,
+                )
+            else:
+                vectorstore.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+            total += len(batch)
+            if progress is not None:
+                progress.add_embeddings(len(batch))
+
+        try:
+            async for batch in self._batches(documents):
+                # 在途批次数量有上限，避免上游一次性堆积全部文档
+                while len(pending) >= self.max_concurrency * 2:
+                    done, pending = await asyncio.wait(
+                        pending, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    for task in done:
+                        _write(task)
+                pending.add(asyncio.create_task(self._embed_batch(batch)))
+
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    _write(task)
+        except BaseException:
+            for task in pending:
+                task.cancel()
+            raise
+
+        if total:
+            elapsed = time.monotonic() - started
+            logger.info(
+                f"向量化完成，共 {total} 个文本块，耗时 {elapsed:.1f}s，"
+                f"{total / max(elapsed, 1e-6):.1f} 块/秒"
+            )
+        return vectorstore
+
+    async def _batches(self, documents):
+        batch = []
+        if hasattr(documents, "__aiter__"):
+            async for doc in documents:
+                batch.append(doc)
+                if len(batch) >= self.batch_size:
+                    yield batch
+                    batch = []
+        else:
+            for doc in documents:
+                batch.append(doc)
+                if len(batch) >= self.batch_size:
+                    yield batch
+                    batch = []
+        if batch:
+            yield batch
+
+    async def _embed_batch(self, batch: List[Document]):
+        texts = [doc.page_content for doc in batch]
+        attempt = 0
+        while True:
+            await self.limiter.acquire()
+            try:
+                vectors = await self.embeddings.aembed_documents(texts)
+            except openai.RateLimitError as e:
+                delay = self._retry_after(e) or self._backoff(attempt)
+                await self.limiter.release(rate_limited=True, retry_after=delay)
+                error = e
+            except TRANSIENT_ERRORS as e:
+                delay = self._backoff(attempt)
+                await self.limiter.release()
+                error = e
+            except BaseException:
+                await self.limiter.release()
+                raise
+            else:
+                await self.limiter.release()
+                return batch, vectors
+
+            attempt += 1
+            if attempt > self.max_retries:
+                raise error
+            logger.warning(
+                f"向量化批次失败，{delay:.1f}s 后第 {attempt} 次重试: {str(error)}"
+            )
+            await asyncio.sleep(delay)
+
+    @staticmethod
+    def _backoff(attempt: int) -> float:
+        return min(60.0, 2**attempt) + random.uniform(0, 1)
+
+    @staticmethod
+    def _retry_after(error: openai.APIStatusError) -> Optional[float]:
+        try:
+            return float(error.response.headers.get("retry-after"))
+        except (AttributeError, TypeError, ValueError):
+            return None
@@ -0,0 +1,247 @@
+import asyncio
+import hashlib
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_openai import OpenAIEmbeddings
+
+from app.config.index import settings
+from app.logging.logging import logger
+
+OPENAI = "openai"
+LOCAL = "local"
+PROVIDERS = (OPENAI, LOCAL)
+
+# 子进程中加载的模型，由进程池的 initializer 创建
+_worker_model = None
+
+
+def embedding_model_id() -> str:
+    """当前向量模型的标识，写入索引清单，加载索引时与之比对
+
+    本地模型的标识包含 model.onnx 内容的哈希和影响向量的配置 (池化方式、
+    查询前缀、最大长度)，目录同名的不同模型或修改这些配置后标识不同。
+    """
+    if settings.EMBEDDING_PROVIDER == LOCAL:
+        model_path = os.path.normpath(settings.LOCAL_EMBEDDING_MODEL_PATH)
+        model_file = os.path.join(model_path, "model.onnx")
+        stat = os.stat(model_file)
+        digest = _local_model_digest(
+            model_file,
+            stat.st_size,
+            stat.st_mtime_ns,
+            settings.LOCAL_EMBEDDING_POOLING,
+            settings.LOCAL_EMBEDDING_QUERY_PREFIX,
+            settings.LOCAL_EMBEDDING_MAX_LENGTH,
+        )
+        return f"{LOCAL}:{os.path.basename(model_path)}:{digest}"
+    return settings.EMBEDDING_MODEL
+
+
+@lru_cache(maxsize=8)
+def _local_model_digest(
+    model_file: str, size: int, mtime_ns: int, pooling: str, prefix: str, max_length: int
+) -> str:
+    """模型文件内容和向量配置的哈希，按文件大小和修改时间缓存，只计算一次"""
+    digest = hashlib.blake2b(digest_size=8)
+    with open(model_file, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    digest.update(f"|{pooling}|{prefix}|{max_length}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def create_embeddings(max_retries: int = 2) -> Embeddings:
+    """按 EMBEDDING_PROVIDER 创建向量模型
+
+    Args:
+        max_retries: OpenAI 客户端内部重试次数，本地模型忽略该参数
+    """
+    provider = settings.EMBEDDING_PROVIDER
+    if provider == OPENAI:
+        return OpenAIEmbeddings(
+            model=settings.EMBEDDING_MODEL,
+            openai_api_key=settings.OPENAI_API_KEY,
+            openai_api_base=settings.OPENAI_API_BASE,
+            max_retries=max_retries,
+        )
+    if provider == LOCAL:
+        return LocalEmbeddings()
+    raise ValueError(
+        f"不支持的向量模型提供方: {provider}，可选 {', '.join(PROVIDERS)}"
+    )
+
+
+class OnnxEmbeddingModel:
+    """ONNX 格式的句向量模型 (如 bge、m3e、e5 导出的模型)
+
+    模型目录中需要包含 model.onnx 和 tokenizer.json，依赖 onnxruntime 和
+    tokenizers，均为可选依赖。文本先按长度排序再分批，每批只补齐到该批
+    最长的文本，输出按注意力掩码做平均池化 (或取 CLS) 后归一化。
+    """
+
+    def __init__(self, model_path: str, threads: int = None):
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads or settings.LOCAL_EMBEDDING_THREADS
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(model_path, "model.onnx"),
+            sess_options=options,
+            providers=["CPUExecutionProvider"],
+        )
+        self.input_names = {item.name for item in self.session.get_inputs()}
+        self.output_names = [item.name for item in self.session.get_outputs()]
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_path, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=settings.LOCAL_EMBEDDING_MAX_LENGTH)
+        self.tokenizer.no_padding()
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        # 长度相近的文本放在同一批，减少补齐的 token
+        order = np.argsort([len(e.ids) for e in encodings], kind="stable")
+        vectors = [None] * len(texts)
+        batch_size = settings.LOCAL_EMBEDDING_BATCH_SIZE
+        for start in range(0, len(order), batch_size):
+            indices = order[start : start + batch_size]
+            batch = self._encode_batch([encodings[i] for i in indices])
+            for i, vector in zip(indices, batch):
+                vectors[i] = vector
+        return np.stack(vectors) if vectors else np.zeros((0, 0), dtype=np.float32)
+
+    def _encode_batch(self, encodings) -> np.ndarray:
+        length = max(len(e.ids) for e in encodings)
+        input_ids = np.zeros((len(encodings), length), dtype=np.int64)
+        attention_mask = np.zeros((len(encodings), length), dtype=np.int64)
+        for row, encoding in enumerate(encodings):
+            input_ids[row, : len(encoding.ids)] = encoding.ids
+            attention_mask[row, : len(encoding.ids)] = 1
+        inputs = {
+            "input_ids": input_ids,
+            "attention_mask": attention_mask,
+            "token_type_ids": np.zeros_like(input_ids),
+        }
+        outputs = dict(
+            zip(
+                self.output_names,
+                self.session.run(
+                    None,
+                    {name: value for name, value in inputs.items() if name in self.input_names},
+                ),
+            )
+        )
+        if "sentence_embedding" in outputs:
+            vectors = outputs["sentence_embedding"]
+        else:
+            hidden = outputs.get("last_hidden_state", next(iter(outputs.values())))
+            if settings.LOCAL_EMBEDDING_POOLING == "cls":
+                vectors = hidden[:, 0]
+            else:
+                mask = attention_mask[:, :, None].astype(hidden.dtype)
+                vectors = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        vectors = vectors.astype(np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+
+def _init_worker(model_path: str):
+    global _worker_model
+    # 每个子进程单线程推理，由进程数决定并行度
+    _worker_model = OnnxEmbeddingModel(model_path, threads=1)
+
+
+def _encode_in_worker(texts: List[str]) -> np.ndarray:
+    return _worker_model.encode(texts)
+
+
+class LocalEmbeddings(Embeddings):
+    """在本机 CPU 上运行的向量模型，不依赖外部 API
+
+    查询向量在当前进程中计算，几毫秒即可返回；批量入库时配置了
+    LOCAL_EMBEDDING_WORKERS 则把文本分片交给进程池并行计算，每个子进程
+    启动时加载一次模型。
+    """
+
+    _model = None
+    _pool = None
+    _lock = threading.Lock()
+
+    def __init__(self, model_path: str = None):
+        self.model_path = model_path or settings.LOCAL_EMBEDDING_MODEL_PATH
+        if not self.model_path:
+            raise ValueError("使用本地向量模型需要配置 LOCAL_EMBEDDING_MODEL_PATH")
+
+    @classmethod
+    def get_model(cls, model_path: str) -> OnnxEmbeddingModel:
+        with cls._lock:
+            if cls._model is None:
+                cls._model = OnnxEmbeddingModel(model_path)
+                logger.info(f"本地向量模型已加载: {model_path}")
+            return cls._model
+
+    @classmethod
+    def get_pool(cls, model_path: str) -> Optional[ProcessPoolExecutor]:
+        if settings.LOCAL_EMBEDDING_WORKERS <= 0:
+            return None
+        with cls._lock:
+            if cls._pool is None:
+                # 服务进程中有多个线程，使用 spawn 避免 fork 继承锁状态
+                cls._pool = ProcessPoolExecutor(
+                    max_workers=settings.LOCAL_EMBEDDING_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(model_path,),
+                )
+            return cls._pool
+
+    @classmethod
+    def shutdown(cls):
+        """关闭向量化进程池"""
+        with cls._lock:
+            if cls._pool is not None:
+                cls._pool.shutdown(wait=False, cancel_futures=True)
+                cls._pool = None
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        return self.get_model(self.model_path).encode(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_queries([text])[0]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        prefix = settings.LOCAL_EMBEDDING_QUERY_PREFIX
+        return self.embed_documents([prefix + text for text in texts])
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        pool = self.get_pool(self.model_path)
+        if pool is None:
+            return await asyncio.to_thread(self.embed_documents, texts)
+
+        # 按进程数分片并行计算，结果按原顺序拼接
+        loop = asyncio.get_running_loop()
+        size = -(-len(texts) // settings.LOCAL_EMBEDDING_WORKERS)
+        parts = await asyncio.gather(
+            *(
+                loop.run_in_executor(pool, _encode_in_worker, texts[start : start + size])
+                for start in range(0, len(texts), size)
+            )
+        )
+        return np.concatenate(parts).tolist()
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_queries([text]))[0]
+
+    async def aembed_queries(self, texts: List[str]) -> List[List[float]]:
+        # onnxruntime 推理时释放 GIL，放到线程池中不阻塞事件循环
+        return await asyncio.to_thread(self.embed_queries, texts)
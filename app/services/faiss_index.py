@@ -0,0 +1,458 @@
+import math
+import os
+import time
+from typing import List, Optional, Tuple
+
+import faiss
+import numpy as np
+
+from app.config.index import settings
+from app.logging.logging import logger
+
+FLAT = "Flat"
+INDEX_FILE = "index.faiss"
+# 过滤检索时 HNSW efSearch 放大的上限
+MAX_FILTERED_EF_SEARCH = 1024
+# 非精确索引在版本目录中额外保存的原始向量，用于增量更新、重新训练、精确重排和召回率评估
+VECTORS_FILE = "vectors.npy"
+# Matryoshka 截断前缀：Trunc256,SQfp16 表示只保留向量前 256 维并重新归一化后再建索引
+TRUNCATE_PREFIX = "Trunc"
+
+
+def is_flat(index) -> bool:
+    """是否为精确检索的 Flat 索引"""
+    return isinstance(index, faiss.IndexFlat)
+
+
+def is_lossy(index) -> bool:
+    """索引是否有损地压缩了向量 (标量/乘积量化或降维)，检索后值得用原始向量精确重排"""
+    if isinstance(index, faiss.IndexPreTransform):
+        return True
+    inner = _unwrap(index)
+    if isinstance(inner, (faiss.IndexFlat, faiss.IndexIVFFlat)):
+        return False
+    if isinstance(inner, faiss.IndexHNSW):
+        return not isinstance(faiss.downcast_index(inner.storage), faiss.IndexFlat)
+    return True
+
+
+def split_truncation(factory: str) -> Tuple[Optional[int], str]:
+    """拆出索引工厂字符串开头的 Trunc{dim}，返回 (截断维数, 其余部分)"""
+    head, _, rest = factory.partition(",")
+    dim = head[len(TRUNCATE_PREFIX) :]
+    if head.startswith(TRUNCATE_PREFIX) and dim.isdigit() and rest:
+        return int(dim), rest
+    return None, factory
+
+
+def resolve_factory(factory: str, ntotal: int) -> str:
+    """解析索引工厂字符串中的 {nlist} 占位符
+
+    nlist 取 4*sqrt(n)，并保证每个聚类中心至少有 39 个训练样本。
+    """
+    if "{nlist}" not in factory:
+        return factory
+    nlist = int(4 * math.sqrt(max(ntotal, 1)))
+    nlist = max(1, min(nlist, ntotal // 39))
+    return factory.replace("{nlist}", str(nlist))
+
+
+def flat_index(vectors: np.ndarray, metric: int = faiss.METRIC_L2) -> faiss.Index:
+    """用原始向量构建精确索引"""
+    index = faiss.IndexFlat(vectors.shape[1], metric)
+    if len(vectors):
+        index.add(np.ascontiguousarray(vectors, dtype=np.float32))
+    return index
+
+
+def get_vectors(index: faiss.Index) -> np.ndarray:
+    """从 Flat 索引中取出全部原始向量"""
+    if index.ntotal == 0:
+        return np.zeros((0, index.d), dtype=np.float32)
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def build_index(
+    vectors: np.ndarray,
+    factory: str,
+    metric: int = faiss.METRIC_L2,
+    trained_index: Optional[faiss.Index] = None,
+) -> faiss.Index:
+    """按索引工厂字符串构建近似检索索引
+
+    Args:
+        vectors: 全部原始向量，顺序与 docstore 映射一致
+        factory: faiss.index_factory 描述，如 HNSW32、IVF{nlist},Flat、OPQ16,IVF{nlist},PQ16、
+            SQfp16、SQ8、PCA256,SQ8，可加 Trunc{dim} 前缀按 Matryoshka 方式截断维度
+        metric: 距离度量，与原 Flat 索引一致
+        trained_index: 已训练的同类索引，数据量增长不大时复用其训练结果
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    ntotal, dim = vectors.shape
+    if trained_index is not None:
+        index = _copy_index(trained_index)
+        index.reset()
+    else:
+        factory = resolve_factory(factory, ntotal)
+        index = _index_from_factory(dim, factory, metric)
+        if not index.is_trained:
+            sample = _training_sample(vectors)
+            if len(sample) == 0:
+                logger.warning("没有可用于训练的向量，使用 Flat 索引")
+                return flat_index(vectors, metric)
+            started = time.monotonic()
+            try:
+                index.train(sample)
+            except RuntimeError as e:
+                # 数据量过小无法训练 (如 PQ 需要的样本数不足) 时退回精确索引
+                logger.warning(f"训练索引 {factory} 失败，使用 Flat 索引: {str(e)}")
+                return flat_index(vectors, metric)
+            logger.info(
+                f"索引 {factory} 训练完成，样本 {len(sample)} 条，"
+                f"耗时 {time.monotonic() - started:.1f}s"
+            )
+
+    hnsw = _find_hnsw(index)
+    if hnsw is not None:
+        hnsw.efConstruction = settings.FAISS_HNSW_EF_CONSTRUCTION
+    if ntotal:
+        index.add(vectors)
+    return index
+
+
+def _index_from_factory(dim: int, factory: str, metric: int) -> faiss.Index:
+    truncate, factory = split_truncation(factory)
+    if truncate is None or truncate >= dim:
+        return faiss.index_factory(dim, factory, metric)
+    # 输入先截取前 truncate 维再归一化，查询向量经过同样的变换，无需在外部处理
+    index = faiss.index_factory(truncate, f"L2norm,{factory}", metric)
+    remap = faiss.RemapDimensionsTransform(dim, truncate, False)
+    # 变换交给索引释放，避免 Python 对象回收时重复释放
+    remap.this.disown()
+    index.prepend_transform(remap)
+    return index
+
+
+def _copy_index(index: faiss.Index) -> faiss.Index:
+    try:
+        return faiss.clone_index(index)
+    except RuntimeError:
+        # 部分向量变换不支持 clone，通过序列化复制
+        return faiss.deserialize_index(faiss.serialize_index(index))
+
+
+def can_reuse_training(index_info: dict, factory: str, ntotal: int) -> bool:
+    """已有索引的训练结果是否仍可使用：工厂相同且数据量增长未超过阈值"""
+    trained_size = index_info.get("trained_size") or 0
+    return (
+        index_info.get("factory") == factory
+        and trained_size > 0
+        and ntotal <= trained_size * settings.FAISS_RETRAIN_GROWTH
+    )
+
+
+def _training_sample(vectors: np.ndarray) -> np.ndarray:
+    size = min(len(vectors), settings.FAISS_TRAIN_SAMPLE)
+    if size == len(vectors):
+        return vectors
+    rng = np.random.default_rng(0)
+    return vectors[np.sort(rng.choice(len(vectors), size, replace=False))]
+
+
+def _find_hnsw(index):
+    index = _unwrap(index)
+    if isinstance(index, faiss.IndexHNSW):
+        return index.hnsw
+    return None
+
+
+def _unwrap(index):
+    """去掉预处理变换 (OPQ/PCA 等) 外壳，返回实际的检索索引"""
+    while isinstance(index, faiss.IndexPreTransform):
+        index = faiss.downcast_index(index.index)
+    return faiss.downcast_index(index)
+
+
+def id_selector(positions: np.ndarray, ntotal: int):
+    """用允许检索的序号构建位图选择器，检索时直接跳过其他向量"""
+    mask = np.zeros(ntotal, dtype=bool)
+    mask[positions] = True
+    bitmap = np.packbits(mask, bitorder="little")
+    selector = faiss.IDSelectorBitmap(ntotal, faiss.swig_ptr(bitmap))
+    # 保留引用，避免位图在检索前被回收
+    selector.referenced_bitmap = bitmap
+    return selector
+
+
+def search_parameters(
+    index,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    selector=None,
+    selectivity: float = 1.0,
+):
+    """构造单次检索的参数，不修改共享索引的全局设置
+
+    带过滤条件时，IVF 的 nprobe 和 HNSW 的 efSearch 按允许检索的比例放大，
+    保证过滤后仍能找到足够的结果。
+
+    Args:
+        index: 检索使用的索引
+        nprobe: IVF 索引检索的聚类数，默认 FAISS_NPROBE
+        ef_search: HNSW 索引检索的候选队列长度，默认 FAISS_EF_SEARCH
+        selector: 只检索选中向量的 IDSelector
+        selectivity: 选中向量占全部向量的比例
+    """
+    scale = 1 / max(selectivity, 1e-6) if selector is not None else 1.0
+    inner = _unwrap(index)
+    if isinstance(inner, faiss.IndexIVF):
+        params = faiss.SearchParametersIVF()
+        params.nprobe = min(
+            math.ceil((nprobe or settings.FAISS_NPROBE) * scale), inner.nlist
+        )
+    elif isinstance(inner, faiss.IndexHNSW):
+        params = faiss.SearchParametersHNSW()
+        params.efSearch = min(
+            math.ceil((ef_search or settings.FAISS_EF_SEARCH) * scale),
+            max(ef_search or settings.FAISS_EF_SEARCH, MAX_FILTERED_EF_SEARCH),
+        )
+    elif selector is not None:
+        params = faiss.SearchParameters()
+    else:
+        return None
+    if selector is not None:
+        params.sel = selector
+        params.referenced_selector = selector
+
+    if isinstance(index, faiss.IndexPreTransform):
+        wrapper = faiss.SearchParametersPreTransform()
+        wrapper.index_params = params
+        # 保留引用，避免内层参数对象被提前回收
+        wrapper.referenced_params = params
+        return wrapper
+    return params
+
+
+def search(index, queries: np.ndarray, k: int, params=None):
+    """检索 k 个最近邻，返回 (距离, 序号)"""
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    if params is None:
+        return index.search(queries, k)
+    return index.search(queries, k, params=params)
+
+
+def rescore(
+    vectors: np.ndarray, query: np.ndarray, positions, metric: int, k: int
+) -> List[int]:
+    """用原始向量重新计算候选的精确距离，返回距离最近的 k 个序号
+
+    vectors 通常是以内存映射打开的 vectors.npy，只读取候选所在的行。
+    """
+    positions = np.sort(np.asarray(positions, dtype=np.int64))
+    if len(positions) == 0:
+        return []
+    candidates = np.asarray(vectors[positions], dtype=np.float32)
+    query = np.asarray(query, dtype=np.float32).reshape(-1)
+    if metric == faiss.METRIC_INNER_PRODUCT:
+        distances = -(candidates @ query)
+    else:
+        distances = ((candidates - query) ** 2).sum(axis=1)
+    best = np.argsort(distances, kind="stable")[:k]
+    return positions[best].tolist()
+
+
+def write_index(index, path: str):
+    faiss.write_index(index, os.path.join(path, INDEX_FILE))
+
+
+def read_index(path: str, mmap: bool = False) -> faiss.Index:
+    """读取版本目录中的索引
+
+    mmap 为 True 时以只读内存映射方式打开，IVF 索引的倒排数据直接映射
+    文件，多个进程共享操作系统页缓存；不支持映射的索引退回普通读取。
+    """
+    file_path = os.path.join(path, INDEX_FILE)
+    if mmap:
+        try:
+            return faiss.read_index(
+                file_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+            )
+        except RuntimeError as e:
+            logger.warning(f"内存映射加载索引失败，改为完整读取: {str(e)}")
+    return faiss.read_index(file_path)
+
+
+def save_vectors(path: str, vectors: np.ndarray):
+    np.save(os.path.join(path, VECTORS_FILE), vectors)
+
+
+def load_vectors(path: str, mmap: bool = False) -> Optional[np.ndarray]:
+    """读取版本目录中的原始向量，不存在时返回 None"""
+    file_path = os.path.join(path, VECTORS_FILE)
+    if not os.path.isfile(file_path):
+        return None
+    return np.load(file_path, mmap_mode="r" if mmap else None)
+
+
+def index_size(index) -> int:
+    """索引序列化后的字节数，近似其内存占用"""
+    return int(faiss.serialize_index(index).nbytes)
+
+
+def recall_report(
+    index,
+    vectors: np.ndarray,
+    k: int = 10,
+    num_queries: int = 100,
+    nprobe_values: List[int] = None,
+    ef_search_values: List[int] = None,
+) -> dict:
+    """以精确检索结果为基准，评估近似索引在不同检索参数下的召回率和延迟
+
+    查询取自库中随机抽样的向量，召回率为 recall@k。
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    ntotal = len(vectors)
+    if ntotal == 0:
+        return {"ntotal": 0, "results": []}
+
+    k = min(k, ntotal)
+    rng = np.random.default_rng(0)
+    queries = vectors[rng.choice(ntotal, min(num_queries, ntotal), replace=False)]
+
+    exact = flat_index(vectors, index.metric_type)
+    started = time.perf_counter()
+    _, truth = exact.search(queries, k)
+    flat_ms = (time.perf_counter() - started) * 1000 / len(queries)
+
+    inner = _unwrap(index)
+    if isinstance(inner, faiss.IndexIVF):
+        knob = "nprobe"
+        values = nprobe_values or [1, 4, 8, 16, 32, 64]
+        values = sorted({min(value, inner.nlist) for value in values})
+    elif isinstance(inner, faiss.IndexHNSW):
+        knob = "ef_search"
+        values = ef_search_values or [16, 32, 64, 128, 256]
+    else:
+        knob, values = None, [None]
+
+    results = []
+    for value in values:
+        params = search_parameters(
+            index,
+            nprobe=value if knob == "nprobe" else None,
+            ef_search=value if knob == "ef_search" else None,
+        )
+        started = time.perf_counter()
+        _, found = search(index, queries, k, params)
+        latency_ms = (time.perf_counter() - started) * 1000 / len(queries)
+        result = {
+            "recall": _recall(truth, found),
+            "latency_ms": round(latency_ms, 3),
+        }
+        if knob is not None:
+            result[knob] = value
+        results.append(result)
+
+    return {
+        "index_type": type(inner).__name__,
+        "ntotal": int(index.ntotal),
+        "dimension": int(index.d),
+        "k": k,
+        "queries": len(queries),
+        "index_bytes": index_size(index),
+        "flat_bytes": int(vectors.nbytes),
+        "flat_latency_ms": round(flat_ms, 3),
+        "results": results,
+    }
+
+
+def default_compression_factories(dim: int) -> List[str]:
+    """压缩对比报告默认比较的存储方式"""
+    # 乘积量化的子空间数需整除维数，每个子空间约 16 维
+    m = max(1, dim // 16)
+    while dim % m:
+        m -= 1
+    factories = [FLAT, "SQfp16", "SQ8", f"PQ{m}"]
+    if dim >= 128:
+        factories += [f"PCA{dim // 2},SQ8", f"{TRUNCATE_PREFIX}{dim // 2},SQfp16"]
+    return factories
+
+
+def compression_report(
+    vectors: np.ndarray,
+    factories: List[str] = None,
+    metric: int = faiss.METRIC_L2,
+    k: int = 10,
+    num_queries: int = 100,
+    rescore_factor: int = 0,
+) -> dict:
+    """比较不同压缩存储方式的内存占用、召回率和延迟
+
+    每种方式用同一批向量构建索引，以精确检索结果为基准计算 recall@k；
+    有损方式另外给出多取 rescore_factor 倍候选、用原始向量精确重排后的召回率。
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    ntotal, dim = vectors.shape
+    if ntotal == 0:
+        return {"ntotal": 0, "results": []}
+
+    k = min(k, ntotal)
+    rng = np.random.default_rng(0)
+    queries = vectors[rng.choice(ntotal, min(num_queries, ntotal), replace=False)]
+    _, truth = flat_index(vectors, metric).search(queries, k)
+
+    results = []
+    for factory in factories or default_compression_factories(dim):
+        started = time.monotonic()
+        try:
+            index = build_index(vectors, factory, metric)
+        except RuntimeError as e:
+            results.append({"factory": factory, "error": str(e)})
+            continue
+        build_seconds = time.monotonic() - started
+
+        started = time.perf_counter()
+        _, found = search(index, queries, k)
+        latency_ms = (time.perf_counter() - started) * 1000 / len(queries)
+        size = index_size(index)
+        result = {
+            "factory": factory,
+            "index_type": type(_unwrap(index)).__name__,
+            "index_bytes": size,
+            "bytes_per_vector": round(size / ntotal, 1),
+            "compression_ratio": round(vectors.nbytes / max(size, 1), 2),
+            "recall": _recall(truth, found),
+            "latency_ms": round(latency_ms, 3),
+            "build_seconds": round(build_seconds, 2),
+        }
+        if rescore_factor > 1 and is_lossy(index):
+            started = time.perf_counter()
+            _, candidates = search(index, queries, min(ntotal, k * rescore_factor))
+            rescored = [
+                rescore(vectors, query, row[row >= 0], metric, k)
+                for query, row in zip(queries, candidates)
+            ]
+            result["rescored_recall"] = _recall(truth, rescored)
+            result["rescored_latency_ms"] = round(
+                (time.perf_counter() - started) * 1000 / len(queries), 3
+            )
+        results.append(result)
+
+    return {
+        "ntotal": ntotal,
+        "dimension": dim,
+        "k": k,
+        "queries": len(queries),
+        "flat_bytes": int(vectors.nbytes),
+        "rescore_factor": rescore_factor,
+        "results": results,
+    }
+
+
+def _recall(truth: np.ndarray, found) -> float:
+    hits = sum(
+        len(set(row_truth) & {int(i) for i in row_found if i >= 0})
+        for row_truth, row_found in zip(truth, found)
+    )
+    return round(hits / truth.size, 4)
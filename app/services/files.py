@@ -1,6 +1,8 @@
-from sqlalchemy.orm import Session
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.utils.mysql_client import MySQLClient
 from app.db.models.chat import files
+from app.services.collection import DEFAULT_COLLECTION, Collection, files_filter
 from fastapi import HTTPException
 from fastapi import UploadFile
 from pathlib import Path
@@ -9,40 +11,71 @@ import shutil
 from app.utils.minio_client import MinioClient
 
 
+def object_name(collection: str, file_id: int, file_name: str) -> str:
+    """文件在 MinIO 中的对象名称
+
+    按知识库和文件ID区分，不同知识库或租户上传的同名文件互不覆盖。
+    """
+    return f"{collection}/{file_id}/{file_name}"
+
+
 class Files:
-    def __init__(self, db: Session):
+    def __init__(self, db: AsyncSession):
         self.db = db
         self.minio = MinioClient()
 
-    def create_file(self, file: files):
+    async def create_file(self, file: files):
         try:
             self.db.add(file)
-            self.db.commit()
-            self.db.refresh(file)
+            await self.db.commit()
+            await self.db.refresh(file)
             return file
         except Exception as e:
-            self.db.rollback()
+            await self.db.rollback()
             raise e
 
-    async def uploadfile(self, upload_files: list[UploadFile] = File(...)):
-        """上传文档"""
+    async def uploadfile(
+        self,
+        upload_files: list[UploadFile] = File(...),
+        user_id: str = None,
+        tags: str = None,
+        collection: str = None,
+    ):
+        """上传文档
+
+        Args:
+            upload_files: 文档文件列表
+            user_id: 上传者/所属租户ID
+            tags: 逗号分隔的标签
+            collection: 所属知识库，默认知识库为空
+        """
+        collection = Collection(collection).name
+        tags = ",".join(tag.strip() for tag in (tags or "").split(",") if tag.strip())
         try:
             results = []
             for file in upload_files:
                 # 读取文件内容
                 content = await file.read()
 
-                # 直接上传到MinIO
-                file_url = await self.minio.upload_file_bytes(
-                    file_bytes=content, object_name=file.filename
-                )
-
-                # 保存文件信息到数据库
+                # 先写入数据库获得文件ID，再按知识库和文件ID上传到MinIO
                 file_info = files(
                     file_name=file.filename,
-                    file_path=file_url,
+                    file_path="",
+                    user_id=user_id,
+                    tags=tags or None,
+                    collection=collection,
+                )
+                self.db.add(file_info)
+                await self.db.flush()
+                file_info.file_path = object_name(
+                    collection, file_info.id, file.filename
                 )
-                self.create_file(file_info)
+                await self.minio.upload_file_bytes(
+                    file_bytes=content,
+                    object_name=file_info.file_path,
+                    content_type=file.content_type,
+                )
+                await self.db.commit()
 
                 results.append(file.filename)
 
@@ -50,41 +83,72 @@ class Files:
                 "message": "文件上传成功",
                 "uploaded_files": results,
                 "total_files": len(results),
+                "collection": collection,
             }
         except Exception as e:
+            await self.db.rollback()
             raise HTTPException(status_code=500, detail=f"文件上传失败: {str(e)}")
 
-    async def files_study(self):
-        """设置文件为已学习状态"""
+    async def files_study(self, file_ids: list[int] = None):
+        """设置文件为已学习状态
+
+        Args:
+            file_ids: 本次已处理的文件ID，为空时更新所有未学习的文件
+        """
         try:
-            # 更新所有未学习文件的状态
-            unprocessed_files = self.db.query(files).filter(
-                files.is_study == False, files.is_deleted == False
+            # 更新未学习文件的状态
+            statement = (
+                update(files)
+                .where(files.is_study == False, files.is_deleted == False)
+                .values(is_study=True)
             )
+            if file_ids is not None:
+                statement = statement.where(files.id.in_(file_ids))
 
-            for file in unprocessed_files:
-                file.is_study = True
-
-            self.db.commit()
+            await self.db.execute(statement)
+            await self.db.commit()
             return {"message": "文件学习状态更新成功"}
         except Exception as e:
-            self.db.rollback()
+            await self.db.rollback()
             raise HTTPException(status_code=500, detail=f"文件学习失败: {str(e)}")
 
-    async def files_list(self):
-        """文件列表"""
+    async def files_unsupported(self, file_ids: list[int]):
+        """标记格式不支持的文件，之后的重建不再处理
+
+        Args:
+            file_ids: 格式不支持的文件ID
+        """
         try:
-            # 查询所有未删除的文件
-            files_list = (
-                self.db.query(
-                    files.id,
-                    files.file_name,
-                    files.file_path,
-                    files.is_study,
-                )
-                .filter(files.is_deleted == False)
-                .all()
+            await self.db.execute(
+                update(files).where(files.id.in_(file_ids)).values(is_unsupported=True)
             )
+            await self.db.commit()
+        except Exception as e:
+            await self.db.rollback()
+            raise HTTPException(status_code=500, detail=f"文件状态更新失败: {str(e)}")
+
+    async def files_list(self, collection: str = None):
+        """文件列表
+
+        Args:
+            collection: 只列出该知识库的文件，为空时列出全部
+        """
+        try:
+            # 查询所有未删除的文件
+            statement = select(
+                files.id,
+                files.file_name,
+                files.file_path,
+                files.is_study,
+                files.is_unsupported,
+                files.user_id,
+                files.tags,
+                files.created_at,
+                files.collection,
+            ).where(files.is_deleted == False)
+            if collection:
+                statement = statement.where(files_filter(collection))
+            files_list = (await self.db.execute(statement)).all()
 
             # 将查询结果转换为字典列表
             result = [
@@ -93,6 +157,13 @@ class Files:
                     "file_name": file.file_name,
                     "file_path": file.file_path,
                     "is_study": file.is_study,
+                    "is_unsupported": bool(file.is_unsupported),
+                    "user_id": file.user_id,
+                    "tags": file.tags.split(",") if file.tags else [],
+                    "collection": file.collection or DEFAULT_COLLECTION,
+                    "created_at": (
+                        file.created_at.isoformat() if file.created_at else None
+                    ),
                 }
                 for file in files_list
             ]
@@ -0,0 +1,180 @@
+import json
+import os
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from app.logging.logging import logger
+
+
+class IndexManifest:
+    """向量索引清单
+
+    与 FAISS 索引保存在同一个版本目录中，记录每个文件的内容哈希、生成的文本块
+    ID (及合并掉的重复文本块所指向的文本块ID)、使用的向量模型和更新时间，
+    以及索引类型和训练数据量。按文件增删改时只需处理该文件的文本块，内容
+    未变化的文件可以直接跳过，文件列表也无需反序列化索引即可获得。
+    """
+
+    FILE_NAME = "manifest.json"
+
+    def __init__(self, data: dict = None):
+        data = data or {}
+        self.embedding_model: Optional[str] = data.get("embedding_model")
+        self.updated_at: Optional[str] = data.get("updated_at")
+        self.files: Dict[str, dict] = data.get("files", {})
+        # 索引类型信息：factory、resolved_factory、trained_size
+        self.index: dict = data.get("index", {})
+        # 加载后是否有修改，未修改时无需保存新的索引版本
+        self.dirty = False
+        # 内容未变化但元数据已更新的文本块ID，保存时写入 docstore
+        self.updated_chunks: set = set()
+
+    @classmethod
+    def load(cls, index_path: str) -> Optional["IndexManifest"]:
+        """从索引目录读取清单，不存在时返回 None"""
+        path = os.path.join(index_path, cls.FILE_NAME)
+        if not os.path.isfile(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    @classmethod
+    def from_docstore(cls, vectorstore) -> "IndexManifest":
+        """根据已有索引的 docstore 重建清单，用于没有清单的旧版本索引"""
+        manifest = cls()
+        for chunk_id in vectorstore.index_to_docstore_id.values():
+            doc = vectorstore.docstore.search(chunk_id)
+            if not hasattr(doc, "metadata"):
+                continue
+            source = doc.metadata.get("source") or "未知来源"
+            file_id = doc.metadata.get("file_id")
+            key = str(file_id) if file_id is not None else f"source:{source}"
+            entry = manifest.files.setdefault(
+                key,
+                {
+                    "file_id": file_id if file_id is not None else key,
+                    "file_name": os.path.basename(source),
+                    "content_hash": None,
+                    "chunk_ids": [],
+                    "embedding_model": None,
+                    "updated_at": None,
+                },
+            )
+            entry["chunk_ids"].append(chunk_id)
+        manifest.dirty = True
+        logger.info(f"已根据 docstore 重建索引清单，共 {len(manifest.files)} 个文件")
+        return manifest
+
+    def save(self, index_path: str):
+        """写入清单，先写临时文件再替换"""
+        self.updated_at = datetime.utcnow().isoformat()
+        path = os.path.join(index_path, self.FILE_NAME)
+        tmp_path = f"{path}.{uuid.uuid4().hex}"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "embedding_model": self.embedding_model,
+                    "updated_at": self.updated_at,
+                    "index": self.index,
+                    "files": self.files,
+                },
+                f,
+                ensure_ascii=False,
+            )
+        os.replace(tmp_path, path)
+
+    def get_file(self, file_id) -> Optional[dict]:
+        return self.files.get(str(file_id))
+
+    def find_by_name(self, file_name: str) -> List[str]:
+        """按文件名查找清单中的文件，返回其清单键"""
+        return [
+            key for key, entry in self.files.items() if entry["file_name"] == file_name
+        ]
+
+    def find_unchanged(
+        self, file_name: str, content_hash: str, embedding_model: str
+    ) -> Optional[str]:
+        """查找内容和向量模型都未变化的同名文件，返回其清单键"""
+        return next(
+            (
+                key
+                for key in self.find_by_name(file_name)
+                if self.files[key]["content_hash"] == content_hash
+                and self.files[key]["embedding_model"] == embedding_model
+            ),
+            None,
+        )
+
+    def is_unchanged(self, file_name: str, content_hash: str, embedding_model: str) -> bool:
+        """同名文件内容和向量模型都未变化时无需重新向量化"""
+        return self.find_unchanged(file_name, content_hash, embedding_model) is not None
+
+    def set_file(
+        self,
+        file_id,
+        file_name: str,
+        content_hash: Optional[str],
+        chunk_ids: List[str],
+        embedding_model: str,
+        duplicate_ids: List[str] = None,
+    ):
+        """记录文件的文本块
+
+        Args:
+            duplicate_ids: 该文件中近似重复、已合并到其他文本块的文本块，
+                记录其合并到的保留文本块ID
+        """
+        self.dirty = True
+        self.files[str(file_id)] = {
+            "file_id": file_id,
+            "file_name": file_name,
+            "content_hash": content_hash,
+            "chunk_ids": chunk_ids,
+            "duplicate_ids": duplicate_ids or [],
+            "embedding_model": embedding_model,
+            "updated_at": datetime.utcnow().isoformat(),
+        }
+
+    def move_file(self, old_file_id, new_file_id):
+        """重新上传的同名文件内容未变化时，将清单条目转移到新的文件ID"""
+        self.dirty = True
+        entry = self.files.pop(str(old_file_id))
+        entry["file_id"] = new_file_id
+        entry["updated_at"] = datetime.utcnow().isoformat()
+        self.files[str(new_file_id)] = entry
+        return entry
+
+    def remove_file(self, file_id) -> Optional[dict]:
+        entry = self.files.pop(str(file_id), None)
+        if entry is not None:
+            self.dirty = True
+        return entry
+
+    def remove_chunk(self, chunk_id: str):
+        """移除单个文本块，返回其所属文件的清单条目"""
+        for key, entry in self.files.items():
+            if chunk_id in entry["chunk_ids"]:
+                self.dirty = True
+                entry["chunk_ids"].remove(chunk_id)
+                if not entry["chunk_ids"]:
+                    self.files.pop(key)
+                return entry
+        return None
+
+    def list_documents(self) -> List[dict]:
+        """文件列表，供后台管理展示"""
+        return [
+            {
+                "file_id": entry["file_id"],
+                "ids": entry["chunk_ids"],
+                "duplicates": len(entry.get("duplicate_ids", [])),
+                "source": entry["file_name"],
+                "full_path": entry["file_name"],
+                "content_hash": entry["content_hash"],
+                "embedding_model": entry["embedding_model"],
+                "updated_at": entry["updated_at"],
+            }
+            for entry in self.files.values()
+        ]
@@ -0,0 +1,393 @@
+import asyncio
+import json
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional
+
+from redis.exceptions import LockError
+from sqlalchemy import func, select
+
+from app.config.index import settings
+from app.db.database import SessionLocal
+from app.db.models.chat import files
+from app.logging.logging import logger
+from app.services.collection import Collection, pending_files_filter
+from app.services.files import Files
+from app.services.vector_store import VectorStore
+from app.utils.redis_client import RedisClient
+
+PENDING = "pending"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+FINISHED_STATUSES = (SUCCEEDED, FAILED, CANCELLED)
+
+
+class IngestionJob:
+    """向量库重建任务，同时作为入库流水线的进度记录对象"""
+
+    def __init__(self, collection: str = None):
+        self.job_id = uuid.uuid4().hex
+        self.collection = Collection(collection).name
+        self.status = PENDING
+        self.created_at = datetime.utcnow()
+        self.started_at: Optional[datetime] = None
+        self.finished_at: Optional[datetime] = None
+        self.error: Optional[str] = None
+        self.result = None
+        # 文件名 -> {"file_id", "status", "pages", "chunks", "error"}
+        self.files = OrderedDict()
+        self.pages = 0
+        self.chunks = 0
+        self.embeddings = 0
+        self.task: Optional[asyncio.Task] = None
+        self._started_monotonic = None
+        self._finished_monotonic = None
+        self._last_publish = 0.0
+
+    # ---- 入库流水线回调 ----
+
+    def file_status(self, file_id, file_name: str, status: str, **info):
+        """更新单个文件的处理状态"""
+        entry = self.files.setdefault(
+            file_name, {"file_id": file_id, "status": status, "pages": 0, "chunks": 0}
+        )
+        entry["file_id"] = file_id
+        entry["status"] = status
+        entry.update(info)
+        self.publish()
+
+    def add_pages(self, count: int):
+        self.pages += count
+
+    def add_chunks(self, file_name: str, count: int):
+        self.chunks += count
+        if file_name in self.files:
+            self.files[file_name]["chunks"] += count
+
+    def add_embeddings(self, count: int):
+        self.embeddings += count
+        self.publish()
+
+    # ---- 状态查询 ----
+
+    @property
+    def processed_file_ids(self) -> list:
+        """已处理完成(含内容未变化跳过)的文件ID，解析失败的文件留待下次重建"""
+        return [
+            entry["file_id"]
+            for entry in self.files.values()
+            if entry["status"] not in ("failed", "unsupported")
+        ]
+
+    @property
+    def unsupported_file_ids(self) -> list:
+        """格式不支持的文件ID，标记后不再计入待学习文件"""
+        return [
+            entry["file_id"]
+            for entry in self.files.values()
+            if entry["status"] == "unsupported"
+        ]
+
+    def to_dict(self) -> dict:
+        elapsed = 0.0
+        if self._started_monotonic is not None:
+            end = time.monotonic() if self.finished_at is None else self._finished_monotonic
+            elapsed = max(end - self._started_monotonic, 1e-6)
+        return {
+            "job_id": self.job_id,
+            "collection": self.collection,
+            "status": self.status,
+            "created_at": self.created_at.isoformat(),
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+            "error": self.error,
+            "result": self.result,
+            "files": list(
+                {"file_name": file_name, **entry} for file_name, entry in self.files.items()
+            ),
+            "totals": {
+                "files": len(self.files),
+                "pages": self.pages,
+                "chunks": self.chunks,
+                "embeddings": self.embeddings,
+            },
+            "throughput": {
+                "elapsed_seconds": round(elapsed, 2),
+                "pages_per_second": round(self.pages / elapsed, 2) if elapsed else 0.0,
+                "chunks_per_second": round(self.chunks / elapsed, 2) if elapsed else 0.0,
+                "embeddings_per_second": (
+                    round(self.embeddings / elapsed, 2) if elapsed else 0.0
+                ),
+            },
+        }
+
+    def mark_running(self):
+        self.status = RUNNING
+        self.started_at = datetime.utcnow()
+        self._started_monotonic = time.monotonic()
+        self.publish(force=True)
+
+    def mark_finished(self, status: str, error: str = None, result=None):
+        self.status = status
+        self.error = error
+        self.result = result
+        self.finished_at = datetime.utcnow()
+        self._finished_monotonic = time.monotonic()
+        self.publish(force=True)
+
+    def publish(self, force: bool = False):
+        """将任务快照同步到 Redis，供其他 worker 进程查询，进度更新限频"""
+        now = time.monotonic()
+        if not force and now - self._last_publish < settings.INGESTION_PUBLISH_INTERVAL:
+            return
+        self._last_publish = now
+        payload = json.dumps(self.to_dict(), ensure_ascii=False, default=str)
+        # Redis 客户端是同步的，放到线程池中写入，避免阻塞事件循环
+        asyncio.get_running_loop().run_in_executor(None, self._write_snapshot, payload)
+
+    def _write_snapshot(self, payload: str):
+        try:
+            RedisClient().client.set(
+                IngestionJobManager.redis_key(self.job_id),
+                payload,
+                ex=settings.INGESTION_JOB_TTL,
+            )
+        except Exception as e:
+            logger.warning(f"同步重建任务状态到 Redis 失败: {str(e)}")
+
+
+class IngestionJobManager:
+    """进程内的后台重建任务队列
+
+    重建请求只负责入队并立即返回任务ID，由单个后台协程按顺序执行下载、解析、
+    切分、向量化和保存；解析在进程池、切分和保存在线程池中进行，不阻塞问答
+    请求所在的事件循环。多个 worker 进程时，同一知识库的重建通过 Redis 锁
+    串行执行，取消请求通过 Redis 中的取消标记通知执行任务的进程。
+    """
+
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(IngestionJobManager, cls).__new__(cls)
+            cls._instance.jobs = OrderedDict()
+            cls._instance.queue = None
+            cls._instance.worker = None
+        return cls._instance
+
+    @staticmethod
+    def redis_key(job_id: str) -> str:
+        return f"ingest:job:{job_id}"
+
+    @staticmethod
+    def cancel_key(job_id: str) -> str:
+        return f"ingest:cancel:{job_id}"
+
+    @staticmethod
+    def lock_key(collection: str) -> str:
+        return f"ingest:lock:{collection}"
+
+    def start(self):
+        """在当前事件循环中启动后台 worker"""
+        if self.worker is None or self.worker.done():
+            self.queue = asyncio.Queue()
+            self.worker = asyncio.create_task(self._run())
+            logger.info("向量库重建任务 worker 已启动")
+
+    async def stop(self):
+        """停止 worker 并取消正在执行的任务"""
+        if self.worker is not None:
+            self.worker.cancel()
+            await asyncio.gather(self.worker, return_exceptions=True)
+            self.worker = None
+
+    def submit(self, collection: str = None) -> IngestionJob:
+        """提交知识库的重建任务，该知识库已有未完成的任务时直接返回该任务"""
+        collection = Collection(collection).name
+        for job in self.jobs.values():
+            if job.collection == collection and job.status not in FINISHED_STATUSES:
+                return job
+
+        if self.worker is None or self.worker.done():
+            self.start()
+
+        job = IngestionJob(collection)
+        self.jobs[job.job_id] = job
+        # 只保留最近的任务记录
+        while len(self.jobs) > settings.INGESTION_JOB_HISTORY:
+            self.jobs.popitem(last=False)
+        self.queue.put_nowait(job)
+        job.publish(force=True)
+        return job
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        """查询任务状态，本进程不存在时从 Redis 读取"""
+        job = self.jobs.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        try:
+            snapshot = await asyncio.to_thread(
+                RedisClient().client.get, self.redis_key(job_id)
+            )
+            return json.loads(snapshot) if snapshot else None
+        except Exception as e:
+            logger.warning(f"从 Redis 读取重建任务状态失败: {str(e)}")
+            return None
+
+    def list_jobs(self) -> list:
+        return [job.to_dict() for job in reversed(self.jobs.values())]
+
+    async def cancel(self, job_id: str) -> Optional[dict]:
+        """取消任务，返回取消后的任务状态，任务不存在时返回 None
+
+        任务在其他 worker 进程中时写入取消标记，由执行任务的进程检查后取消。
+        """
+        job = self.jobs.get(job_id)
+        if job is not None:
+            if job.status == PENDING:
+                job.mark_finished(CANCELLED)
+            elif job.status == RUNNING and job.task is not None:
+                job.task.cancel()
+            return job.to_dict()
+
+        snapshot = await self.get(job_id)
+        if snapshot is None:
+            return None
+        if snapshot["status"] not in FINISHED_STATUSES:
+            await asyncio.to_thread(
+                RedisClient().client.set,
+                self.cancel_key(job_id),
+                1,
+                ex=settings.INGESTION_JOB_TTL,
+            )
+            snapshot["cancel_requested"] = True
+        return snapshot
+
+    async def _cancel_requested(self, job_id: str) -> bool:
+        try:
+            return bool(
+                await asyncio.to_thread(
+                    RedisClient().client.exists, self.cancel_key(job_id)
+                )
+            )
+        except Exception as e:
+            logger.warning(f"从 Redis 读取重建任务取消标记失败: {str(e)}")
+            return False
+
+    async def _acquire_lock(self, job: IngestionJob):
+        """获取知识库的重建锁，其他进程正在重建同一知识库时等待其完成
+
+        Redis 不可用时返回 None，不加锁执行 (进程内仍按顺序执行)。
+        """
+        lock = RedisClient().client.lock(
+            self.lock_key(job.collection),
+            timeout=settings.INGESTION_LOCK_TTL,
+            thread_local=False,
+        )
+        waiting = False
+        while True:
+            try:
+                if await asyncio.to_thread(lock.acquire, blocking=False):
+                    return lock
+            except Exception as e:
+                logger.warning(f"获取重建锁失败，不加锁执行: {str(e)}")
+                return None
+            if not waiting:
+                logger.info(f"知识库 {job.collection} 正在其他进程中重建，等待其完成")
+                waiting = True
+            if await self._cancel_requested(job.job_id):
+                raise asyncio.CancelledError()
+            await asyncio.sleep(settings.INGESTION_PUBLISH_INTERVAL)
+
+    async def _watch(self, job: IngestionJob, lock):
+        """任务执行期间续期重建锁，并检查其他进程写入的取消标记"""
+        renewed = time.monotonic()
+        while True:
+            await asyncio.sleep(settings.INGESTION_PUBLISH_INTERVAL)
+            if await self._cancel_requested(job.job_id):
+                logger.info(f"重建任务 {job.job_id} 收到取消请求")
+                job.task.cancel()
+                return
+            if lock is None:
+                continue
+            if time.monotonic() - renewed < settings.INGESTION_LOCK_TTL / 3:
+                continue
+            try:
+                await asyncio.to_thread(lock.reacquire)
+                renewed = time.monotonic()
+            except LockError:
+                # 锁已过期并可能被其他进程获取，继续执行会与其相互覆盖
+                logger.error(f"重建任务 {job.job_id} 的重建锁已失效，取消任务")
+                job.task.cancel()
+                return
+            except Exception as e:
+                logger.warning(f"续期重建锁失败: {str(e)}")
+
+    @staticmethod
+    async def _release_lock(lock):
+        if lock is None:
+            return
+        try:
+            await asyncio.to_thread(lock.release)
+        except Exception as e:
+            logger.warning(f"释放重建锁失败: {str(e)}")
+
+    async def _run(self):
+        while True:
+            job = await self.queue.get()
+            if job.status != PENDING:
+                continue
+            if await self._cancel_requested(job.job_id):
+                job.mark_finished(CANCELLED)
+                continue
+            job.task = asyncio.create_task(self._execute(job))
+            try:
+                # 单个任务被取消不会影响 worker 继续处理队列
+                await asyncio.wait({job.task})
+            except asyncio.CancelledError:
+                job.task.cancel()
+                raise
+            finally:
+                job.task = None
+
+    async def _execute(self, job: IngestionJob):
+        job.mark_running()
+        db = SessionLocal()
+        lock = watcher = None
+        try:
+            lock = await self._acquire_lock(job)
+            watcher = asyncio.create_task(self._watch(job, lock))
+            unprocessed_files = await db.scalar(
+                select(func.count())
+                .select_from(files)
+                .where(pending_files_filter(job.collection))
+            )
+            if unprocessed_files == 0:
+                job.mark_finished(SUCCEEDED, result={"message": "没有需要学习的文件"})
+                return
+
+            await VectorStore.create_vectorstore(
+                db, progress=job, collection=job.collection
+            )
+            result = await Files(db).files_study(job.processed_file_ids)
+            if job.unsupported_file_ids:
+                await Files(db).files_unsupported(job.unsupported_file_ids)
+            job.mark_finished(SUCCEEDED, result=result)
+            logger.info(f"重建任务 {job.job_id} 完成: {job.to_dict()['throughput']}")
+        except asyncio.CancelledError:
+            job.mark_finished(CANCELLED)
+            logger.info(f"重建任务 {job.job_id} 已取消")
+            raise
+        except Exception as e:
+            job.mark_finished(FAILED, error=getattr(e, "detail", None) or str(e))
+            logger.error(f"重建任务 {job.job_id} 失败: {str(e)}")
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+            await self._release_lock(lock)
+            await db.close()
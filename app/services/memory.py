@@ -0,0 +1,191 @@
+import asyncio
+from functools import lru_cache
+
+import tiktoken
+from langchain.memory import ConversationBufferMemory
+from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_openai import ChatOpenAI
+from redis.exceptions import RedisError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config.index import settings
+from app.db.database import SessionLocal
+from app.logging.logging import logger
+from app.services.chat_cache import ChatCache
+from app.utils.mysql_client import MySQLClient
+from app.utils.redis_client import RedisClient
+
+SUMMARY_PROMPT = """请将下面的对话内容合并到已有摘要中，生成新的摘要。
+摘要需要保留用户关心的主题、关键事实和结论，使用中文，不超过 300 字。
+
+已有摘要:
+{summary}
+
+新的对话:
+{dialogue}
+
+新的摘要:"""
+
+
+@lru_cache(maxsize=1)
+def _get_encoding():
+    try:
+        return tiktoken.encoding_for_model(settings.OPENAI_MODEL)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        # 离线环境无法下载词表时按字符数估算
+        logger.warning(f"加载 tiktoken 词表失败，按字符数估算 token: {str(e)}")
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """按对话模型的分词方式统计 token 数"""
+    encoding = _get_encoding()
+    if encoding is None:
+        return len(text or "")
+    return len(encoding.encode(text or ""))
+
+
+class ConversationMemory:
+    """有界的会话记忆
+
+    只加载最近 MEMORY_MAX_TURNS 轮问答，优先从 Redis 会话缓存读取，并按
+    MEMORY_MAX_TOKENS 的 token 预算从新到旧截取，查询只涉及问题和答案两列。
+    开启摘要时，窗口之外的旧轮次由后台任务合并为滚动摘要保存在 Redis 中，
+    每轮的开销与会话长度无关。
+    """
+
+    # 正在更新摘要的会话，避免同一会话并发生成摘要
+    _summarizing = set()
+    _background_tasks = set()
+
+    def __init__(self, db: AsyncSession):
+        self.cache = ChatCache(db)
+
+    async def load(self, session_id: str, user_id: str) -> ConversationBufferMemory:
+        """获取带最近历史记录的记忆对象"""
+        memory = ConversationBufferMemory(
+            input_key="question",
+            output_key="answer",
+            memory_key="chat_history",
+            return_messages=True,
+        )
+
+        if settings.MEMORY_SUMMARY_ENABLED:
+            try:
+                summary = await asyncio.to_thread(RedisClient().get_summary, session_id)
+            except RedisError as e:
+                # 摘要只是补充上下文，Redis 不可用时仍按最近轮次回答
+                logger.warning(f"读取会话 {session_id} 摘要失败: {str(e)}")
+                summary = {}
+            if summary.get("summary"):
+                memory.chat_memory.add_message(
+                    SystemMessage(content=f"此前对话摘要: {summary['summary']}")
+                )
+
+        for turn in await self._window(self.cache, session_id, user_id):
+            memory.save_context(
+                {"question": turn["question"]}, {"answer": turn["answer"]}
+            )
+        return memory
+
+    @classmethod
+    async def _window(cls, cache: ChatCache, session_id: str, user_id: str) -> list:
+        """记忆窗口：最近 MEMORY_MAX_TURNS 轮中符合 token 预算的轮次"""
+        turns = await cache.get_recent_turns(
+            session_id, user_id, limit=settings.MEMORY_MAX_TURNS
+        )
+        return cls._fit_budget(turns)
+
+    @staticmethod
+    def _fit_budget(turns: list) -> list:
+        """从最新一轮开始保留，直到超出 token 预算"""
+        kept = []
+        used = 0
+        for turn in reversed(turns):
+            cost = count_tokens(turn["question"]) + count_tokens(turn["answer"])
+            if used + cost > settings.MEMORY_MAX_TOKENS:
+                break
+            used += cost
+            kept.append(turn)
+        kept.reverse()
+        return kept
+
+    @classmethod
+    def schedule_summary(cls, session_id: str, user_id: str):
+        """在后台更新会话摘要，不阻塞当前请求"""
+        if not settings.MEMORY_SUMMARY_ENABLED or session_id in cls._summarizing:
+            return
+        task = asyncio.create_task(cls.update_summary(session_id, user_id))
+        cls._background_tasks.add(task)
+        task.add_done_callback(cls._background_tasks.discard)
+
+    @classmethod
+    async def update_summary(cls, session_id: str, user_id: str):
+        """将滑出窗口且尚未摘要的轮次合并到滚动摘要中
+
+        窗口之外的轮次 (超出轮数或被 token 预算截掉) 从上次摘要的位置开始按
+        时间正序分批合并，直到追上窗口中最早的一轮。
+        """
+        if session_id in cls._summarizing:
+            return
+        cls._summarizing.add(session_id)
+        try:
+            redis_client = RedisClient()
+            summary = await asyncio.to_thread(redis_client.get_summary, session_id)
+            async with SessionLocal() as db:
+                window = await cls._window(ChatCache(db), session_id, user_id)
+            # 窗口为空时 (最新一轮也超出预算) 全部轮次都需要摘要
+            before_id = window[0]["id"] if window else None
+            upto_id = summary.get("upto_id")
+            text = summary.get("summary")
+            llm = None
+            merged = 0
+            while True:
+                async with SessionLocal() as db:
+                    turns = await MySQLClient(db).get_turns_between(
+                        session_id,
+                        user_id,
+                        limit=settings.MEMORY_SUMMARY_BATCH_TURNS,
+                        after_id=upto_id,
+                        before_id=before_id,
+                    )
+                if not turns:
+                    break
+
+                if llm is None:
+                    llm = ChatOpenAI(
+                        model=settings.OPENAI_MODEL,
+                        openai_api_key=settings.OPENAI_API_KEY,
+                        openai_api_base=settings.OPENAI_API_BASE,
+                        max_tokens=settings.MEMORY_SUMMARY_MAX_TOKENS,
+                    )
+                dialogue = "\n".join(
+                    f"Human: {turn['question']}\nAssistant: {turn['answer']}"
+                    for turn in turns
+                )
+                message = await llm.ainvoke(
+                    [
+                        HumanMessage(
+                            content=SUMMARY_PROMPT.format(
+                                summary=text or "无", dialogue=dialogue
+                            )
+                        )
+                    ]
+                )
+                text = message.content
+                upto_id = turns[-1]["id"]
+                # 每批合并后立即保存，中途失败时下次从该位置继续
+                await asyncio.to_thread(
+                    redis_client.save_summary,
+                    session_id,
+                    {"summary": text, "upto_id": upto_id},
+                )
+                merged += len(turns)
+            if merged:
+                logger.info(f"会话 {session_id} 摘要已更新，合并 {merged} 轮对话")
+        except Exception as e:
+            logger.warning(f"更新会话 {session_id} 摘要失败: {str(e)}")
+        finally:
+            cls._summarizing.discard(session_id)
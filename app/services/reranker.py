@@ -0,0 +1,160 @@
+import os
+import threading
+import time
+from typing import List, Optional
+
+import numpy as np
+from langchain_core.documents import Document
+
+from app.config.index import settings
+from app.logging.logging import logger
+from app.services import bm25
+
+
+class CrossEncoder:
+    """ONNX 格式的交叉编码器 (如 bge-reranker 导出的模型)
+
+    模型目录中需要包含 model.onnx 和 tokenizer.json，依赖 onnxruntime 和
+    tokenizers，均为可选依赖。每批按该批最长的文本补齐，不统一补齐到最大长度。
+    """
+
+    def __init__(self, model_path: str):
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = settings.RERANK_THREADS
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(model_path, "model.onnx"),
+            sess_options=options,
+            providers=["CPUExecutionProvider"],
+        )
+        self.input_names = {item.name for item in self.session.get_inputs()}
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_path, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=settings.RERANK_MAX_LENGTH)
+        self.tokenizer.enable_padding()
+
+    def score(self, query: str, passages: List[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch([(query, passage) for passage in passages])
+        inputs = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+        }
+        logits = self.session.run(
+            None, {name: value for name, value in inputs.items() if name in self.input_names}
+        )[0]
+        # 单输出为相关度分数，二分类输出取"相关"一列
+        return logits[:, -1] if logits.ndim == 2 else logits
+
+
+class Reranker:
+    """检索结果重排序
+
+    检索阶段多取 RERANK_FETCH_K 个候选，重排序后只把最相关的 k 个交给 LLM。
+    配置了 RERANK_MODEL_PATH 且可选依赖已安装时使用交叉编码器打分：候选按
+    检索顺序分批计算，超过 RERANK_TIMEOUT 后剩余候选不再打分，保持检索顺序
+    排在已打分的候选之后。没有模型时使用关键词覆盖度结合 MMR 去重的打分，
+    不依赖任何模型。
+    """
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __new__(cls):
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    instance = super(Reranker, cls).__new__(cls)
+                    instance._model = instance._load_model()
+                    instance.timeouts = 0
+                    cls._instance = instance
+        return cls._instance
+
+    @staticmethod
+    def _load_model() -> Optional[CrossEncoder]:
+        model_path = settings.RERANK_MODEL_PATH
+        if not model_path:
+            return None
+        try:
+            model = CrossEncoder(model_path)
+            logger.info(f"重排序模型已加载: {model_path}")
+            return model
+        except ImportError:
+            logger.warning("未安装 onnxruntime/tokenizers，重排序使用关键词 MMR 打分")
+        except Exception as e:
+            logger.error(f"加载重排序模型失败，使用关键词 MMR 打分: {str(e)}")
+        return None
+
+    @property
+    def method(self) -> str:
+        return "cross-encoder" if self._model is not None else "mmr"
+
+    def rerank(self, query: str, documents: List[Document], top_n: int) -> List[Document]:
+        """返回重排序后的前 top_n 个文本块"""
+        if len(documents) <= 1:
+            return documents[:top_n]
+        if self._model is not None:
+            try:
+                return self._cross_encoder_rerank(query, documents, top_n)
+            except Exception as e:
+                logger.error(f"交叉编码器重排序失败，使用关键词 MMR 打分: {str(e)}")
+        return self._mmr_rerank(query, documents, top_n)
+
+    def _cross_encoder_rerank(
+        self, query: str, documents: List[Document], top_n: int
+    ) -> List[Document]:
+        deadline = time.monotonic() + settings.RERANK_TIMEOUT
+        batch_size = settings.RERANK_BATCH_SIZE
+        scores = []
+        for start in range(0, len(documents), batch_size):
+            if start and time.monotonic() > deadline:
+                self.timeouts += 1
+                logger.warning(
+                    f"重排序超过 {settings.RERANK_TIMEOUT}s，"
+                    f"{len(documents) - start} 个候选未打分"
+                )
+                break
+            batch = documents[start : start + batch_size]
+            scores.extend(
+                self._model.score(query, [doc.page_content for doc in batch]).tolist()
+            )
+
+        order = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)
+        order.extend(range(len(scores), len(documents)))
+        return [documents[i] for i in order[:top_n]]
+
+    @staticmethod
+    def _mmr_rerank(query: str, documents: List[Document], top_n: int) -> List[Document]:
+        """关键词覆盖度与检索排名作为相关度，用 MMR 去掉内容重复的候选"""
+        query_tokens = set(bm25.tokenize(query))
+        doc_tokens = [set(bm25.tokenize(doc.page_content)) for doc in documents]
+        count = len(documents)
+        relevance = [
+            0.7 * (len(query_tokens & tokens) / len(query_tokens) if query_tokens else 0.0)
+            + 0.3 * (1 - rank / count)
+            for rank, tokens in enumerate(doc_tokens)
+        ]
+
+        lambda_ = settings.RERANK_MMR_LAMBDA
+        selected: List[int] = []
+        remaining = list(range(count))
+        while remaining and len(selected) < top_n:
+
+            def mmr_score(i):
+                redundancy = max(
+                    (_jaccard(doc_tokens[i], doc_tokens[j]) for j in selected),
+                    default=0.0,
+                )
+                return lambda_ * relevance[i] - (1 - lambda_) * redundancy
+
+            best = max(remaining, key=mmr_score)
+            selected.append(best)
+            remaining.remove(best)
+        return [documents[i] for i in selected]
+
+
+def _jaccard(a: set, b: set) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
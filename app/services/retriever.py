@@ -0,0 +1,205 @@
+import asyncio
+from typing import List, Optional
+
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun,
+)
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from pydantic import ConfigDict
+
+from app.config.index import settings
+from app.services import bm25, faiss_index
+from app.services.collection import Collection
+from app.services.docstore import SqliteDocstore, metadata_matches
+from app.services.reranker import Reranker
+
+
+class FaissRetriever(BaseRetriever):
+    """直接调用 FAISS 索引的检索器，支持与 BM25 关键词检索混合
+
+    每次检索可以单独指定 k、IVF 的 nprobe 和 HNSW 的 efSearch，参数通过
+    SearchParameters 传给本次检索，不修改共享索引的全局设置。只读实例的
+    docstore 带有 BM25 索引时，向量检索和关键词检索各取 fetch_k 个候选，
+    按加权倒数排名融合后取前 k 个。开启重排序时先取 rerank_fetch_k 个
+    候选，重排序后再取前 k 个。
+
+    filters 按文件ID、上传者、标签和上传时间过滤：先从 docstore 查出允许
+    检索的序号，以 IDSelector 交给 FAISS 只在这些向量中检索，BM25 检索也在
+    SQL 中先过滤再排序，过滤后仍能返回完整的 k 个结果。
+
+    量化或降维的有损索引多取 rescore_factor 倍候选，再用磁盘上的原始向量
+    计算精确距离重排。
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    vectorstore: FAISS
+    k: int = 3
+    nprobe: Optional[int] = None
+    ef_search: Optional[int] = None
+    vector_weight: float = 1.0
+    bm25_weight: float = 0.0
+    fetch_k: int = 20
+    rerank: bool = False
+    rerank_fetch_k: int = 20
+    filters: Optional[dict] = None
+    # 有损压缩索引的原始向量 (内存映射) 和精确重排时多取的候选倍数
+    rescore_vectors: Optional[np.ndarray] = None
+    rescore_factor: int = 0
+
+    @property
+    def _lexical(self) -> bool:
+        """本次检索是否使用 BM25"""
+        return self.bm25_weight > 0 and isinstance(
+            self.vectorstore.docstore, SqliteDocstore
+        )
+
+    @property
+    def _dense(self) -> bool:
+        """本次检索是否使用向量检索，不使用 BM25 时总是使用"""
+        return self.vector_weight > 0 or not self._lexical
+
+    def _search(self, embedding: Optional[List[float]], query: str) -> List[Document]:
+        lexical = self._lexical
+        limit = max(self.k, self.rerank_fetch_k) if self.rerank else self.k
+        fetch_k = max(limit, self.fetch_k) if lexical else limit
+
+        allowed = None
+        if self.filters and isinstance(self.vectorstore.docstore, SqliteDocstore):
+            allowed = self.vectorstore.docstore.filter_positions(self.filters)
+            if len(allowed) == 0:
+                return []
+
+        dense = []
+        if embedding is not None and self.vectorstore.index.ntotal > 0:
+            dense = self._dense_search(embedding, fetch_k, allowed)
+
+        positions = dense
+        if lexical:
+            sparse = self.vectorstore.docstore.bm25_search(query, fetch_k, self.filters)
+            positions = bm25.reciprocal_rank_fusion(
+                [dense, sparse],
+                [self.vector_weight, self.bm25_weight],
+                settings.HYBRID_RRF_K,
+            )
+        documents = self._documents(positions[:limit])
+        if self.rerank and len(documents) > self.k:
+            documents = Reranker().rerank(query, documents, self.k)
+        return documents
+
+    def _dense_search(
+        self, embedding: List[float], k: int, allowed: Optional[np.ndarray]
+    ) -> List[int]:
+        index = self.vectorstore.index
+        query = np.array([embedding], dtype=np.float32)
+        rescoring = self.rescore_vectors is not None and self.rescore_factor > 1
+        result_k = k
+        if rescoring:
+            k *= self.rescore_factor
+        selector, selectivity = None, 1.0
+        if allowed is not None and len(allowed) < index.ntotal:
+            selector = faiss_index.id_selector(allowed, index.ntotal)
+            selectivity = len(allowed) / index.ntotal
+        params = faiss_index.search_parameters(
+            index, self.nprobe, self.ef_search, selector, selectivity
+        )
+        try:
+            _, indices = faiss_index.search(index, query, k, params)
+            found = indices[0]
+        except RuntimeError:
+            if selector is None:
+                raise
+            # 不支持 IDSelector 的索引 (如 IndexPQ) 按比例多取后再过滤
+            params = faiss_index.search_parameters(index, self.nprobe, self.ef_search)
+            fetch = min(index.ntotal, int(k / selectivity) + k)
+            _, indices = faiss_index.search(index, query, fetch, params)
+            found = indices[0][np.isin(indices[0], allowed)][:k]
+        # 近似索引可能返回不足 k 个结果，以 -1 填充
+        found = [int(i) for i in found if i != -1]
+        if rescoring:
+            found = faiss_index.rescore(
+                self.rescore_vectors, query[0], found, index.metric_type, result_k
+            )
+        return found
+
+    def _documents(self, positions: List[int]) -> List[Document]:
+        docstore = self.vectorstore.docstore
+        if isinstance(docstore, SqliteDocstore):
+            # 只读实例一次查询读取全部命中的文本块
+            return [doc for doc in docstore.get_by_positions(positions) if doc]
+
+        documents = []
+        for i in positions:
+            doc_id = self.vectorstore.index_to_docstore_id.get(i)
+            if doc_id is None:
+                continue
+            doc = docstore.search(doc_id)
+            if not isinstance(doc, Document):
+                continue
+            # 旧格式索引没有过滤索引，只能对检索结果过滤
+            if self.filters and not metadata_matches(doc.metadata, self.filters):
+                continue
+            documents.append(doc)
+        return documents
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        embedding = None
+        if self._dense:
+            embedding = self.vectorstore.embeddings.embed_query(query)
+        return self._search(embedding, query)
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        # 只用关键词检索时无需计算查询向量
+        embedding = None
+        if self._dense:
+            embedding = await self.vectorstore.embeddings.aembed_query(query)
+        # 大索引检索耗时较长，放到线程池中执行，FAISS 检索时会释放 GIL
+        return await asyncio.to_thread(self._search, embedding, query)
+
+    @classmethod
+    def from_options(
+        cls,
+        vectorstore: FAISS,
+        k: Optional[int] = None,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+        vector_weight: Optional[float] = None,
+        bm25_weight: Optional[float] = None,
+        rerank: Optional[bool] = None,
+        filters: Optional[dict] = None,
+        collection: Optional[str] = None,
+    ) -> "FaissRetriever":
+        # 未指定的参数按知识库配置，知识库未覆盖时使用全局配置
+        config = Collection(collection)
+        if bm25_weight is None:
+            bm25_weight = (
+                config.setting("HYBRID_BM25_WEIGHT")
+                if config.setting("HYBRID_SEARCH_ENABLED")
+                else 0.0
+            )
+        return cls(
+            vectorstore=vectorstore,
+            k=k or config.setting("RETRIEVER_K"),
+            nprobe=nprobe,
+            ef_search=ef_search,
+            vector_weight=(
+                config.setting("HYBRID_VECTOR_WEIGHT")
+                if vector_weight is None
+                else vector_weight
+            ),
+            bm25_weight=bm25_weight,
+            fetch_k=config.setting("HYBRID_FETCH_K"),
+            rerank=config.setting("RERANK_ENABLED") if rerank is None else rerank,
+            rerank_fetch_k=config.setting("RERANK_FETCH_K"),
+            rescore_vectors=getattr(vectorstore, "full_vectors", None),
+            rescore_factor=config.setting("FAISS_RESCORE_FACTOR"),
+            filters=filters or None,
+        )
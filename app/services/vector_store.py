@@ -1,207 +1,933 @@
-from langchain_openai import OpenAIEmbeddings
 from langchain_community.vectorstores import FAISS
-from langchain_community.document_loaders import PyMuPDFLoader, CSVLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from app.config.index import settings
 from app.logging.logging import logger
 import os
-from sqlalchemy.orm import Session
-from app.db.database import get_db
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import update
+from app.db.database import SessionLocal
 from app.db.models.chat import files
-from app.utils.minio_client import MinioClient
-from pathlib import Path
+from app.services.document_loader import DocumentLoader
+from app.services.index_manifest import IndexManifest
+from app.services.collection import Collection
+from app.services.docstore import SqliteDocstore, SqliteIdMap
+from app.services.dedup import DUPLICATES_KEY, ChunkDeduplicator, DedupIndex
+from app.utils.embedding_cache import CachedEmbeddings, EmbeddingCache
+from app.utils.query_embeddings import BatchedQueryEmbeddings
+from app.services.embedding_pipeline import EmbeddingPipeline
+from app.services.embedding_provider import create_embeddings, embedding_model_id
+from app.services import faiss_index
+import asyncio
+import numpy as np
 import shutil
-from langchain.document_loaders import PyMuPDFLoader
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import AsyncIterator
+from langchain_core.documents import Document
 
+# 记录当前生效索引版本目录名的指针文件
+CURRENT_FILE = "CURRENT"
+# 版本目录名前缀
+VERSION_PREFIX = "v"
 
-class VectorStore:
-    @staticmethod
-    async def load_documents(db: Session):
-        """从MinIO加载文档"""
-        documents = []
-        temp_dir = Path("temp")
-        temp_dir.mkdir(exist_ok=True)
-
-        try:
-            files_query = (
-                db.query(files)
-                .filter(files.is_study == False, files.is_deleted == False)
-                .all()
-            )  # 添加 .all()
+# 进程内共享的查询向量模型
+_query_embeddings = None
+_query_embeddings_lock = threading.Lock()
 
-            minio_client = MinioClient()
 
-            for file_record in files_query:
-                try:
-                    # 从URL中提取文件名
-                    file_name = file_record.file_name
-                    if not file_name:  # 添加检查
-                        logger.warning(f"跳过无效文件名的记录: {file_record.id}")
-                        continue
-
-                    local_path = temp_dir / file_name
+class VectorStore:
+    @staticmethod
+    def get_embeddings(max_retries: int = 2, cached: bool = True):
+        """获取 EMBEDDING_PROVIDER 配置的向量模型，启用缓存时未变化的文本块不会重复计算
 
-                    # 使用文件名从MinIO下载
-                    await minio_client.download_file(file_name, str(local_path))
+        Args:
+            max_retries: 客户端内部重试次数，批量入库时由流水线自行重试，传 0
+            cached: 是否使用文档向量缓存，查询向量不写入该缓存
+        """
+        embeddings = create_embeddings(max_retries=max_retries)
+        if cached and settings.EMBEDDING_CACHE_ENABLED:
+            return CachedEmbeddings(embeddings, embedding_model_id())
+        return embeddings
 
-                    # 加载文档
-                    if file_name.lower().endswith(".pdf"):
-                        loader = PyMuPDFLoader(str(local_path))
-                        documents.extend(loader.load())
+    @staticmethod
+    def get_query_embeddings() -> BatchedQueryEmbeddings:
+        """获取进程内共享的查询向量模型，带 LRU 缓存并合并并发请求"""
+        global _query_embeddings
+        with _query_embeddings_lock:
+            if _query_embeddings is None:
+                _query_embeddings = BatchedQueryEmbeddings(
+                    VectorStore.get_embeddings(cached=False), embedding_model_id()
+                )
+            return _query_embeddings
 
-                    # 删除临时文件
-                    if local_path.exists():
-                        local_path.unlink()
+    @staticmethod
+    async def split_documents(
+        db: AsyncSession,
+        manifest: IndexManifest,
+        vectorstore=None,
+        progress=None,
+        collection: str = None,
+        dedup: ChunkDeduplicator = None,
+    ) -> AsyncIterator[Document]:
+        """边加载边切分，每个文件解析完成后立即产出其文本块
+
+        同时维护索引清单：内容未变化的同名文件直接沿用已有文本块，内容变化的
+        文件先从 vectorstore 中删除旧的文本块再写入新的文本块。传入 dedup
+        时近似重复的文本块不再产出，只记录其出处。
+        """
+        text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=settings.CHUNK_SIZE, chunk_overlap=settings.CHUNK_OVERLAP
+        )
+        loop = asyncio.get_running_loop()
+        page_count = chunk_count = 0
+        try:
+            async for loaded in DocumentLoader.iter_documents(
+                db, manifest, embedding_model_id(), progress, collection
+            ):
+                previous_keys = manifest.find_by_name(loaded.file_name)
+                kept_key = (
+                    manifest.find_unchanged(
+                        loaded.file_name, loaded.content_hash, embedding_model_id()
+                    )
+                    if loaded.unchanged
+                    else None
+                )
 
-                except Exception as e:
-                    logger.error(f"处理文件 {file_name} 时出错: {str(e)}")
+                # 同名文件的其他清单条目 (旧版本或重复上传) 先删除其文本块，
+                # 只保留一个条目，避免转移到同一文件ID时互相覆盖留下孤立的文本块
+                stale_ids = []
+                for key in previous_keys:
+                    if key == kept_key:
+                        continue
+                    stale_ids.extend(
+                        VectorStore._release_file(
+                            vectorstore, manifest, key, manifest.remove_file(key)
+                        )
+                    )
+                if stale_ids and vectorstore is not None:
+                    VectorStore._delete_chunks(vectorstore, stale_ids)
+                    logger.info(
+                        f"删除文件 {loaded.file_name} 旧版本的 {len(stale_ids)} 个文本块"
+                    )
+                if dedup is not None:
+                    dedup.index.remove(stale_ids)
+
+                if kept_key is not None:
+                    entry = manifest.move_file(kept_key, loaded.file_id)
+                    # 重新上传后文件ID、标签等可能变化，同步到已有文本块
+                    if vectorstore is not None:
+                        manifest.updated_chunks.update(
+                            VectorStore._update_chunk_metadata(
+                                vectorstore, entry["chunk_ids"], loaded.metadata
+                            )
+                        )
+                        manifest.updated_chunks.update(
+                            VectorStore._update_duplicate_origins(
+                                vectorstore,
+                                entry.get("duplicate_ids", []),
+                                kept_key,
+                                loaded.metadata,
+                            )
+                        )
                     continue
 
-            return documents
+                # 大文件分批解析，每批切分后立即产出，只保留文本块ID
+                chunk_ids, duplicate_ids = [], []
+                try:
+                    async for batch in loaded.batches:
+                        chunks = batch.documents
+                        if not batch.chunked:
+                            chunks = await loop.run_in_executor(
+                                None, text_splitter.split_documents, chunks
+                            )
+                        for chunk in chunks:
+                            chunk.id = str(uuid.uuid4())
+                        if dedup is not None:
+                            chunks, merged_into = await dedup.filter(chunks, vectorstore)
+                            duplicate_ids.extend(merged_into)
+                        chunk_ids.extend(chunk.id for chunk in chunks)
+
+                        page_count += batch.units
+                        chunk_count += len(chunks)
+                        if progress is not None:
+                            progress.add_pages(batch.units)
+                            progress.add_chunks(loaded.file_name, len(chunks))
+                        for chunk in chunks:
+                            yield chunk
+                finally:
+                    loaded.close()
+                manifest.set_file(
+                    loaded.file_id,
+                    loaded.file_name,
+                    loaded.content_hash,
+                    chunk_ids,
+                    embedding_model_id(),
+                    duplicate_ids,
+                )
         except Exception as e:
             logger.error(f"加载文档时出错: {str(e)}")
             raise
-        finally:
-            # 清理临时目录
-            if temp_dir.exists():
-                shutil.rmtree(temp_dir, ignore_errors=True)
+        logger.info(f"共加载 {page_count} 页/行，切分为 {chunk_count} 个文本块")
 
     @staticmethod
-    async def create_vectorstore(db: Session):
-        """创建或更新向量数据库"""
+    async def create_vectorstore(
+        db: AsyncSession, progress=None, collection: str = None
+    ):
+        """创建或更新向量数据库
+
+        Args:
+            db: 数据库会话
+            progress: 进度记录对象(IngestionJob)，为空时不记录进度
+            collection: 知识库名，默认知识库为空
+        """
         try:
-            if (
-                os.path.exists(settings.FAISS_INDEX_PATH)
-                and os.path.isdir(settings.FAISS_INDEX_PATH)
-                and len(os.listdir(settings.FAISS_INDEX_PATH)) > 0
-            ):
+            pipeline = EmbeddingPipeline(VectorStore.get_embeddings(max_retries=0))
+            existing_vectorstore = None
+            trained_index = None
+            manifest = IndexManifest()
+            dedup = None
+            factory = Collection(collection).setting("FAISS_INDEX_FACTORY")
+            index_path = VectorStore._resolve_index(collection)[1]
+            if index_path is not None:
                 logger.info("检测到已存在的向量数据库，执行增量更新")
-                existing_vectorstore = VectorStore.load_vectorstore()
-                documents = await VectorStore.load_documents(db)
-
-                text_splitter = RecursiveCharacterTextSplitter(
-                    chunk_size=settings.CHUNK_SIZE, chunk_overlap=settings.CHUNK_OVERLAP
+                VectorStore._check_embedding_model(index_path)
+                # 反序列化和保存索引都是阻塞操作，放到线程池中避免影响问答请求
+                existing_vectorstore = await asyncio.to_thread(
+                    VectorStore.load_vectorstore, index_path, True
                 )
-                new_docs = text_splitter.split_documents(documents)
-
-                existing_vectorstore.add_documents(new_docs)
-                existing_vectorstore.save_local(settings.FAISS_INDEX_PATH)
-                logger.info("向量索引已更新")
-                return existing_vectorstore
-
-            # 创建新的向量数据库
-            documents = await VectorStore.load_documents(db)
-            if not documents:
-                return None
-
-            logger.info(f"共加载 {len(documents)} 个文档片段")
-
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=settings.CHUNK_SIZE, chunk_overlap=settings.CHUNK_OVERLAP
+                # 加载失败时继续会以空索引构建新版本并替换 CURRENT，已有的文本块
+                # 全部丢失，清单却仍记录为已学习，因此中止本次重建
+                if existing_vectorstore is None:
+                    raise RuntimeError(
+                        f"无法加载已有的向量数据库 {index_path}，已中止重建，"
+                        "当前版本保持不变"
+                    )
+                manifest = await asyncio.to_thread(
+                    VectorStore.load_manifest, index_path, existing_vectorstore
+                )
+                trained_index = await asyncio.to_thread(
+                    VectorStore._to_working_copy, existing_vectorstore, index_path
+                )
+                # 索引类型配置变化时即使没有文件变化也需要重新构建
+                if manifest.index.get("factory", faiss_index.FLAT) != factory:
+                    manifest.dirty = True
+                # 旧格式 (pickle) 的索引和旧表结构的 docstore 重新保存为新格式
+                if not SqliteDocstore.is_compatible(index_path):
+                    manifest.dirty = True
+
+            if settings.DEDUP_ENABLED:
+                dedup_index = await asyncio.to_thread(DedupIndex.load, index_path)
+                if dedup_index is None:
+                    dedup_index = await asyncio.to_thread(
+                        DedupIndex.from_docstore, existing_vectorstore
+                    )
+                    manifest.dirty = manifest.dirty or existing_vectorstore is not None
+                dedup = ChunkDeduplicator(dedup_index, VectorStore.get_embeddings())
+
+            vectorstore = await pipeline.add_documents(
+                VectorStore.split_documents(
+                    db, manifest, existing_vectorstore, progress, collection, dedup
+                ),
+                existing_vectorstore,
+                query_embedding=VectorStore.get_query_embeddings(),
+                progress=progress,
             )
-            docs = text_splitter.split_documents(documents)
-            logger.info(f"文本切分完成，共生成 {len(docs)} 个文本块")
+            if vectorstore is None or not manifest.dirty:
+                logger.info("没有新的文本块需要写入向量数据库")
+                return vectorstore
+            if dedup is not None:
+                updated = dedup.apply(vectorstore, manifest)
+                logger.info(
+                    f"合并 {dedup.merged} 个近似重复的文本块，"
+                    f"出处记录到 {updated} 个保留的文本块"
+                )
 
-            embedding = OpenAIEmbeddings(
-                openai_api_key=settings.OPENAI_API_KEY,
-                openai_api_base=settings.OPENAI_API_BASE,
+            manifest.embedding_model = embedding_model_id()
+            version = await asyncio.to_thread(
+                VectorStore.save_vectorstore,
+                vectorstore,
+                manifest,
+                trained_index,
+                collection,
+                dedup.index if dedup is not None else None,
+            )
+            VectorStoreRegistry().swap(
+                await asyncio.to_thread(
+                    VectorStore._open_version, vectorstore, version, collection
+                ),
+                version,
+                collection,
             )
-
-            vectorstore = FAISS.from_documents(docs, embedding)
-            vectorstore.save_local(settings.FAISS_INDEX_PATH)
             logger.info("向量索引已保存")
+            VectorStore._log_cache_stats()
             return vectorstore
         except Exception as e:
             logger.error(f"创建向量数据库时发生错误: {str(e)}")
             raise
 
     @staticmethod
-    def load_vectorstore():
-        """加载向量数据库"""
-        try:
-            embeddings = OpenAIEmbeddings(
-                openai_api_key=settings.OPENAI_API_KEY,
-                openai_api_base=settings.OPENAI_API_BASE,
+    def load_manifest(
+        index_path: str = None, vectorstore=None, collection: str = None
+    ) -> IndexManifest:
+        """读取索引清单，旧版本索引没有清单时根据 docstore 重建"""
+        if index_path is None:
+            index_path = VectorStore._resolve_index(collection)[1]
+        if index_path is None:
+            return IndexManifest()
+
+        manifest = IndexManifest.load(index_path)
+        if manifest is None:
+            if vectorstore is None:
+                vectorstore = VectorStore.load_vectorstore(index_path)
+            manifest = (
+                IndexManifest.from_docstore(vectorstore) if vectorstore else IndexManifest()
             )
-            vectorstore = FAISS.load_local(
-                settings.FAISS_INDEX_PATH,
-                embeddings,
-                allow_dangerous_deserialization=True,
+        return manifest
+
+    @staticmethod
+    def _check_embedding_model(index_path: str):
+        """索引的向量模型与当前配置不一致时拒绝加载，查询向量与索引不在同一向量空间"""
+        manifest = IndexManifest.load(index_path)
+        model = manifest.embedding_model if manifest is not None else None
+        if model is not None and model != embedding_model_id():
+            raise ValueError(
+                f"索引由向量模型 {model} 构建，与当前配置的 {embedding_model_id()} "
+                "不一致，请恢复配置或删除索引后重建"
             )
-            return vectorstore
-        except Exception as e:
-            logger.error(f"加载向量数据库失败: {str(e)}")
+
+    @staticmethod
+    def list_documents(collection: str = None) -> list:
+        """从索引清单获取已学习的文件列表，无需加载索引"""
+        return VectorStore.load_manifest(collection=collection).list_documents()
+
+    @staticmethod
+    def _delete_chunks(vectorstore, chunk_ids: list[str]) -> list[str]:
+        """从索引中删除存在的文本块，返回实际删除的ID"""
+        existing_ids = [
+            chunk_id for chunk_id in chunk_ids if chunk_id in vectorstore.docstore._dict
+        ]
+        if existing_ids:
+            vectorstore.delete(existing_ids)
+        return existing_ids
+
+    @staticmethod
+    def _update_chunk_metadata(vectorstore, chunk_ids: list[str], metadata: dict):
+        """更新工作副本中文本块的文件级元数据，返回实际更新的ID"""
+        updated = []
+        for chunk_id in chunk_ids:
+            doc = vectorstore.docstore.search(chunk_id)
+            if isinstance(doc, Document):
+                doc.metadata.update(metadata)
+                updated.append(chunk_id)
+        return updated
+
+    @staticmethod
+    def _update_duplicate_origins(
+        vectorstore, chunk_ids: list[str], file_key: str, metadata: dict
+    ) -> list[str]:
+        """文件重新上传后，同步保留的文本块上记录的该文件出处"""
+        updated = []
+        for chunk_id in set(chunk_ids):
+            doc = vectorstore.docstore.search(chunk_id)
+            if not isinstance(doc, Document):
+                continue
+            for ref in doc.metadata.get(DUPLICATES_KEY, []):
+                if str(ref.get("file_id")) == file_key:
+                    ref.update(metadata)
+                    updated.append(chunk_id)
+        return updated
+
+    @staticmethod
+    def _release_file(vectorstore, manifest: IndexManifest, file_key: str, entry) -> list:
+        """移除文件前处理近似重复文本块的出处，返回需要删除的文本块ID
+
+        该文件合并到其他文本块的重复内容，从保留的文本块上去掉其出处；该文件
+        保留的文本块如果还记录着其他文件的出处，转给第一个仍在清单中的文件，
+        不删除，其他文件的内容不会因此丢失。
+        """
+        if entry is None:
+            return []
+        if vectorstore is None:
+            return list(entry["chunk_ids"])
+
+        for chunk_id in set(entry.get("duplicate_ids", [])):
+            doc = vectorstore.docstore.search(chunk_id)
+            if isinstance(doc, Document) and doc.metadata.get(DUPLICATES_KEY):
+                doc.metadata[DUPLICATES_KEY] = [
+                    ref
+                    for ref in doc.metadata[DUPLICATES_KEY]
+                    if str(ref.get("file_id")) != file_key
+                ]
+                manifest.updated_chunks.add(chunk_id)
+
+        stale_ids = []
+        for chunk_id in entry["chunk_ids"]:
+            doc = vectorstore.docstore.search(chunk_id)
+            refs = (
+                [
+                    ref
+                    for ref in doc.metadata.get(DUPLICATES_KEY, [])
+                    if str(ref.get("file_id")) != file_key
+                ]
+                if isinstance(doc, Document)
+                else []
+            )
+            owner = next(
+                (ref for ref in refs if manifest.get_file(ref.get("file_id"))), None
+            )
+            if owner is None:
+                stale_ids.append(chunk_id)
+                continue
+            owner_entry = manifest.get_file(owner["file_id"])
+            owner_entry["chunk_ids"].append(chunk_id)
+            if chunk_id in owner_entry.get("duplicate_ids", []):
+                owner_entry["duplicate_ids"].remove(chunk_id)
+            refs.remove(owner)
+            doc.metadata.update(owner)
+            doc.metadata[DUPLICATES_KEY] = refs
+            manifest.updated_chunks.add(chunk_id)
+        return stale_ids
+
+    @staticmethod
+    def index_report(
+        k: int = 10,
+        num_queries: int = 100,
+        nprobe_values: list[int] = None,
+        ef_search_values: list[int] = None,
+        collection: str = None,
+    ) -> dict:
+        """评估当前索引相对精确检索的召回率和延迟"""
+        registry = VectorStoreRegistry()
+        vectorstore = registry.get(collection)
+        if vectorstore is None:
             return None
 
+        index = vectorstore.index
+        if faiss_index.is_flat(index):
+            vectors = faiss_index.get_vectors(index)
+        else:
+            vectors = faiss_index.load_vectors(VectorStore._resolve_index(collection)[1])
+            if vectors is None:
+                vectors = index.reconstruct_n(0, index.ntotal)
+
+        report = faiss_index.recall_report(
+            index, vectors, k, num_queries, nprobe_values, ef_search_values
+        )
+        report["collection"] = Collection(collection).name
+        report["version"] = registry.get_version(collection)
+        report["factory"] = Collection(collection).setting("FAISS_INDEX_FACTORY")
+        return report
+
     @staticmethod
-    def delete_documents(doc_ids: list[str]):
-        """删除指定文档的向量数据
-        Args:
-            doc_ids: 要删除的文档ID列表
+    def compression_report(
+        k: int = 10,
+        num_queries: int = 100,
+        factories: list[str] = None,
+        max_vectors: int = 100000,
+        collection: str = None,
+    ) -> dict:
+        """用当前索引的原始向量比较各压缩存储方式的内存占用和召回率"""
+        vectorstore = VectorStoreRegistry().get(collection)
+        if vectorstore is None:
+            return None
+
+        index = vectorstore.index
+        vectors = faiss_index.load_vectors(
+            VectorStore._resolve_index(collection)[1], mmap=True
+        )
+        if vectors is None:
+            vectors = index.reconstruct_n(0, index.ntotal)
+        # 向量较多时随机抽样，控制构建各种索引的耗时
+        if len(vectors) > max_vectors:
+            rng = np.random.default_rng(0)
+            vectors = vectors[np.sort(rng.choice(len(vectors), max_vectors, replace=False))]
+
+        config = Collection(collection)
+        report = faiss_index.compression_report(
+            vectors,
+            factories,
+            index.metric_type,
+            k,
+            num_queries,
+            config.setting("FAISS_RESCORE_FACTOR"),
+        )
+        report["collection"] = config.name
+        report["factory"] = config.setting("FAISS_INDEX_FACTORY")
+        return report
+
+    @staticmethod
+    def _log_cache_stats():
+        if settings.EMBEDDING_CACHE_ENABLED:
+            logger.info(f"向量缓存统计: {EmbeddingCache().stats()}")
+
+    @staticmethod
+    def _resolve_index(collection: str = None):
+        """解析知识库当前生效的索引版本
+
+        Returns:
+            tuple: (版本号, 索引目录)，索引不存在时返回 (None, None)
         """
+        root = Collection(collection).root
+        current_file = os.path.join(root, CURRENT_FILE)
         try:
-            vectorstore = VectorStore.load_vectorstore()
-            if not vectorstore:
-                logger.warning("向量数据库不存在")
-                return False
+            with open(current_file, encoding="utf-8") as f:
+                version = f.read().strip()
+            path = os.path.join(root, version)
+            if version and os.path.isdir(path):
+                return version, path
+        except FileNotFoundError:
+            pass
+
+        # 兼容旧版本：索引文件直接保存在根目录下
+        legacy_index = os.path.join(root, "index.faiss")
+        if os.path.isfile(legacy_index):
+            return f"legacy-{os.stat(legacy_index).st_mtime_ns}", root
+        return None, None
 
-            docstore = vectorstore.docstore
-
-            # 打印删除前的文档数量
-            logger.info(f"删除前文档总数: {len(docstore._dict)}")
-            logger.info(f"要删除的文档IDs: {doc_ids}")
-
-            # 验证所有文档ID是否存在
-            docs_to_delete = []
-            file_paths_to_update = set()
-            for doc_id in doc_ids:
-                logger.info(f"检查文档ID: {doc_id}")
-                if doc_id in docstore._dict:
-                    docs_to_delete.append(doc_id)
-                    source = docstore._dict[doc_id].metadata.get("source")
-                    logger.info(f"找到文档，源文件: {source}")
-                    if source:
-                        relative_path = os.path.relpath(source, settings.BOOKS_DIR)
-                        file_paths_to_update.add(relative_path)
-                else:
-                    logger.warning(f"文档ID不存在: {doc_id}")
+    @staticmethod
+    def get_index_version(collection: str = None):
+        """获取知识库当前生效的索引版本号，索引不存在时返回 None"""
+        return VectorStore._resolve_index(collection)[0]
 
-            if not docs_to_delete:
-                logger.warning("未找到指定文档的向量数据")
-                return False
+    @staticmethod
+    def save_vectorstore(
+        vectorstore,
+        manifest: IndexManifest = None,
+        trained_index=None,
+        collection: str = None,
+        dedup: DedupIndex = None,
+    ) -> str:
+        """将向量数据库及其清单保存为新的版本目录，并原子切换 CURRENT 指针
+
+        写入过程中其他请求/进程仍读取旧版本，切换后才会看到新版本。配置了
+        FAISS_INDEX_FACTORY 时，用 Flat 工作副本中的原始向量构建近似检索索引，
+        替换 vectorstore.index 后保存，原始向量另存一份供下次增量更新使用。
+
+        Args:
+            vectorstore: 索引为 Flat 工作副本的向量数据库
+            manifest: 索引清单
+            trained_index: 上一版本已训练的近似索引，数据量增长不大时复用
+            collection: 知识库名，默认知识库为空
+            dedup: 文本块去重签名，与索引一同保存
+
+        Returns:
+            str: 新的版本号
+        """
+        config = Collection(collection)
+        root = config.root
+        os.makedirs(root, exist_ok=True)
+
+        vectors = VectorStore._build_search_index(
+            vectorstore, manifest, trained_index, config.setting("FAISS_INDEX_FACTORY")
+        )
+        # 在上一版本的 docstore 基础上增量写入
+        base_path = VectorStore._resolve_index(collection)[1]
+
+        version = f"{VERSION_PREFIX}{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        path = os.path.join(root, version)
+        os.makedirs(path)
+        faiss_index.write_index(vectorstore.index, path)
+        SqliteDocstore.write(
+            path,
+            vectorstore.docstore,
+            vectorstore.index_to_docstore_id,
+            base_path,
+            manifest.updated_chunks if manifest is not None else (),
+        )
+        if vectors is not None:
+            faiss_index.save_vectors(path, vectors)
+        if dedup is not None:
+            dedup.save(path)
+        if manifest is not None:
+            manifest.save(path)
+
+        # 先写临时文件再 os.replace，保证读取方只会看到完整的版本号
+        tmp_file = os.path.join(root, f".{CURRENT_FILE}.{uuid.uuid4().hex}")
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            f.write(version)
+        os.replace(tmp_file, os.path.join(root, CURRENT_FILE))
+        logger.info(f"向量索引版本已切换为 {version}")
+
+        VectorStore._prune_versions(root, version)
+        return version
+
+    @staticmethod
+    def _build_search_index(
+        vectorstore, manifest=None, trained_index=None, factory: str = None
+    ):
+        """按索引工厂字符串 (默认 FAISS_INDEX_FACTORY) 将 Flat 工作副本替换为近似检索索引
+
+        Returns:
+            原始向量，索引为 Flat 无需另存时返回 None
+        """
+        factory = factory or settings.FAISS_INDEX_FACTORY
+        previous = manifest.index if manifest is not None else {}
+        if factory == faiss_index.FLAT or not faiss_index.is_flat(vectorstore.index):
+            if manifest is not None:
+                manifest.index = {"factory": faiss_index.FLAT}
+            return None
+
+        vectors = faiss_index.get_vectors(vectorstore.index)
+        if trained_index is not None and faiss_index.can_reuse_training(
+            previous, factory, len(vectors)
+        ):
+            trained_size = previous["trained_size"]
+        else:
+            trained_index = None
+            trained_size = len(vectors)
+
+        started = time.monotonic()
+        vectorstore.index = faiss_index.build_index(
+            vectors, factory, vectorstore.index.metric_type, trained_index
+        )
+        if manifest is not None:
+            manifest.index = {
+                "factory": factory,
+                "resolved_factory": faiss_index.resolve_factory(factory, trained_size),
+                "trained_size": trained_size,
+            }
+        logger.info(
+            f"已构建 {factory} 索引，共 {len(vectors)} 个向量，"
+            f"{'复用已有训练结果' if trained_index is not None else '重新训练'}，"
+            f"耗时 {time.monotonic() - started:.1f}s"
+        )
+        return vectors
+
+    @staticmethod
+    def _to_working_copy(vectorstore, index_path: str):
+        """将近似检索索引替换为基于原始向量的 Flat 工作副本，便于增删文本块
+
+        Returns:
+            原来的近似索引，供保存时复用训练结果；本身已是 Flat 时返回 None
+        """
+        if vectorstore is None or faiss_index.is_flat(vectorstore.index):
+            return None
+        index = vectorstore.index
+        vectors = faiss_index.load_vectors(index_path)
+        if vectors is None:
+            # 没有保存原始向量时尝试从索引中还原 (HNSW、带直接映射的 IVF 支持)
+            vectors = index.reconstruct_n(0, index.ntotal)
+        vectorstore.index = faiss_index.flat_index(vectors, index.metric_type)
+        return index
+
+    @staticmethod
+    def _open_version(vectorstore, version: str, collection: str = None):
+        """保存新版本后重新以只读方式打开，释放工作副本占用的内存"""
+        reopened = VectorStore.load_vectorstore(
+            os.path.join(Collection(collection).root, version)
+        )
+        return reopened or vectorstore
+
+    @staticmethod
+    def _prune_versions(root: str, current_version: str):
+        """清理过期的索引版本目录及旧版本遗留的根目录索引文件"""
+        versions = sorted(
+            (
+                name
+                for name in os.listdir(root)
+                if name.startswith(VERSION_PREFIX)
+                and name != current_version
+                and os.path.isdir(os.path.join(root, name))
+            ),
+            key=lambda name: os.path.getmtime(os.path.join(root, name)),
+            reverse=True,
+        )
+        # 保留最近的若干版本，避免其他进程正在加载的目录被删除
+        for name in versions[max(settings.VECTOR_STORE_KEEP_VERSIONS - 1, 0) :]:
+            shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+
+        for legacy_file in ("index.faiss", "index.pkl"):
+            legacy_path = os.path.join(root, legacy_file)
+            if os.path.isfile(legacy_path):
+                os.remove(legacy_path)
+
+    @staticmethod
+    def load_vectorstore(path: str = None, writable: bool = False):
+        """加载向量数据库
 
-            # 删除文档
-            logger.info(f"开始删除文档: {docs_to_delete}")
-            vectorstore.delete(docs_to_delete)
+        问答使用的只读实例文本块留在 SQLite 中按需读取，并提供 BM25 检索，
+        索引按 VECTOR_STORE_MMAP 以内存映射方式打开，加载几乎不耗时也不占用
+        额外内存；需要增删文本块时传 writable=True，完整读入内存。
 
-            # 验证删除结果
-            logger.info(f"删除后文档总数: {len(docstore._dict)}")
-            for doc_id in docs_to_delete:
-                if doc_id in docstore._dict:
-                    logger.error(f"文档 {doc_id} 删除失败")
-                else:
-                    logger.info(f"文档 {doc_id} 删除成功")
+        Args:
+            path: 索引目录，默认为当前生效的版本
+            writable: 是否加载为可修改的实例
+        """
+        try:
+            if path is None:
+                path = VectorStore._resolve_index()[1]
+            if path is None:
+                logger.warning("向量数据库不存在")
+                return None
+
+            VectorStore._check_embedding_model(path)
+            embeddings = VectorStore.get_query_embeddings()
+            if not SqliteDocstore.exists(path):
+                # 旧格式索引的 docstore 以 pickle 保存，下次重建或删除文档时转换为新格式
+                return FAISS.load_local(
+                    path,
+                    embeddings,
+                    allow_dangerous_deserialization=True,
+                )
 
-            # 保存更新后的向量数据库
-            vectorstore.save_local(settings.FAISS_INDEX_PATH)
-            logger.info(f"成功删除 {len(docs_to_delete)} 个文档的向量数据")
+            index = faiss_index.read_index(
+                path, mmap=settings.VECTOR_STORE_MMAP and not writable
+            )
+            docstore = SqliteDocstore(path)
+            if not writable:
+                vectorstore = FAISS(embeddings, index, docstore, SqliteIdMap(docstore))
+                if faiss_index.is_lossy(index):
+                    # 检索时用原始向量精确重排，以内存映射打开，只读取候选所在的页
+                    vectorstore.full_vectors = faiss_index.load_vectors(path, mmap=True)
+                return vectorstore
+            memory_docstore, index_to_docstore_id = docstore.to_memory()
+            return FAISS(embeddings, index, memory_docstore, index_to_docstore_id)
+        except Exception as e:
+            logger.error(f"加载向量数据库失败: {str(e)}")
+            return None
+
+    @staticmethod
+    async def delete_documents(doc_ids: list[str], collection: str = None):
+        """删除指定文档的向量数据
+        Args:
+            doc_ids: 要删除的文件ID列表，也兼容直接传入文本块ID
+            collection: 知识库名，默认知识库为空
+        """
+        try:
+            # 索引的加载、删除和保存是阻塞操作，放到线程池中执行
+            changed, file_ids = await asyncio.to_thread(
+                VectorStore._delete_from_index, doc_ids, collection
+            )
+            if not changed:
+                return False
 
             # 变更数据库状态为未学习
-            db = next(get_db())
-            for file_path in file_paths_to_update:
-                file = db.query(files).filter(files.file_path == file_path).first()
-                if file:
-                    file.is_study = False
-                    db.commit()
-                    db.refresh(file)
-
-                # 将文件从ReadBooks目录中删除
-                read_books_path = os.path.join(settings.READ_BOOKS_DIR, file_path)
-                if os.path.exists(read_books_path):
-                    os.remove(read_books_path)
+            file_ids = [file_id for file_id in file_ids if isinstance(file_id, int)]
+            if file_ids:
+                async with SessionLocal() as db:
+                    await db.execute(
+                        update(files)
+                        .where(files.id.in_(file_ids))
+                        .values(is_study=False)
+                    )
+                    await db.commit()
 
             return True
 
         except Exception as e:
             logger.error(f"删除向量数据时发生错误: {str(e)}")
             return False
+
+    @staticmethod
+    def _delete_from_index(doc_ids: list[str], collection: str = None):
+        """从索引中删除文档并保存新版本
+
+        Returns:
+            tuple: (是否保存了新版本, 涉及的文件ID)
+        """
+        index_path = VectorStore._resolve_index(collection)[1]
+        vectorstore = VectorStore.load_vectorstore(index_path, writable=True)
+        if not vectorstore:
+            logger.warning("向量数据库不存在")
+            return False, set()
+
+        manifest = VectorStore.load_manifest(index_path, vectorstore)
+        trained_index = VectorStore._to_working_copy(vectorstore, index_path)
+        logger.info(f"要删除的文档IDs: {doc_ids}")
+
+        # 通过清单找到每个文件对应的文本块
+        chunk_ids = []
+        file_ids = set()
+        for doc_id in doc_ids:
+            entry = manifest.remove_file(doc_id)
+            if entry is None:
+                entry = manifest.remove_chunk(doc_id)
+                if entry is None:
+                    logger.warning(f"文档ID不存在: {doc_id}")
+                    continue
+                chunk_ids.append(doc_id)
+            else:
+                chunk_ids.extend(
+                    VectorStore._release_file(vectorstore, manifest, str(doc_id), entry)
+                )
+            file_ids.add(entry["file_id"])
+
+        deleted_ids = VectorStore._delete_chunks(vectorstore, chunk_ids)
+        # 文本块全部转给了其他文件时没有向量需要删除，但清单和出处已变化
+        if not deleted_ids and not manifest.updated_chunks:
+            logger.warning("未找到指定文档的向量数据")
+            return False, set()
+
+        # 签名随索引一起保存，已删除的文本块不再参与去重
+        dedup = DedupIndex.load(index_path)
+        if dedup is not None:
+            dedup.remove(deleted_ids)
+
+        # 保存更新后的向量数据库，并替换进程内共享的实例
+        version = VectorStore.save_vectorstore(
+            vectorstore, manifest, trained_index, collection, dedup
+        )
+        VectorStoreRegistry().swap(
+            VectorStore._open_version(vectorstore, version, collection),
+            version,
+            collection,
+        )
+        logger.info(
+            f"成功删除 {len(deleted_ids)} 个文本块的向量数据，"
+            f"{len(manifest.updated_chunks)} 个文本块的出处已更新"
+        )
+        return True, file_ids
+
+
+class _LoadedCollection:
+    """注册表中一个已加载的知识库"""
+
+    __slots__ = ("vectorstore", "version", "size", "last_check", "reloading")
+
+    def __init__(self, vectorstore, version: str, size: int):
+        self.vectorstore = vectorstore
+        self.version = version
+        # 索引文件大小，近似该知识库常驻的内存；文本块留在 SQLite 中不计入
+        self.size = size
+        self.last_check = time.monotonic()
+        self.reloading = False
+
+
+class VectorStoreRegistry:
+    """进程内共享的向量数据库注册表
+
+    每个知识库首次使用时加载只读实例，之后所有请求共享。已加载的知识库按
+    最近使用排序，索引总大小超过 VECTOR_STORE_MEMORY_BUDGET 时淘汰最久未用的
+    知识库，下次使用时再重新加载。索引在磁盘上切换版本后 (重建、删除文档或
+    其他 worker 进程写入) 在后台加载新版本并原子替换，加载期间请求继续使用旧实例。
+    """
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __new__(cls):
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    instance = super(VectorStoreRegistry, cls).__new__(cls)
+                    # 知识库名 -> _LoadedCollection，按最近使用排序
+                    instance._entries = OrderedDict()
+                    instance._lock = threading.Lock()
+                    # 每个知识库一把加载锁，不同知识库可以并行加载
+                    instance._load_locks = {}
+                    cls._instance = instance
+        return cls._instance
+
+    def get_version(self, collection: str = None):
+        """知识库已加载实例对应的索引版本号"""
+        entry = self._entries.get(Collection(collection).name)
+        return entry.version if entry is not None else None
+
+    def load(self, collection: str = None):
+        """同步加载知识库当前版本的索引，版本未变化时直接返回已有实例"""
+        name = Collection(collection).name
+        with self._load_lock(name):
+            version, path = VectorStore._resolve_index(name)
+            entry = self._entries.get(name)
+            if version is None:
+                with self._lock:
+                    self._entries.pop(name, None)
+                return None
+            if entry is not None and entry.version == version:
+                return entry.vectorstore
+
+            vectorstore = VectorStore.load_vectorstore(path)
+            if vectorstore is None:
+                return entry.vectorstore if entry is not None else None
+            self._put(name, vectorstore, version, path)
+            logger.info(f"知识库 {name} 的 FAISS 向量数据库已加载，版本: {version}")
+            return vectorstore
+
+    def get(self, collection: str = None):
+        """获取知识库共享的向量数据库实例，未加载时同步加载
+
+        按 VECTOR_STORE_CHECK_INTERVAL 检查磁盘上的版本指针，发现变化时在
+        后台线程中加载新版本，当前请求不会被阻塞。
+        """
+        name = Collection(collection).name
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None:
+                self._entries.move_to_end(name)
+        if entry is None:
+            return self.load(name)
+
+        now = time.monotonic()
+        if now - entry.last_check >= settings.VECTOR_STORE_CHECK_INTERVAL:
+            entry.last_check = now
+            if VectorStore.get_index_version(name) != entry.version:
+                self._reload_in_background(name, entry)
+        return entry.vectorstore
+
+    def swap(self, vectorstore, version: str = None, collection: str = None):
+        """用已在内存中的新实例替换知识库的共享实例，避免再次从磁盘加载"""
+        name = Collection(collection).name
+        version = version or VectorStore.get_index_version(name)
+        path = os.path.join(Collection(name).root, version) if version else None
+        self._put(name, vectorstore, version, path)
+
+    def stats(self) -> dict:
+        """已加载的知识库及其索引大小，按最近使用排序"""
+        with self._lock:
+            loaded = [
+                {"collection": name, "version": entry.version, "size_bytes": entry.size}
+                for name, entry in reversed(self._entries.items())
+            ]
+        return {
+            "memory_budget_mb": settings.VECTOR_STORE_MEMORY_BUDGET,
+            "loaded_bytes": sum(item["size_bytes"] for item in loaded),
+            "loaded": loaded,
+        }
+
+    def _load_lock(self, name: str) -> threading.Lock:
+        with self._lock:
+            return self._load_locks.setdefault(name, threading.Lock())
+
+    def _put(self, name: str, vectorstore, version: str, path: str = None):
+        size = 0
+        if path is not None:
+            try:
+                size = os.path.getsize(os.path.join(path, faiss_index.INDEX_FILE))
+            except OSError:
+                pass
+        with self._lock:
+            self._entries[name] = _LoadedCollection(vectorstore, version, size)
+            self._entries.move_to_end(name)
+            self._evict(keep=name)
+
+    def _evict(self, keep: str):
+        """淘汰最久未使用的知识库直到总大小不超过预算，正在使用的请求仍持有旧实例"""
+        budget = settings.VECTOR_STORE_MEMORY_BUDGET * 1024 * 1024
+        if budget <= 0:
+            return
+        total = sum(entry.size for entry in self._entries.values())
+        for name in list(self._entries):
+            if total <= budget:
+                break
+            if name == keep:
+                continue
+            total -= self._entries.pop(name).size
+            logger.info(f"向量库内存超出预算，淘汰知识库 {name}")
+
+    def _reload_in_background(self, name: str, entry: _LoadedCollection):
+        with self._lock:
+            if entry.reloading:
+                return
+            entry.reloading = True
+
+        def _reload():
+            try:
+                self.load(name)
+            except Exception as e:
+                logger.error(f"热更新知识库 {name} 的向量数据库失败: {str(e)}")
+            finally:
+                entry.reloading = False
+
+        threading.Thread(target=_reload, daemon=True).start()
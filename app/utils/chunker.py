@@ -0,0 +1,239 @@
+import logging
+import math
+import re
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Iterable, List, Optional
+
+from langchain_core.documents import Document
+
+PARAGRAPH = "paragraph"
+HEADING = "heading"
+TABLE = "table"
+
+# 句末标点 (含中文全角标点) 及其后紧跟的引号、括号；英文句号后需为空白或文本
+# 结尾，小数点、缩写中间的点不切分
+_CLOSERS = r"[”’」』）)\]\"']*"
+_SENTENCE_END = re.compile(
+    r"[^\n]*?"
+    r"(?:[。！？；!?;\n]+|…+|\.+(?=" + _CLOSERS + r"(?:\s|$))|$)"
+    + _CLOSERS
+)
+_CJK = re.compile(r"[぀-ヿ㐀-䶿一-鿿가-힯豈-﫿]")
+
+# 在解析进程中使用，不依赖应用的日志配置
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ChunkOptions:
+    """切分参数，随任务传给解析进程，不依赖子进程中的配置"""
+
+    chunk_tokens: int = 400
+    overlap_tokens: int = 40
+    # 短于该长度的段落与后续内容合并，标题总是与后续内容合并
+    min_tokens: int = 80
+    encoding: str = "cl100k_base"
+    detect_tables: bool = True
+
+
+@dataclass
+class TextBlock:
+    """版面中的一个文本块：段落、标题或表格"""
+
+    text: str
+    kind: str = PARAGRAPH
+    page: int = 0
+
+
+@dataclass
+class _Chunk:
+    parts: List[str] = field(default_factory=list)
+    # 每个片段所属文本块的序号，同一文本块拆出的句子直接相连
+    blocks: List[int] = field(default_factory=list)
+    kinds: List[str] = field(default_factory=list)
+    pages: List[int] = field(default_factory=list)
+    tokens: int = 0
+    # 文档块开始时所在章节的标题
+    section: Optional[str] = None
+
+    @property
+    def has_content(self) -> bool:
+        return any(kind != HEADING for kind in self.kinds)
+
+    def add(self, text: str, block: int, kind: str, page: int, tokens: int):
+        self.parts.append(text)
+        self.blocks.append(block)
+        self.kinds.append(kind)
+        self.pages.append(page)
+        self.tokens += tokens
+
+    def text(self) -> str:
+        text = ""
+        for i, part in enumerate(self.parts):
+            if i and self.blocks[i] != self.blocks[i - 1]:
+                text = text.rstrip() + "\n"
+            text += part
+        return text.strip()
+
+
+@lru_cache(maxsize=4)
+def _encoding(name: str):
+    """tiktoken 编码，未安装或无法下载词表 (离线环境) 时返回 None，改用估算"""
+    try:
+        import tiktoken
+
+        return tiktoken.get_encoding(name)
+    except Exception as e:
+        logger.warning(f"无法加载 tiktoken 编码 {name}，按字符数估算 token: {e}")
+        return None
+
+
+def count_tokens(text: str, encoding: str = "cl100k_base") -> int:
+    enc = _encoding(encoding)
+    if enc is not None:
+        return len(enc.encode(text, disallowed_special=()))
+    # 估算：每个中日韩字符约 1 个 token，其他字符约 4 个一个 token
+    cjk = len(_CJK.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def split_sentences(text: str) -> List[str]:
+    """按中英文句末标点和换行切分句子，标点保留在句尾"""
+    sentences = (match.group(0) for match in _SENTENCE_END.finditer(text))
+    return [sentence for sentence in sentences if sentence.strip()]
+
+
+def join_lines(lines: Iterable[str]) -> str:
+    """合并版面中的折行：中日韩文字之间直接相连，其他以空格相连"""
+    text = ""
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        if text and not (_CJK.match(text[-1]) and _CJK.match(line[0])):
+            text += " "
+        text += line
+    return text
+
+
+class Chunker:
+    """按 token 数切分版面文本块
+
+    相邻的短文本块合并到同一个文档块，标题与其后的内容放在一起，表格尽量
+    保持完整 (放不下时按行切分)；超长的段落按句子切分，单个句子仍超长时
+    按长度截断。段落被切开时，下一个文档块以上一块末尾不超过
+    overlap_tokens 的句子开头。
+    """
+
+    def __init__(self, options: ChunkOptions = None):
+        self.options = options or ChunkOptions()
+
+    def tokens(self, text: str) -> int:
+        return count_tokens(text, self.options.encoding)
+
+    def split_blocks(
+        self, blocks: Iterable[TextBlock], metadata: dict = None
+    ) -> List[Document]:
+        """将一个文件的全部文本块切分为文档块
+
+        Args:
+            blocks: 按阅读顺序排列的文本块
+            metadata: 每个文档块共有的元数据；page 为文档块的起始页，
+                end_page 为结束页，section 为所在章节的标题
+        """
+        limit = self.options.chunk_tokens
+        chunks: List[_Chunk] = []
+        current = _Chunk()
+        section = None
+
+        def flush(overlap: bool = False):
+            nonlocal current
+            if not current.has_content:
+                return
+            chunks.append(current)
+            carried = self._overlap(current) if overlap else None
+            current = _Chunk(section=section)
+            if carried:
+                previous = chunks[-1]
+                current.add(
+                    carried,
+                    previous.blocks[-1],
+                    PARAGRAPH,
+                    previous.pages[-1],
+                    self.tokens(carried),
+                )
+
+        for index, block in enumerate(blocks):
+            text = block.text.strip()
+            if not text:
+                continue
+            tokens = self.tokens(text)
+            if block.kind == HEADING:
+                # 新章节从新的文档块开始，已有内容过短时与新章节合并
+                if current.tokens >= self.options.min_tokens:
+                    flush()
+                section = text
+                if not current.has_content:
+                    current.section = text
+                current.add(text, index, HEADING, block.page, tokens)
+                continue
+
+            if current.tokens + tokens <= limit:
+                current.add(text, index, block.kind, block.page, tokens)
+                continue
+            if tokens <= limit and current.tokens >= self.options.min_tokens:
+                flush()
+                current.add(text, index, block.kind, block.page, tokens)
+                continue
+
+            # 放不下的段落按句子、表格按行逐个放入
+            if block.kind == TABLE:
+                pieces = [line + "\n" for line in text.split("\n")]
+            else:
+                pieces = split_sentences(text)
+            for piece in pieces:
+                for part in self._fit(piece):
+                    part_tokens = self.tokens(part)
+                    if current.parts and current.tokens + part_tokens > limit:
+                        flush(overlap=block.kind != TABLE)
+                    current.add(part, index, block.kind, block.page, part_tokens)
+        flush()
+
+        metadata = metadata or {}
+        return [
+            Document(
+                page_content=chunk.text(),
+                metadata={
+                    **metadata,
+                    "page": chunk.pages[0],
+                    "end_page": chunk.pages[-1],
+                    "section": chunk.section,
+                    "tokens": chunk.tokens,
+                },
+            )
+            for chunk in chunks
+        ]
+
+    def _overlap(self, chunk: _Chunk) -> str:
+        """文档块末尾不超过 overlap_tokens 的完整句子"""
+        budget = self.options.overlap_tokens
+        if budget <= 0 or chunk.kinds[-1] != PARAGRAPH:
+            return ""
+        carried = []
+        for sentence in reversed(split_sentences(chunk.parts[-1])):
+            tokens = self.tokens(sentence)
+            if tokens > budget:
+                break
+            carried.insert(0, sentence)
+            budget -= tokens
+        return "".join(carried)
+
+    def _fit(self, text: str) -> List[str]:
+        """超过文档块上限的单个句子按估算的字符数截断"""
+        limit = self.options.chunk_tokens
+        tokens = self.tokens(text)
+        if tokens <= limit:
+            return [text]
+        size = max(1, int(len(text) * limit / tokens * 0.9))
+        return [text[start : start + size] for start in range(0, len(text), size)]
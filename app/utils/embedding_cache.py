@@ -0,0 +1,205 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from app.config.index import settings
+from app.logging.logging import logger
+
+
+class EmbeddingCache:
+    """基于 SQLite 的持久化向量缓存
+
+    以 (模型名, 文本 sha256) 为键保存向量，按最近访问时间做 LRU 淘汰，
+    多个 worker 进程可以共享同一个缓存文件。
+    """
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __new__(cls):
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    instance = super(EmbeddingCache, cls).__new__(cls)
+                    instance._init_db(settings.EMBEDDING_CACHE_PATH)
+                    cls._instance = instance
+        return cls._instance
+
+    def _init_db(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (model, text_hash)
+            )
+            """
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_embeddings_last_access ON embeddings (last_access)"
+        )
+        self.conn.commit()
+
+    @staticmethod
+    def hash_text(text: str) -> str:
+        """计算文本内容哈希"""
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get_many(self, model: str, text_hashes: List[str]) -> dict:
+        """批量查询缓存，命中的条目会刷新访问时间
+
+        Returns:
+            dict: text_hash -> 向量
+        """
+        found = {}
+        if not text_hashes:
+            return found
+
+        unique_hashes = list(dict.fromkeys(text_hashes))
+        with self._lock:
+            # SQLite 单条语句的参数个数有限，分批查询
+            for start in range(0, len(unique_hashes), 500):
+                batch = unique_hashes[start : start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self.conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings "
+                    f"WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model, *batch],
+                ).fetchall()
+                for text_hash, vector in rows:
+                    found[text_hash] = np.frombuffer(vector, dtype=np.float32).tolist()
+
+            if found:
+                now = time.time()
+                self.conn.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE model = ? AND text_hash = ?",
+                    [(now, model, text_hash) for text_hash in found],
+                )
+                self.conn.commit()
+
+            hits = sum(1 for text_hash in text_hashes if text_hash in found)
+            self.hits += hits
+            self.misses += len(text_hashes) - hits
+        return found
+
+    def put_many(self, model: str, items: dict):
+        """批量写入缓存并按容量淘汰最久未访问的条目
+
+        Args:
+            model: 向量模型名称
+            items: text_hash -> 向量
+        """
+        if not items:
+            return
+
+        now = time.time()
+        with self._lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector, last_access) "
+                "VALUES (?, ?, ?, ?)",
+                [
+                    (model, text_hash, np.asarray(vector, dtype=np.float32).tobytes(), now)
+                    for text_hash, vector in items.items()
+                ],
+            )
+            self._evict()
+            self.conn.commit()
+
+    def _evict(self):
+        max_entries = settings.EMBEDDING_CACHE_MAX_ENTRIES
+        if max_entries <= 0:
+            return
+        (count,) = self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        overflow = count - max_entries
+        if overflow > 0:
+            self.conn.execute(
+                "DELETE FROM embeddings WHERE rowid IN "
+                "(SELECT rowid FROM embeddings ORDER BY last_access LIMIT ?)",
+                (overflow,),
+            )
+            logger.info(f"向量缓存已淘汰 {overflow} 条最久未使用的记录")
+
+    def stats(self) -> dict:
+        """缓存统计信息"""
+        with self._lock:
+            (count,) = self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        total = self.hits + self.misses
+        return {
+            "entries": count,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+class CachedEmbeddings(Embeddings):
+    """为文档向量化增加内容哈希缓存的 Embeddings 包装器
+
+    只有从未见过的文本块才会请求底层模型，查询向量不经过该缓存。
+    """
+
+    def __init__(self, underlying: Embeddings, model: str):
+        self.underlying = underlying
+        self.model = model
+        self.cache = EmbeddingCache()
+
+    @staticmethod
+    def _to_float32(text_hashes, vectors) -> dict:
+        # 与缓存中读出的精度保持一致，命中与未命中返回相同的向量
+        return {
+            text_hash: np.asarray(vector, dtype=np.float32).tolist()
+            for text_hash, vector in zip(text_hashes, vectors)
+        }
+
+    def _lookup(self, texts: List[str]):
+        text_hashes = [EmbeddingCache.hash_text(text) for text in texts]
+        found = self.cache.get_many(self.model, text_hashes)
+        # 同一批次中重复的文本只请求一次
+        missing = {}
+        for text, text_hash in zip(texts, text_hashes):
+            if text_hash not in found and text_hash not in missing:
+                missing[text_hash] = text
+        return text_hashes, found, missing
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        text_hashes, found, missing = self._lookup(texts)
+        if missing:
+            vectors = self.underlying.embed_documents(list(missing.values()))
+            new_items = self._to_float32(missing.keys(), vectors)
+            self.cache.put_many(self.model, new_items)
+            found.update(new_items)
+        return [found[text_hash] for text_hash in text_hashes]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        text_hashes, found, missing = await asyncio.to_thread(self._lookup, texts)
+        if missing:
+            vectors = await self.underlying.aembed_documents(list(missing.values()))
+            new_items = self._to_float32(missing.keys(), vectors)
+            await asyncio.to_thread(self.cache.put_many, self.model, new_items)
+            found.update(new_items)
+        return [found[text_hash] for text_hash in text_hashes]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.underlying.embed_query(text)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await self.underlying.aembed_query(text)
@@ -4,7 +4,14 @@ import json
 
 
 class StreamingHandler(BaseCallbackHandler):
-    """处理流式输出的回调处理器"""
+    """处理流式输出的回调处理器
+
+    token 按生成顺序放入队列，问答链任务结束时放入结束标记 DONE，读取方
+    只需等待队列，无需轮询任务状态。
+    """
+
+    # 队列中的结束标记
+    DONE = object()
 
     def __init__(self):
         self.queue = asyncio.Queue()
@@ -12,7 +19,15 @@ class StreamingHandler(BaseCallbackHandler):
 
     async def on_llm_new_token(self, token: str, **kwargs) -> None:
         """处理流式输出的每个token"""
-        await self.queue.put(token)
+        self.queue.put_nowait(token)
+
+    def finish(self, task: asyncio.Task = None) -> None:
+        """问答链任务结束(完成、出错或取消)时放入结束标记，可直接作为 done callback"""
+        self.queue.put_nowait(self.DONE)
+
+    def create_error_event(self, message: str):
+        """创建错误事件"""
+        return f"data: {json.dumps({'error': message}, ensure_ascii=False)}\n\n"
 
     def create_sse_event(self, token, is_source=False):
         """创建 SSE 事件"""
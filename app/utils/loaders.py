@@ -0,0 +1,639 @@
+import csv
+import io
+import os
+import re
+import zipfile
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from html.parser import HTMLParser
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from xml.etree import ElementTree
+
+import fitz
+from langchain_core.documents import Document
+
+from app.utils.chunker import (
+    HEADING,
+    PARAGRAPH,
+    TABLE,
+    ChunkOptions,
+    Chunker,
+    TextBlock,
+)
+from app.utils.pdf_parser import extract_blocks
+
+# 检测文本编码时读取的字节数
+_SNIFF_BYTES = 64 * 1024
+# 没有空行的长文本每隔该行数截断为一个段落，避免单个段落占用过多内存
+_MAX_PARAGRAPH_LINES = 200
+_MARKDOWN_HEADING = re.compile(r"^\s{0,3}(#{1,6})\s+(.*?)\s*#*\s*$")
+_WORD_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+
+@dataclass
+class ParsedBatch:
+    """一次解析调用的结果
+
+    大文件分批解析时 cursor 为下一批的起始位置，解析完毕时为 None。
+    """
+
+    documents: List[Document] = field(default_factory=list)
+    # 是否已切分为文本块，否则为按页/行等划分的原始文档
+    chunked: bool = False
+    # 本批解析的页数/行数等
+    units: int = 0
+    cursor: Any = None
+
+
+class Loader(ABC):
+    """文档加载器基类
+
+    子类按格式实现 open 和 iter_units：open 打开文件得到句柄，iter_units 从
+    cursor 处开始逐个产出 (该单元的文本块, 下一个单元的 cursor)，单元是页、
+    行或段落，cursor 可序列化，用于大文件分批解析时在下一次调用中继续。
+    """
+
+    name = ""
+    extensions: Tuple[str, ...] = ()
+    mime_types: Tuple[str, ...] = ()
+    # 元数据 page 的含义：page/row/line/paragraph
+    unit = "page"
+
+    def sniff(self, head: bytes) -> bool:
+        """根据文件开头的字节判断是否为该格式"""
+        return False
+
+    @contextmanager
+    def open(self, data: Optional[bytes], file_path: Optional[str]):
+        with _open_binary(data, file_path) as stream:
+            yield stream
+
+    def metadata(self, handle) -> dict:
+        return {}
+
+    @abstractmethod
+    def iter_units(
+        self, handle, cursor, options: ChunkOptions
+    ) -> Iterator[Tuple[List[TextBlock], Any]]:
+        """从 cursor 处开始逐个产出 (文本块, 下一个单元的 cursor)"""
+
+
+_LOADERS: Dict[str, Loader] = {}
+
+
+def register(loader: Loader) -> Loader:
+    """注册加载器，同名加载器会被替换"""
+    _LOADERS[loader.name] = loader
+    return loader
+
+
+def get_loader(name: str) -> Loader:
+    return _LOADERS[name]
+
+
+def resolve(
+    file_name: str, content_type: Optional[str] = None, head: Optional[bytes] = None
+) -> Optional[Loader]:
+    """按扩展名、MIME 类型、文件开头的字节依次查找加载器，都不匹配时返回 None"""
+    extension = os.path.splitext(file_name)[1].lower()
+    for loader in _LOADERS.values():
+        if extension in loader.extensions:
+            return loader
+    if content_type:
+        mime = content_type.split(";")[0].strip().lower()
+        for loader in _LOADERS.values():
+            if mime in loader.mime_types:
+                return loader
+    if head:
+        for loader in _LOADERS.values():
+            if loader.sniff(head):
+                return loader
+    return None
+
+
+def parse_file(
+    loader_name: str,
+    file_name: str,
+    data: Optional[bytes] = None,
+    file_path: Optional[str] = None,
+    options: ChunkOptions = None,
+    chunk: bool = True,
+    cursor: Any = None,
+    max_chars: int = 0,
+) -> ParsedBatch:
+    """在解析进程池中解析文件，返回一批文档
+
+    Args:
+        loader_name: 加载器名称
+        file_name: MinIO 中的对象名称，写入文档的 source 元数据
+        data: 文件内容
+        file_path: 落盘的临时文件路径，与 data 二选一
+        options: 切分参数
+        chunk: 是否在解析进程中直接切分为文本块
+        cursor: 上一批返回的位置，从文件开头解析时为 None
+        max_chars: 单批解析的最大字符数，超过后在单元边界处返回，0 表示不限制
+    """
+    loader = get_loader(loader_name)
+    options = options or ChunkOptions()
+    with loader.open(data, file_path) as handle:
+        metadata = {
+            **loader.metadata(handle),
+            "source": file_name,
+            "file_path": file_name,
+            "unit": loader.unit,
+        }
+        parsed: List[List[TextBlock]] = []
+        chars = 0
+        next_cursor = None
+        for unit_blocks, position in loader.iter_units(handle, cursor, options):
+            if unit_blocks:
+                parsed.append(unit_blocks)
+                chars += sum(len(block.text) for block in unit_blocks)
+            # position 为 None 表示此处无法继续解析，不能在此分批
+            if max_chars and chars >= max_chars and position is not None:
+                next_cursor = position
+                break
+
+    if chunk:
+        documents = Chunker(options).split_blocks(
+            (block for unit_blocks in parsed for block in unit_blocks), metadata
+        )
+    else:
+        # 不切分时每个单元 (页、行、段落) 为一个文档，由调用方切分
+        documents = [
+            Document(
+                page_content="\n".join(block.text for block in unit_blocks),
+                metadata={**metadata, "page": unit_blocks[0].page},
+            )
+            for unit_blocks in parsed
+        ]
+    return ParsedBatch(documents, chunk, len(parsed), next_cursor)
+
+
+@contextmanager
+def _open_binary(data: Optional[bytes], file_path: Optional[str]):
+    if data is not None:
+        yield io.BytesIO(data)
+    else:
+        with open(file_path, "rb") as f:
+            yield f
+
+
+def _detect_encoding(stream) -> str:
+    """检测文本编码，UTF-8、GB18030 都无法解码时用 charset_normalizer 检测"""
+    position = stream.tell()
+    head = stream.read(_SNIFF_BYTES)
+    stream.seek(position)
+    if head.startswith(b"\xef\xbb\xbf"):
+        return "utf-8-sig"
+    # 中文文档常见的编码优先尝试，截断在多字节字符中间时仍视为该编码
+    for encoding in ("utf-8", "gb18030"):
+        try:
+            head.decode(encoding)
+            return encoding
+        except UnicodeDecodeError as e:
+            if e.start >= len(head) - 3:
+                return encoding
+    try:
+        from charset_normalizer import from_bytes
+
+        match = from_bytes(head).best()
+        if match is not None:
+            return match.encoding
+    except ImportError:
+        pass
+    return "utf-8"
+
+
+def _looks_like_text(head: bytes) -> bool:
+    if not head or b"\x00" in head[:1024]:
+        return False
+    try:
+        head[:1024].decode("utf-8")
+        return True
+    except UnicodeDecodeError as e:
+        return e.start >= 1020
+
+
+@contextmanager
+def _open_text(data: Optional[bytes], file_path: Optional[str], newline=None):
+    with _open_binary(data, file_path) as stream:
+        encoding = _detect_encoding(stream)
+        text = io.TextIOWrapper(
+            stream, encoding=encoding, errors="replace", newline=newline
+        )
+        try:
+            yield text
+        finally:
+            text.detach()
+
+
+def _markdown_row(cells: List[str]) -> str:
+    return "| " + " | ".join(cell.replace("\n", " ").strip() for cell in cells) + " |"
+
+
+def _markdown_table(rows: List[List[str]]) -> str:
+    rows = [row for row in rows if any(cell.strip() for cell in row)]
+    if not rows:
+        return ""
+    width = max(len(row) for row in rows)
+    rows = [row + [""] * (width - len(row)) for row in rows]
+    lines = [_markdown_row(rows[0]), _markdown_row(["---"] * width)]
+    lines.extend(_markdown_row(row) for row in rows[1:])
+    return "\n".join(lines)
+
+
+class PdfLoader(Loader):
+    """PDF：每页为一个单元，按版面提取标题、段落和表格"""
+
+    name = "pdf"
+    extensions = (".pdf",)
+    mime_types = ("application/pdf",)
+    unit = "page"
+
+    def sniff(self, head: bytes) -> bool:
+        return head.startswith(b"%PDF")
+
+    @contextmanager
+    def open(self, data, file_path):
+        if data is not None:
+            doc = fitz.open(stream=data, filetype="pdf")
+        else:
+            doc = fitz.open(file_path, filetype="pdf")
+        with doc:
+            yield doc
+
+    def metadata(self, handle) -> dict:
+        metadata = {
+            key: value
+            for key, value in (handle.metadata or {}).items()
+            if isinstance(value, (str, int))
+        }
+        metadata["total_pages"] = handle.page_count
+        return metadata
+
+    def iter_units(self, handle, cursor, options):
+        for number in range(cursor or 0, handle.page_count):
+            page = handle[number]
+            yield extract_blocks(page, options.detect_tables), number + 1
+
+
+class TextLoader(Loader):
+    """纯文本：逐行读取，按空行划分段落，page 为段落起始行号"""
+
+    name = "text"
+    extensions = (".txt", ".text", ".log")
+    mime_types = ("text/plain",)
+    unit = "line"
+
+    def sniff(self, head: bytes) -> bool:
+        return _looks_like_text(head)
+
+    @contextmanager
+    def open(self, data, file_path):
+        with _open_text(data, file_path) as text:
+            yield text
+
+    def iter_units(self, handle, cursor, options):
+        line_number = 0
+        if cursor is not None:
+            position, line_number = cursor
+            handle.seek(position)
+        lines: List[str] = []
+        start = line_number
+        # 不能用 for 迭代文件，否则 tell() 不可用
+        while True:
+            line = handle.readline()
+            if not line:
+                break
+            line_number += 1
+            block = self._line_block(line, line_number - 1)
+            if block is None and line.strip():
+                if not lines:
+                    start = line_number - 1
+                lines.append(line)
+                if len(lines) < _MAX_PARAGRAPH_LINES:
+                    continue
+            # 空行、标题行或段落达到最大行数时结束当前段落
+            blocks = self._paragraph(lines, start)
+            lines = []
+            if block is not None:
+                blocks.append(block)
+            if blocks:
+                yield blocks, (handle.tell(), line_number)
+        blocks = self._paragraph(lines, start)
+        if blocks:
+            yield blocks, None
+
+    def _line_block(self, line: str, line_number: int) -> Optional[TextBlock]:
+        """单独成块的行 (如 Markdown 标题)，普通行返回 None"""
+        return None
+
+    def _paragraph(self, lines: List[str], start: int) -> List[TextBlock]:
+        text = "".join(lines).strip()
+        return [TextBlock(text, PARAGRAPH, start)] if text else []
+
+
+class MarkdownLoader(TextLoader):
+    """Markdown：# 开头的行为标题，由 | 开头的行组成的段落为表格"""
+
+    name = "markdown"
+    extensions = (".md", ".markdown")
+    mime_types = ("text/markdown", "text/x-markdown")
+
+    def sniff(self, head: bytes) -> bool:
+        return False
+
+    def _line_block(self, line: str, line_number: int) -> Optional[TextBlock]:
+        match = _MARKDOWN_HEADING.match(line)
+        if match and match.group(2):
+            return TextBlock(match.group(2), HEADING, line_number)
+        return None
+
+    def _paragraph(self, lines: List[str], start: int) -> List[TextBlock]:
+        blocks = super()._paragraph(lines, start)
+        if blocks and all(line.lstrip().startswith("|") for line in lines if line.strip()):
+            blocks[0].kind = TABLE
+        return blocks
+
+
+class CsvLoader(Loader):
+    """CSV：每行为一个单元，按 "列名: 值" 逐列展开，page 为数据行号"""
+
+    name = "csv"
+    extensions = (".csv", ".tsv")
+    mime_types = ("text/csv", "text/tab-separated-values", "application/csv")
+    unit = "row"
+
+    @contextmanager
+    def open(self, data, file_path):
+        with _open_text(data, file_path, newline="") as text:
+            yield text
+
+    def iter_units(self, handle, cursor, options):
+        if cursor is None:
+            head = handle.read(_SNIFF_BYTES)
+            handle.seek(0)
+            try:
+                dialect = csv.Sniffer().sniff(head, delimiters=",\t;|")
+                delimiter = dialect.delimiter
+            except csv.Error:
+                delimiter = ","
+            row_number = 0
+            header = None
+        else:
+            position, row_number, header, delimiter = cursor
+            handle.seek(position)
+
+        # csv.reader 按需调用 readline，每行读完后 tell() 即为下一行的位置
+        reader = csv.reader(iter(handle.readline, ""), delimiter=delimiter)
+        for row in reader:
+            if header is None:
+                header = [column.strip() for column in row]
+                continue
+            if not any(cell.strip() for cell in row):
+                continue
+            text = "\n".join(
+                f"{self._column(header, i)}: {cell.strip()}"
+                for i, cell in enumerate(row)
+                if cell.strip()
+            )
+            yield (
+                [TextBlock(text, PARAGRAPH, row_number)],
+                (handle.tell(), row_number + 1, header, delimiter),
+            )
+            row_number += 1
+
+    @staticmethod
+    def _column(header: List[str], index: int) -> str:
+        if index < len(header) and header[index]:
+            return header[index]
+        return f"列{index + 1}"
+
+
+class DocxLoader(Loader):
+    """Word (.docx)：流式解析 document.xml，每个段落/表格为一个单元
+
+    标题按段落样式 (Heading/Title/标题) 识别，表格转为 Markdown。只依赖
+    标准库，无需安装 python-docx。iterparse 无法从中间位置继续，DOCX 不分批，
+    整个文件在一次调用中解析完，已处理的元素随即释放。
+    """
+
+    name = "docx"
+    extensions = (".docx",)
+    mime_types = (
+        "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    )
+    unit = "paragraph"
+
+    def sniff(self, head: bytes) -> bool:
+        return head.startswith(b"PK\x03\x04") and b"word/" in head
+
+    @contextmanager
+    def open(self, data, file_path):
+        with _open_binary(data, file_path) as stream:
+            with zipfile.ZipFile(stream) as archive:
+                yield archive
+
+    def iter_units(self, handle, cursor, options):
+        headings = self._heading_styles(handle)
+        index = depth = 0
+        with handle.open("word/document.xml") as xml:
+            for event, element in ElementTree.iterparse(xml, events=("start", "end")):
+                if event == "start":
+                    depth += 1
+                    continue
+                depth -= 1
+                # 只处理 body 的直接子元素 (document > body > p/tbl)
+                if depth != 2:
+                    continue
+                block = self._block(element, headings, index)
+                index += 1
+                element.clear()
+                # cursor 为 None：不在此处分批
+                yield ([block] if block is not None else []), None
+
+    def _block(self, element, headings: set, index: int) -> Optional[TextBlock]:
+        if element.tag == f"{_WORD_NS}p":
+            text = self._text(element)
+            if not text:
+                return None
+            style = element.find(f"{_WORD_NS}pPr/{_WORD_NS}pStyle")
+            style_id = style.get(f"{_WORD_NS}val") if style is not None else None
+            kind = HEADING if style_id in headings else PARAGRAPH
+            return TextBlock(text, kind, index)
+        if element.tag == f"{_WORD_NS}tbl":
+            rows = [
+                [self._text(cell) for cell in row.iter(f"{_WORD_NS}tc")]
+                for row in element.iter(f"{_WORD_NS}tr")
+            ]
+            table = _markdown_table(rows)
+            return TextBlock(table, TABLE, index) if table else None
+        return None
+
+    @staticmethod
+    def _text(element) -> str:
+        parts = []
+        for node in element.iter():
+            if node.tag == f"{_WORD_NS}t" and node.text:
+                parts.append(node.text)
+            elif node.tag == f"{_WORD_NS}tab":
+                parts.append("\t")
+            elif node.tag in (f"{_WORD_NS}br", f"{_WORD_NS}p") and parts:
+                parts.append("\n")
+        return "".join(parts).strip()
+
+    @staticmethod
+    def _heading_styles(archive: zipfile.ZipFile) -> set:
+        """标题样式的 ID，中文版 Word 的样式 ID 可能是数字，需要按样式名判断"""
+        headings = set()
+        try:
+            with archive.open("word/styles.xml") as xml:
+                root = ElementTree.parse(xml).getroot()
+        except KeyError:
+            return headings
+        for style in root.iter(f"{_WORD_NS}style"):
+            name = style.find(f"{_WORD_NS}name")
+            label = (name.get(f"{_WORD_NS}val") if name is not None else "") or ""
+            label = label.lower()
+            if label.startswith(("heading", "title", "标题")):
+                headings.add(style.get(f"{_WORD_NS}styleId"))
+        return headings
+
+
+class _HtmlBlockParser(HTMLParser):
+    """把 HTML 转为文本块，忽略脚本、样式等不可见内容"""
+
+    HEADINGS = {"h1", "h2", "h3", "h4", "h5", "h6"}
+    BLOCKS = {
+        "p",
+        "div",
+        "li",
+        "section",
+        "article",
+        "blockquote",
+        "pre",
+        "dd",
+        "dt",
+        "header",
+        "footer",
+        "main",
+        "aside",
+        "nav",
+        "br",
+        "tr",
+    }
+    IGNORED = {"script", "style", "noscript", "template", "head", "svg"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.blocks: List[TextBlock] = []
+        self.count = 0
+        self._text: List[str] = []
+        self._ignored = 0
+        self._heading = False
+        self._rows: Optional[List[List[str]]] = None
+        self._cells: Optional[List[str]] = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.IGNORED:
+            self._ignored += 1
+        elif tag == "table" and self._rows is None:
+            self._flush()
+            self._rows = []
+        elif tag == "tr" and self._rows is not None:
+            self._cells = []
+        elif tag in ("td", "th") and self._cells is not None:
+            self._text = []
+        elif tag in self.HEADINGS or tag in self.BLOCKS:
+            self._flush()
+            self._heading = tag in self.HEADINGS
+
+    def handle_endtag(self, tag):
+        if tag in self.IGNORED:
+            self._ignored = max(0, self._ignored - 1)
+        elif tag in ("td", "th") and self._cells is not None:
+            self._cells.append(" ".join("".join(self._text).split()))
+            self._text = []
+        elif tag == "tr" and self._rows is not None and self._cells is not None:
+            self._rows.append(self._cells)
+            self._cells = None
+        elif tag == "table" and self._rows is not None:
+            table = _markdown_table(self._rows)
+            self._rows = None
+            if table:
+                self._emit(table, TABLE)
+        elif tag in self.HEADINGS or tag in self.BLOCKS:
+            self._flush()
+
+    def handle_data(self, data):
+        if not self._ignored:
+            self._text.append(data)
+
+    def close(self):
+        super().close()
+        self._flush()
+
+    def _flush(self):
+        if self._rows is not None:
+            return
+        text = " ".join("".join(self._text).split())
+        self._text = []
+        if text:
+            self._emit(text, HEADING if self._heading else PARAGRAPH)
+        self._heading = False
+
+    def _emit(self, text: str, kind: str):
+        self.blocks.append(TextBlock(text, kind, self.count))
+        self.count += 1
+
+
+class HtmlLoader(Loader):
+    """HTML：分段读入解析，每个标题/段落/表格为一个单元
+
+    解析器状态无法跨进程保存，HTML 不分批，整个文件在一次调用中解析完；
+    原始文件仍分段读入，内存占用为提取出的文本大小。
+    """
+
+    name = "html"
+    extensions = (".html", ".htm", ".xhtml")
+    mime_types = ("text/html", "application/xhtml+xml")
+    unit = "paragraph"
+    READ_SIZE = 64 * 1024
+
+    def sniff(self, head: bytes) -> bool:
+        start = head[:1024].lstrip().lower()
+        return start.startswith((b"<!doctype html", b"<html")) or b"<html" in start
+
+    @contextmanager
+    def open(self, data, file_path):
+        with _open_text(data, file_path) as text:
+            yield text
+
+    def iter_units(self, handle, cursor, options):
+        parser = _HtmlBlockParser()
+        while True:
+            text = handle.read(self.READ_SIZE)
+            if text:
+                parser.feed(text)
+            else:
+                parser.close()
+            blocks, parser.blocks = parser.blocks, []
+            # cursor 为 None：不在此处分批
+            for block in blocks:
+                yield [block], None
+            if not text:
+                break
+
+
+# 按顺序匹配，纯文本放在最后
+for _loader in (
+    PdfLoader(),
+    CsvLoader(),
+    DocxLoader(),
+    MarkdownLoader(),
+    HtmlLoader(),
+    TextLoader(),
+):
+    register(_loader)
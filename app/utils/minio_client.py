@@ -2,8 +2,10 @@ from minio import Minio
 from minio.error import S3Error
 from app.config.index import settings
 from app.logging.logging import logger
+import hashlib
 import os
-from typing import List
+import tempfile
+from typing import List, Optional, Tuple
 
 
 class MinioClient:
@@ -68,12 +70,15 @@ class MinioClient:
             logger.error(f"Error listing files from MinIO: {e}")
             raise
 
-    async def upload_file_bytes(self, file_bytes: bytes, object_name: str) -> str:
+    async def upload_file_bytes(
+        self, file_bytes: bytes, object_name: str, content_type: str = None
+    ) -> str:
         """上传文件字节流到MinIO
 
         Args:
             file_bytes: 文件字节流
             object_name: MinIO中的对象名称
+            content_type: 文件的 MIME 类型，解析时用于识别没有扩展名的文件
 
         Returns:
             str: 文件的访问URL
@@ -89,6 +94,7 @@ class MinioClient:
                 object_name=object_name,
                 data=file_stream,
                 length=len(file_bytes),
+                content_type=content_type or "application/octet-stream",
             )
 
             # 生成文件URL
@@ -116,3 +122,78 @@ class MinioClient:
         except S3Error as e:
             logger.error(f"Error downloading file from MinIO: {e}")
             raise
+
+    def sniff_object(self, object_name: str, length: int) -> Tuple[Optional[str], bytes]:
+        """读取对象的 MIME 类型和开头的字节，用于下载前判断文件格式
+
+        该方法是阻塞调用，应在线程池中执行。
+
+        Returns:
+            tuple: (MIME 类型, 开头至多 length 个字节)
+        """
+        stat = self.client.stat_object(settings.MINIO_BUCKET_NAME, object_name)
+        if not stat.size:
+            return stat.content_type, b""
+        response = None
+        try:
+            response = self.client.get_object(
+                settings.MINIO_BUCKET_NAME,
+                object_name,
+                offset=0,
+                length=min(length, stat.size),
+            )
+            return stat.content_type, response.read()
+        finally:
+            if response is not None:
+                response.close()
+                response.release_conn()
+
+    def read_object(
+        self, object_name: str, spill_threshold: int
+    ) -> Tuple[Optional[bytes], Optional[str], str]:
+        """流式读取对象内容，不经过固定的本地目录
+
+        内容不超过 spill_threshold 时保存在内存中；超过后转存到唯一命名的
+        临时文件，由调用方在使用后删除。该方法是阻塞调用，应在线程池中执行。
+
+        Args:
+            object_name: MinIO中的对象名称
+            spill_threshold: 内存缓冲的最大字节数
+
+        Returns:
+            tuple: (文件内容, 临时文件路径, 内容 sha256)，前两者只有一个不为 None
+        """
+        response = None
+        buffer = bytearray()
+        spill_file = None
+        digest = hashlib.sha256()
+        try:
+            response = self.client.get_object(settings.MINIO_BUCKET_NAME, object_name)
+            for chunk in response.stream(256 * 1024):
+                digest.update(chunk)
+                if spill_file is None and len(buffer) + len(chunk) > spill_threshold:
+                    suffix = os.path.splitext(object_name)[1]
+                    spill_file = tempfile.NamedTemporaryFile(
+                        prefix="minio-", suffix=suffix, delete=False
+                    )
+                    spill_file.write(buffer)
+                    buffer = None
+                if spill_file is not None:
+                    spill_file.write(chunk)
+                else:
+                    buffer.extend(chunk)
+        except Exception as e:
+            logger.error(f"Error reading file from MinIO: {e}")
+            if spill_file is not None:
+                spill_file.close()
+                os.unlink(spill_file.name)
+            raise
+        finally:
+            if response is not None:
+                response.close()
+                response.release_conn()
+
+        if spill_file is not None:
+            spill_file.close()
+            return None, spill_file.name, digest.hexdigest()
+        return buffer, None, digest.hexdigest()
@@ -1,10 +1,13 @@
-from sqlalchemy.orm import Session
+from sqlalchemy import func, insert, select
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.db.models.chat import ChatHistory, sessions, Quote
+from datetime import datetime
 from typing import List, Dict
 
 
 class MySQLClient:
-    def __init__(self, db: Session):
+    def __init__(self, db: AsyncSession):
         self.db = db
 
     async def get_chat_history(self, session_id: str = None, user_id: str = None):
@@ -15,21 +18,23 @@ class MySQLClient:
             user_id: 用户ID
         """
         query = (
-            self.db.query(ChatHistory, sessions, Quote)
+            select(ChatHistory, sessions, Quote)
             .join(sessions, ChatHistory.session_id == sessions.session_id)
             .join(
                 Quote,
                 ChatHistory.id == Quote.chat_history_id,
                 isouter=True,  # 使用左连接，因为可能没有引用
             )
+            # 按记录排序，保证同一条聊天记录的引用相邻
+            .order_by(ChatHistory.id, Quote.id)
         )
 
         if session_id:
-            query = query.filter(ChatHistory.session_id == session_id)
+            query = query.where(ChatHistory.session_id == session_id)
         if user_id:
-            query = query.filter(sessions.user_id == user_id)
+            query = query.where(sessions.user_id == user_id)
 
-        results = query.all()
+        results = (await self.db.execute(query)).all()
 
         # 将查询结果转换为字典列表
         history = []
@@ -59,66 +64,213 @@ class MySQLClient:
 
         return history
 
+    async def get_recent_turns(
+        self, session_id: str, user_id: str, limit: int
+    ) -> List[Dict]:
+        """按时间倒序取会话最近的问答轮次，只查询问题和答案，不关联引用
+
+        Args:
+            session_id: 会话ID
+            user_id: 用户ID
+            limit: 最多返回的轮次数
+
+        Returns:
+            List[Dict]: 按时间正序排列的 id、question、answer
+        """
+        query = (
+            self._turns_query(session_id, user_id)
+            .order_by(ChatHistory.id.desc())
+            .limit(limit)
+        )
+        results = (await self.db.execute(query)).all()
+        return [row._asdict() for row in reversed(results)]
+
+    async def get_turns_between(
+        self,
+        session_id: str,
+        user_id: str,
+        limit: int,
+        after_id: int = None,
+        before_id: int = None,
+    ) -> List[Dict]:
+        """按时间正序取 ID 在 (after_id, before_id) 之间最早的问答轮次
+
+        Args:
+            session_id: 会话ID
+            user_id: 用户ID
+            limit: 最多返回的轮次数
+            after_id: 只返回ID大于该值的记录，为空时从第一轮开始
+            before_id: 只返回ID小于该值的记录，为空时不限制
+
+        Returns:
+            List[Dict]: 按时间正序排列的 id、question、answer
+        """
+        query = self._turns_query(session_id, user_id)
+        if after_id is not None:
+            query = query.where(ChatHistory.id > after_id)
+        if before_id is not None:
+            query = query.where(ChatHistory.id < before_id)
+        query = query.order_by(ChatHistory.id.asc()).limit(limit)
+
+        results = (await self.db.execute(query)).all()
+        return [row._asdict() for row in results]
+
+    @staticmethod
+    def _turns_query(session_id: str, user_id: str):
+        query = (
+            select(ChatHistory.id, ChatHistory.question, ChatHistory.answer)
+            .join(sessions, ChatHistory.session_id == sessions.session_id)
+            .where(ChatHistory.session_id == session_id)
+        )
+        if user_id:
+            query = query.where(sessions.user_id == user_id)
+        return query
+
     async def save_chat_history(
         self, session_id: str, question: str, answer: str, user_id: str, sources: list
     ):
-        """保存会话记录"""
+        """保存会话记录
+
+        会话 upsert、对话记录插入和引用批量插入在同一个事务中完成，只提交一次。
+        """
+        return await self.save_chat_histories(
+            [
+                {
+                    "session_id": session_id,
+                    "question": question,
+                    "answer": answer,
+                    "user_id": user_id,
+                    "sources": sources,
+                }
+            ]
+        )
+
+    async def save_chat_histories(self, records: List[Dict]):
+        """在一个事务中批量保存多条会话记录
+
+        无论记录条数，都只需会话 upsert、对话记录多行插入、引用批量插入和
+        提交四次往返。会话ID已被其他用户使用时整批回滚并抛出 PermissionError，
+        批量写入器会改为逐条保存，只丢弃不匹配的记录。
+
+        Args:
+            records: 会话记录列表，每条包含 session_id、question、answer、
+                user_id 和 sources
+
+        Returns:
+            List[Dict]: 已保存的记录，格式与 get_chat_history 一致
+        """
+        if not records:
+            return []
         try:
-            # 检查会话是否存在
-            if not await self.exists(session_id, user_id):
-                # 创建会话，使用问题的前20个字符作为标题
-                title = question[:20] + "..." if len(question) > 20 else question
-                session = sessions(
-                    session_id=session_id,
-                    user_id=user_id,
-                    title=title,
-                    is_deleted=False,
+            # 会话不存在时创建，使用问题的前20个字符作为标题
+            session_rows = {}
+            for record in records:
+                question = record["question"]
+                session_rows.setdefault(
+                    record["session_id"],
+                    {
+                        "session_id": record["session_id"],
+                        "user_id": record["user_id"],
+                        "title": question[:20] + "..." if len(question) > 20 else question,
+                        "is_deleted": False,
+                    },
+                )
+            # 已存在的会话只"更新"为相同的 user_id：属于同一用户时行未变化，
+            # 影响行数按 1 计 (SQLAlchemy 的 MySQL 驱动总是开启 FOUND_ROWS)；
+            # 属于其他用户时行被修改，按 2 计。影响行数多于会话数即说明有会话
+            # 不属于该用户，整个事务回滚，修改不会生效
+            statement = mysql_insert(sessions).values(list(session_rows.values()))
+            result = await self.db.execute(
+                statement.on_duplicate_key_update(user_id=statement.inserted.user_id)
+            )
+            if result.rowcount != len(session_rows):
+                raise PermissionError(
+                    f"会话 {', '.join(session_rows)} 中有会话不属于当前用户"
+                )
+
+            # 对话记录用一条多行 INSERT 写入。MySQL 不支持 RETURNING，多行
+            # INSERT ... VALUES 属于 InnoDB 的 simple insert，同一条语句分配的
+            # 自增ID连续，由第一条记录的ID推算其余记录的ID
+            created_at = datetime.utcnow()
+            result = await self.db.execute(
+                insert(ChatHistory).values(
+                    [
+                        {
+                            "session_id": record["session_id"],
+                            "question": record["question"],
+                            "answer": record["answer"],
+                            "created_at": created_at,
+                        }
+                        for record in records
+                    ]
+                )
+            )
+            first_id = result.lastrowid
+
+            saved = []
+            quote_rows = []
+            for offset, record in enumerate(records):
+                chat_id = first_id + offset
+                # 合并了近似重复文本块的引用按每个出处各保存一条
+                quotes = [
+                    {
+                        "content": source["page_content"],
+                        "page_number": item["page"],
+                        "source": item["source"],
+                    }
+                    for source in record["sources"]
+                    for item in source.get("origins") or [source]
+                ]
+                quote_rows.extend(
+                    {"chat_history_id": chat_id, **quote} for quote in quotes
                 )
-                self.db.add(session)
-                self.db.commit()
-
-            # 先创建会话记录
-            chat = ChatHistory(session_id=session_id, question=question, answer=answer)
-            self.db.add(chat)
-            self.db.commit()
-            self.db.refresh(chat)  # 刷新以获取新插入记录的ID
-
-            # 再保存引用
-            for source in sources:
-                quote = Quote(
-                    chat_history_id=chat.id,  # 使用刚创建的chat_history的ID
-                    content=source["page_content"],
-                    page_number=source["page"],
-                    source=source["source"],
+                saved.append(
+                    {
+                        "id": chat_id,
+                        "question": record["question"],
+                        "answer": record["answer"],
+                        "session_id": record["session_id"],
+                        "created_at": created_at.isoformat(),
+                        "quotes": quotes,
+                    }
                 )
-                self.db.add(quote)
 
-            self.db.commit()
+            # 引用使用 executemany 一次性写入
+            if quote_rows:
+                await self.db.execute(insert(Quote), quote_rows)
+
+            await self.db.commit()
+            return saved
         except Exception as e:
-            self.db.rollback()
+            await self.db.rollback()
             raise e
 
     async def exists(self, session_id: str, user_id: str) -> bool:
         """检查会话是否存在"""
-        count = (
-            self.db.query(sessions)
-            .filter(sessions.session_id == session_id, sessions.user_id == user_id)
-            .count()
+        count = await self.db.scalar(
+            select(func.count())
+            .select_from(sessions)
+            .where(sessions.session_id == session_id, sessions.user_id == user_id)
         )
         return count > 0
 
     async def get_session(self, user_id: str):
         """获取会话列表"""
         results = (
-            self.db.query(
-                sessions.session_id.label("session_id"),
-                sessions.user_id.label("user_id"),
-                sessions.title.label("title"),
-                sessions.created_at.label("created_at"),
+            await self.db.execute(
+                select(
+                    sessions.session_id.label("session_id"),
+                    sessions.user_id.label("user_id"),
+                    sessions.title.label("title"),
+                    sessions.created_at.label("created_at"),
+                )
+                .where(sessions.user_id == user_id, sessions.is_deleted == False)
+                .order_by(sessions.created_at.desc())
             )
-            .filter(sessions.user_id == user_id, sessions.is_deleted == False)
-            .order_by(sessions.created_at.desc())
-            .all()
-        )
+        ).all()
 
-        return [row._asdict() for row in results]
+        # 与 get_chat_history 一致返回 ISO 格式的时间，缓存命中与否返回相同的类型
+        return [
+            {**row._asdict(), "created_at": row.created_at.isoformat()}
+            for row in results
+        ]
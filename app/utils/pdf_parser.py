@@ -0,0 +1,97 @@
+from collections import Counter
+from typing import List
+
+import fitz
+
+from app.utils.chunker import (
+    HEADING,
+    PARAGRAPH,
+    TABLE,
+    TextBlock,
+    join_lines,
+)
+
+# 字号不小于正文字号该倍数的短文本块视为标题
+HEADING_FONT_RATIO = 1.2
+HEADING_MAX_CHARS = 60
+# 整块加粗且不超过该长度的文本块视为标题
+BOLD_HEADING_MAX_CHARS = 40
+_BOLD_FLAG = 16
+
+
+def extract_blocks(page: "fitz.Page", detect_tables: bool = True) -> List[TextBlock]:
+    """按阅读顺序提取页面中的标题、段落和表格
+
+    正文字号取页面中字符数最多的字号，明显大于正文或整块加粗的短文本块
+    视为标题；表格区域内的文本不再作为段落，整张表格以 Markdown 形式
+    放在其所在位置。
+    """
+    tables = []
+    if detect_tables:
+        try:
+            tables = [
+                (fitz.Rect(table.bbox), table.to_markdown(clean=False).strip())
+                for table in page.find_tables().tables
+            ]
+        except Exception:
+            # 表格识别失败时按普通文本处理
+            tables = []
+
+    lines = []
+    for block in page.get_text("dict", sort=True)["blocks"]:
+        if block.get("type") != 0:
+            continue
+        bbox = fitz.Rect(block["bbox"])
+        if any(_inside(bbox, rect) for rect, _ in tables):
+            continue
+        spans = [
+            span
+            for line in block["lines"]
+            for span in line["spans"]
+            if span["text"].strip()
+        ]
+        if not spans:
+            continue
+        text = join_lines(
+            "".join(span["text"] for span in line["spans"]) for line in block["lines"]
+        )
+        lines.append((bbox.y0, text, spans))
+
+    sizes = Counter()
+    for _, _, spans in lines:
+        for span in spans:
+            sizes[round(span["size"], 1)] += len(span["text"].strip())
+    body_size = sizes.most_common(1)[0][0] if sizes else 0
+
+    items = [
+        (y, TextBlock(text, _block_kind(text, spans, body_size), page.number))
+        for y, text, spans in lines
+    ]
+    items.extend(
+        (rect.y0, TextBlock(markdown, TABLE, page.number))
+        for rect, markdown in tables
+        if markdown
+    )
+    items.sort(key=lambda item: item[0])
+    return [block for _, block in items]
+
+
+def _block_kind(text: str, spans: list, body_size: float) -> str:
+    size = max(span["size"] for span in spans)
+    if (
+        len(text) <= HEADING_MAX_CHARS
+        and body_size
+        and size >= body_size * HEADING_FONT_RATIO
+    ):
+        return HEADING
+    if len(text) <= BOLD_HEADING_MAX_CHARS and all(
+        span["flags"] & _BOLD_FLAG for span in spans
+    ):
+        return HEADING
+    return PARAGRAPH
+
+
+def _inside(bbox: "fitz.Rect", rect: "fitz.Rect") -> bool:
+    """文本块的大部分面积落在表格区域内"""
+    overlap = bbox & rect
+    return not overlap.is_empty and overlap.get_area() >= 0.5 * bbox.get_area()
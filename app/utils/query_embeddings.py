@@ -0,0 +1,125 @@
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+from app.config.index import settings
+from app.logging.logging import logger
+
+
+class BatchedQueryEmbeddings(Embeddings):
+    """为查询向量增加内存 LRU 缓存和微批合并的 Embeddings 包装器
+
+    相同的问题直接返回缓存的向量；未命中的查询在 QUERY_EMBEDDING_BATCH_WINDOW
+    毫秒内与其他并发请求合并，以一次批量请求发给向量模型，同一批次中的相同
+    文本只计算一次。文档向量化直接交给底层模型。
+    """
+
+    def __init__(self, underlying: Embeddings, model: str):
+        self.underlying = underlying
+        self.model = model
+        self.max_entries = settings.QUERY_EMBEDDING_CACHE_SIZE
+        self.batch_window = settings.QUERY_EMBEDDING_BATCH_WINDOW / 1000
+        self.max_batch_size = settings.QUERY_EMBEDDING_BATCH_SIZE
+        self._cache: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        # 等待合并发送的查询：文本 -> Future
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._tasks = set()
+        self.hits = 0
+        self.misses = 0
+        self.batches = 0
+
+    def _get_cached(self, text: str) -> Optional[List[float]]:
+        with self._cache_lock:
+            vector = self._cache.get(text)
+            if vector is None:
+                self.misses += 1
+                return None
+            self._cache.move_to_end(text)
+            self.hits += 1
+            return vector
+
+    def _put_cached(self, text: str, vector: List[float]):
+        if self.max_entries <= 0:
+            return
+        with self._cache_lock:
+            self._cache[text] = vector
+            self._cache.move_to_end(text)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.underlying.embed_documents(texts)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self.underlying.aembed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        vector = self._get_cached(text)
+        if vector is None:
+            vector = self.underlying.embed_query(text)
+            self._put_cached(text, vector)
+        return vector
+
+    async def aembed_query(self, text: str) -> List[float]:
+        vector = self._get_cached(text)
+        if vector is not None:
+            return vector
+
+        future = self._pending.get(text)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            # 所有等待方都已取消时避免出现未读取异常的警告
+            future.add_done_callback(lambda f: f.cancelled() or f.exception())
+            self._pending[text] = future
+            if len(self._pending) >= self.max_batch_size:
+                self._flush()
+            elif self._flush_handle is None:
+                self._flush_handle = loop.call_later(self.batch_window, self._flush)
+        # 共享的 Future 不随单个请求取消
+        return await asyncio.shield(future)
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        pending, self._pending = self._pending, {}
+        if pending:
+            task = asyncio.ensure_future(self._embed_batch(pending))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _embed_batch(self, pending: Dict[str, asyncio.Future]):
+        texts = list(pending)
+        try:
+            # 本地模型提供 aembed_queries，查询向量在当前进程中计算并加查询前缀
+            embed = getattr(self.underlying, "aembed_queries", None)
+            vectors = await (embed or self.underlying.aembed_documents)(texts)
+        except Exception as e:
+            logger.warning(f"批量计算 {len(texts)} 个查询向量失败: {str(e)}")
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.batches += 1
+        for text, vector in zip(texts, vectors):
+            self._put_cached(text, vector)
+            future = pending[text]
+            if not future.done():
+                future.set_result(vector)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "batches": self.batches,
+        }
@@ -1,5 +1,6 @@
 import json
 import redis
+import redis.asyncio as aioredis
 from app.config.index import settings
 
 
@@ -15,6 +16,7 @@ class RedisClient:
                 db=settings.REDIS_DB,
                 password=settings.REDIS_PASSWORD,
                 decode_responses=True,
+                max_connections=settings.REDIS_MAX_CONNECTIONS,
             )
         return cls._instance
 
@@ -28,3 +30,44 @@ class RedisClient:
         key = f"chat:history:{session_id}"
         history = self.client.get(key)
         return json.loads(history) if history else []
+
+    def save_summary(self, session_id: str, summary: dict):
+        """保存会话的滚动摘要"""
+        key = f"chat:summary:{session_id}"
+        self.client.set(key, json.dumps(summary, ensure_ascii=False), ex=settings.SESSION_TTL)
+
+    def get_summary(self, session_id: str) -> dict:
+        """获取会话的滚动摘要"""
+        key = f"chat:summary:{session_id}"
+        summary = self.client.get(key)
+        return json.loads(summary) if summary else {}
+
+
+class AsyncRedisClient:
+    """基于连接池的异步 Redis 客户端，供请求路径上的缓存使用"""
+
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(AsyncRedisClient, cls).__new__(cls)
+            cls._instance.pool = aioredis.ConnectionPool(
+                host=settings.REDIS_HOST,
+                port=settings.REDIS_PORT,
+                db=settings.REDIS_DB,
+                password=settings.REDIS_PASSWORD,
+                decode_responses=True,
+                max_connections=settings.REDIS_MAX_CONNECTIONS,
+                socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+                socket_connect_timeout=settings.REDIS_SOCKET_TIMEOUT,
+            )
+            cls._instance.client = aioredis.Redis(connection_pool=cls._instance.pool)
+        return cls._instance
+
+    @classmethod
+    async def close(cls):
+        """关闭连接池"""
+        if cls._instance is not None:
+            await cls._instance.client.aclose()
+            await cls._instance.pool.disconnect()
+            cls._instance = None
@@ -1,13 +1,41 @@
 import uvicorn
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from app.api.routes import router
 from app.logging.logging import logger
+from app.services.vector_store import VectorStoreRegistry
+from app.services.document_loader import DocumentLoader
+from app.services.embedding_provider import LocalEmbeddings
+from app.services.ingestion_jobs import IngestionJobManager
+from app.services.chat_history_writer import ChatHistoryWriter
+from app.config.index import settings
+from app.db.database import engine
+from app.utils.redis_client import AsyncRedisClient
 from fastapi.middleware.cors import CORSMiddleware
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 启动时加载默认知识库，其他知识库首次使用时加载，后续请求共享同一实例
+    VectorStoreRegistry().load()
+    IngestionJobManager().start()
+    if settings.CHAT_HISTORY_WRITE_BEHIND:
+        ChatHistoryWriter().start()
+    yield
+    await IngestionJobManager().stop()
+    # 先写完排队中的会话记录再关闭连接池
+    await ChatHistoryWriter().stop()
+    DocumentLoader.shutdown()
+    LocalEmbeddings.shutdown()
+    await engine.dispose()
+    await AsyncRedisClient.close()
+
+
 app = FastAPI(
     title="文档问答系统 API",
     description="基于 LangChain 和 OpenAI 的文档问答系统",
     version="1.0.0",
+    lifespan=lifespan,
 )
 # 配置 CORS
 origins = [
@@ -0,0 +1,53 @@
+import sys
+from pathlib import Path
+
+# 添加项目根目录到 Python 路径
+root_dir = Path(__file__).parent.parent
+sys.path.append(str(root_dir))
+
+from app.db.models.chat import Base
+from app.config.index import settings
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.schema import CreateColumn
+
+
+def migrate_db():
+    """为已有数据库补充模型中新增的表、列和索引，不删除任何数据
+
+    可重复执行：已存在的表、列和索引会被跳过。已有行的新增列为空，
+    例如 files.collection 为空的文件属于默认知识库。
+    """
+    engine = create_engine(settings.DATABASE_URL, pool_pre_ping=True, pool_recycle=3600)
+    with engine.begin() as connection:
+        inspector = inspect(connection)
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                table.create(bind=connection)
+                print(f"数据表 {table.name} 创建成功")
+                continue
+
+            existing_columns = {
+                column["name"] for column in inspector.get_columns(table.name)
+            }
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                ddl = CreateColumn(column).compile(dialect=engine.dialect)
+                connection.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {ddl}")
+                print(f"已为 {table.name} 表添加列 {column.name}")
+
+            existing_indexes = {
+                index["name"] for index in inspector.get_indexes(table.name)
+            }
+            for index in table.indexes:
+                if index.name in existing_indexes:
+                    continue
+                index.create(bind=connection)
+                print(f"已为 {table.name} 表添加索引 {index.name}")
+
+    engine.dispose()
+    print("数据库迁移完成")
+
+
+if __name__ == "__main__":
+    migrate_db()
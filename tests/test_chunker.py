@@ -0,0 +1,52 @@
+from app.utils.chunker import ChunkOptions, Chunker, TextBlock, split_sentences
+
+
+def test_split_sentences_latin():
+    assert split_sentences("Hello world. This is a test.") == [
+        "Hello world.",
+        " This is a test.",
+    ]
+
+
+def test_split_sentences_cjk():
+    assert split_sentences("今天天气很好。我们去公园吧！好吗？") == [
+        "今天天气很好。",
+        "我们去公园吧！",
+        "好吗？",
+    ]
+
+
+def test_split_sentences_mixed():
+    assert split_sentences("支持 PDF 格式. 也支持 Word。Done!") == [
+        "支持 PDF 格式.",
+        " 也支持 Word。",
+        "Done!",
+    ]
+
+
+def test_split_sentences_keeps_decimal_point():
+    assert split_sentences("版本 1.2 已发布。Pi is 3.14 today.") == [
+        "版本 1.2 已发布。",
+        "Pi is 3.14 today.",
+    ]
+
+
+def test_split_sentences_keeps_closing_quote():
+    assert split_sentences('He said "hi." Then left.') == [
+        'He said "hi."',
+        " Then left.",
+    ]
+
+
+def test_long_latin_paragraph_splits_on_sentences():
+    text = " ".join(f"Sentence number {i} is here." for i in range(200))
+    options = ChunkOptions(chunk_tokens=60, overlap_tokens=10, min_tokens=10)
+    chunks = Chunker(options).split_blocks([TextBlock(text)])
+
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert chunk.page_content.startswith("Sentence number")
+        assert chunk.page_content.endswith("is here.")
+    # 下一块以上一块末尾的句子开头
+    last_sentence = chunks[0].page_content.rsplit(". ", 1)[-1]
+    assert chunks[1].page_content.startswith(last_sentence.rstrip("."))